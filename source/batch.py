@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# 批量模式: 从文件或标准输入读取多条内容, 并发请求后按输入顺序输出
+# 日志和生词本在全部完成后一次性写入
+
+import sys
+import asyncio
+
+from prompts import Translator
+from engine import Session, TEMPERATURE, MAX_TOKENS
+from cache import Answer_Cache, make_key
+from log import log_messages, extract_word_data, save_words
+from metrics import Request_Trace, Metrics_Store
+from query_log import mode_name
+from router import Model_Router
+from templates import render_prompt
+from utils import Rate_Limiter, measure_time, CLEAN_SEQ, GREEN_DOT, RED_DOT
+
+def read_items(path: str) -> list:
+  """
+  读取批量输入, 每行一条, 忽略空行和 # 开头的注释行
+  :param path: 文件路径, "-" 表示标准输入
+  :return: 输入内容列表
+  """
+  if path == "-":
+    lines = sys.stdin.read().splitlines()
+  else:
+    with open(path, "r", encoding = "utf-8") as file:
+      lines = file.read().splitlines()
+  return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#")]
+
+def show_progress(done: int, total: int, failed: int) -> None:
+  """在标准错误输出中刷新进度, 不影响标准输出中的结果"""
+  sys.stderr.write(f"{CLEAN_SEQ}批量请求进度: {done}/{total} 失败: {failed}")
+  sys.stderr.flush()
+
+@measure_time
+async def run_batch(session: Session,
+                    items: list,
+                    prompt_type,
+                    concurrency: int = 4,
+                    rps: float = 2.0,
+                    use_cache: bool = True,
+                    refresh: bool = False,
+                    model: str = None) -> list:
+  """
+  并发处理多条输入, 按输入顺序输出结果
+  :param session: 请求会话
+  :param items: 输入内容列表
+  :param prompt_type: 提示词类型
+  :param concurrency: 最多同时进行的请求数
+  :param rps: 每秒最多发出的请求数, 小于等于 0 表示不限制
+  :param use_cache: 是否使用缓存
+  :param refresh: 忽略已有缓存重新请求
+  :param model: 指定使用的模型, 为 None 时每条请求分别按批量模式的规则选择(见 router.py)
+  :return: 每条输入对应的 (回答内容, 使用的token数, 请求时间), 失败时回答为空
+  """
+  cache = Answer_Cache() if use_cache else None
+  router = Model_Router()
+  mode = mode_name(prompt_type)
+  limiter = Rate_Limiter(rps)
+  semaphore = asyncio.Semaphore(max(1, concurrency))
+  total = len(items)
+  progress = {"done": 0, "failed": 0}
+  traces = []
+
+  async def work(input_text: str) -> tuple:
+    route = router.choose(mode, model, batch = True)
+    key = make_key(prompt_type, input_text, route.model, TEMPERATURE, MAX_TOKENS)
+    if cache is not None and not refresh:
+      record = cache.get(key)
+      if record is not None:
+        return record["answer"], 0, record.get("request_time"), True, route.model
+    trace = Request_Trace(mode, route.model)
+    traces.append(trace)
+    async with semaphore:
+      await limiter.acquire()
+      try:
+        reply = await session.complete(render_prompt(prompt_type, input_text), model = route.model)
+      except Exception:
+        trace.ok = False
+        raise
+    trace.from_reply(reply)
+    if cache is not None and reply.answer and not trace.truncated:
+      cache.put(key, {"answer": reply.answer, "tokens_used": reply.tokens_used, "request_time": reply.request_time, "model": route.model})
+    return reply.answer, reply.tokens_used, reply.request_time, False, route.model
+
+  def on_done(task) -> None:
+    progress["done"] += 1
+    if task.cancelled() or task.exception() is not None:
+      progress["failed"] += 1
+    show_progress(progress["done"], total, progress["failed"])
+
+  results = []
+  log_entries = []
+  word_records = []
+  total_tokens = 0
+  tasks = [asyncio.create_task(work(item)) for item in items]
+  for task in tasks:
+    task.add_done_callback(on_done)
+  try:
+    # 按输入顺序等待, 前面的结果完成后立即输出, 不必等全部完成
+    for index, (item, task) in enumerate(zip(items, tasks), start = 1):
+      try:
+        answer, tokens_used, request_time, cached, model_used = await task
+      except Exception as e:
+        answer, tokens_used, request_time, cached = "", 0, None, False
+        log_entries.append((item, f"请求失败: {e}", prompt_type))
+        print(f"{CLEAN_SEQ}{RED_DOT} [{index}/{total}] {item}\n请求失败: {e}\n", flush = True)
+      else:
+        total_tokens += tokens_used
+        mark = "(缓存) " if cached else ""
+        print(f"{CLEAN_SEQ}{GREEN_DOT} [{index}/{total}] {mark}{item}\n{answer}\n", flush = True)
+        if not cached:
+          log_entries.append((item, answer, prompt_type, model_used))
+          if prompt_type == Translator.explain_word:
+            word_data = extract_word_data(item, answer, request_time)
+            if word_data is not None:
+              word_records.append(word_data)
+      results.append((answer, tokens_used, request_time))
+  finally:
+    # 中断时取消剩余的请求
+    for task in tasks:
+      task.cancel()
+
+  sys.stderr.write(CLEAN_SEQ)
+  print(f"完成 {total} 条, 失败 {progress['failed']} 条 || 使用的token数: {total_tokens}")
+  # 全部完成后一次性写入日志和生词本
+  if log_entries:
+    log_messages(log_entries)
+  if word_records:
+    save_words(word_records)
+    print(f"{len(word_records)} 条单词记录已提交, 在后台写入生词本")
+  # 被取消的请求没有完整的耗时, 不记录
+  Metrics_Store().append([trace.record() for trace in traces if not trace.ok or "total" in trace.spans])
+  return results
@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+
+# 性能检查和基准测试
+# 用法:
+#   python bench.py startup [--budget 100]     检查入口文件的导入耗时
+#   python bench.py e2e [--runs 10]            命令行端到端耗时
+#   python bench.py render                     流式输出渲染的开销
+#   python bench.py persist [--sizes 0 1000 10000]  写入日志和生词本的耗时与已有记录数的关系
+#   python bench.py batch [--items 50]         批量模式的吞吐量
+#   python bench.py pack [--items 40]         打包请求与逐条请求的请求次数、提示词 token 数和耗时
+#   python bench.py prefix [--runs 10]        模板"固定前缀 + 输入内容"与"输入内容在前"两种结构的提示词缓存命中率和首字延迟
+#   python bench.py auto [--corpus FILE]      自动选择模式的准确率和耗时, 默认使用 auto_corpus.tsv
+#   python bench.py fuzzy [--entries 100000]  已有大量记录时查找相似问题的耗时和命中情况, 以及拼写相近的不同单词是否被误认为同一个
+#   python bench.py words [--fuzz 200]        单词解释的解析: 语料识别率, 随机分段和随机改动时增量解析与一次性解析是否一致, 以及耗时
+#   python bench.py all [--output result.json] 运行以上全部基准测试
+# 除 startup 外, 请求都发往 mock_server.py 在本地模拟的接口, 数据写入临时目录, 不会影响真实的日志和生词本
+# 结果以 JSON 格式输出到标准输出, 可以保存下来与其他版本比较; startup 检查不通过或 fuzzy 中不同的单词复用了彼此的回答时
+# 返回非零退出码, 可以直接在 CI 中使用
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# ds -h 和命中缓存的路径上不应该出现的模块
+HEAVY_MODULES = ("openai", "asyncio", "requests", "tzlocal", "zoneinfo", "ssl")
+# 入口文件的导入耗时预算(毫秒), tests/test_startup.py 使用同一个值
+STARTUP_BUDGET_MS = 100.0
+
+def parse_importtime(output: str) -> list:
+  """
+  解析 python -X importtime 的输出
+  :return: (模块名, 自身耗时微秒, 累计耗时微秒, 层级) 组成的列表
+  """
+  rows = []
+  for line in output.splitlines():
+    if not line.startswith("import time:") or "|" not in line:
+      continue
+    try:
+      self_us, cumulative_us, name = line[len("import time:"):].split("|")
+      rows.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip())) // 2))
+    except ValueError:
+      continue # 表头
+  return rows
+
+def measure_import(module: str = "main", repeat: int = 5) -> dict:
+  """
+  在子进程中测量导入模块的耗时, 取多次中的最小值以减少噪声
+  :return: 耗时(毫秒)以及导入了哪些重量级模块
+  """
+  best = None
+  for _ in range(repeat):
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+      [sys.executable, "-X", "importtime", "-c", code],
+      cwd = SOURCE_DIR, capture_output = True, text = True
+    )
+    if result.returncode != 0:
+      raise RuntimeError(result.stderr)
+    rows = parse_importtime(result.stderr)
+    total = sum(row[2] for row in rows if row[3] == 0)
+    loaded = set(result.stdout.split())
+    sample = {
+      "module": module,
+      "import_ms": round(total / 1000, 2),
+      "heavy_modules": sorted(name for name in HEAVY_MODULES if name in loaded),
+      "slowest": [
+        {"module": name, "cumulative_ms": round(cumulative / 1000, 2)}
+        for name, _, cumulative, level in sorted(rows, key = lambda row: -row[2]) if level == 1
+      ][:5]
+    }
+    if best is None or sample["import_ms"] < best["import_ms"]:
+      best = sample
+  return best
+
+def check_startup(budget_ms: float = STARTUP_BUDGET_MS) -> dict:
+  """
+  检查入口文件的导入耗时是否在预算之内, 并且没有导入重量级模块
+  """
+  result = measure_import("main")
+  result["budget_ms"] = budget_ms
+  result["passed"] = result["import_ms"] <= budget_ms and not result["heavy_modules"]
+  return result
+
+def _summary(samples: list) -> dict:
+  """毫秒数列表的统计值"""
+  samples = sorted(samples)
+  if not samples:
+    return {}
+  return {
+    "min_ms": round(samples[0], 2),
+    "p50_ms": round(samples[len(samples) // 2], 2),
+    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+    "max_ms": round(samples[-1], 2),
+    "runs": len(samples)
+  }
+
+@contextlib.contextmanager
+def _mock_server(**kwargs):
+  """在后台线程中启动模拟接口"""
+  from mock_server import Mock_Server
+  server = Mock_Server(**kwargs)
+  server.start_in_thread()
+  try:
+    yield server
+  finally:
+    server.stop()
+
+def bench_e2e(runs: int = 10, ttft: float = 0.05, rate: float = 0.0) -> dict:
+  """
+  多次运行 ds -w, 统计从启动进程到进程退出的耗时
+  模拟接口的首字延迟和输出速度是固定的, 减去之后即为本程序自身的开销
+  """
+  result = {"ttft_s": ttft, "rate": rate}
+  with _mock_server(ttft = ttft, rate = rate) as server, tempfile.TemporaryDirectory() as data_dir:
+    env = dict(os.environ, DS_BASE_URL = server.base_url, DS_DATA_DIR = data_dir, DEEPSEEK_API_KEY = "mock")
+    for typewriter in (True, False):
+      command = [sys.executable, "main.py", "--no-daemon", "--no-cache", "-w", "serendipity"]
+      if not typewriter:
+        command.append("--no-typewriter")
+      samples = []
+      for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd = SOURCE_DIR, env = env, capture_output = True, text = True)
+        samples.append((time.perf_counter() - start) * 1000)
+        if completed.returncode != 0:
+          raise RuntimeError(completed.stderr)
+      server_ms = ttft * 1000 + (len(server.answer_chunks("最接近的中文解释")) / rate * 1000 if rate > 0 else 0)
+      summary = _summary(samples)
+      summary["overhead_p50_ms"] = round(summary["p50_ms"] - server_ms, 2)
+      result["typewriter" if typewriter else "raw"] = summary
+    # 子进程写入的各阶段耗时, 见 metrics.py
+    from metrics import Metrics_Store, summarize, percentile
+    groups = summarize(Metrics_Store(os.path.join(data_dir, "metrics.jsonl")).records())
+    result["phases_p50_ms"] = {
+      phase: round(percentile(values, 0.5), 2)
+      for group in groups.values() for phase, values in group["phases"].items()
+    }
+  return result
+
+def bench_render(chunks: int = 400, interval: float = 0.005) -> dict:
+  """
+  以固定间隔向 Stream_Renderer 输入内容, 输出到内存中
+  统计渲染占用的 CPU 时间和网络结束到显示完毕的延迟
+  """
+  import asyncio
+  from render import Stream_Renderer
+
+  async def run(typewriter: bool) -> dict:
+    out = io.StringIO()
+    renderer = Stream_Renderer(typewriter = typewriter, out = out)
+    task = asyncio.create_task(renderer.run())
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for index in range(chunks):
+      renderer.feed(f"第{index}段内容 chunk {index} ")
+      await asyncio.sleep(interval)
+    renderer.close()
+    await task
+    return {
+      "wall_ms": round((time.perf_counter() - start) * 1000, 2),
+      "cpu_ms": round((time.process_time() - cpu_start) * 1000, 2),
+      "display_lag_ms": round(renderer.display_lag * 1000, 3),
+      "chars": len(out.getvalue())
+    }
+
+  return {
+    "chunks": chunks,
+    "interval_ms": interval * 1000,
+    "typewriter": asyncio.run(run(True)),
+    "raw": asyncio.run(run(False))
+  }
+
+def bench_persist(sizes: list = (0, 1000, 10000), repeat: int = 20) -> dict:
+  """
+  已有不同数量的记录时, 追加一条记录的耗时
+  append_dict_to_json 每次都重写整个文件, 作为对照; Word_Book 和 write_log_records 只追加
+  log_message 只写入预写日志, 由后台线程写入(见 persist.py), background_flush 为之后等待后台全部写完的耗时
+  """
+  from utils import append_dict_to_json, write_json_atomic
+  from word_book import Word_Book
+  from query_log import Query_Log
+  from search import Search_Index
+  from log import log_message, write_log_records
+  from persist import flush
+
+  word = {"word": "serendipity", "closest_chinese": "意外发现珍宝的运气", "slang_or_usage": "-", "context": "-", "example": "-", "time": "2026-10-01 10:00:00"}
+  result = {}
+  for size in sizes:
+    with tempfile.TemporaryDirectory() as data_dir:
+      json_file = os.path.join(data_dir, "word_data.json")
+      write_json_atomic(json_file, [word] * size)
+      book = Word_Book(os.path.join(data_dir, "book.json"))
+      book.extend([word] * size)
+      log_dir = os.path.join(data_dir, "log")
+      record = {"ts": time.time(), "time": "2026-10-01 10:00:00", "mode": "explain_word", "question": "serendipity", "answer": "意外发现珍宝的运气 " * 20}
+      Query_Log(log_dir, legacy_file = None).append([record] * size)
+      with Search_Index() as index: # DS_DATA_DIR 已指向临时目录
+        index.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '0')")
+        index.add([record] * size)
+
+      samples = {"append_dict_to_json": [], "word_book_append": [], "write_log_records": [], "log_message": []}
+      with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+          start = time.perf_counter()
+          append_dict_to_json(json_file, word)
+          samples["append_dict_to_json"].append((time.perf_counter() - start) * 1000)
+          start = time.perf_counter()
+          book.append(word)
+          samples["word_book_append"].append((time.perf_counter() - start) * 1000)
+          start = time.perf_counter()
+          write_log_records([record], log_dir)
+          samples["write_log_records"].append((time.perf_counter() - start) * 1000)
+          start = time.perf_counter()
+          log_message("serendipity", record["answer"], "Translator.explain_word", log_dir)
+          samples["log_message"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        flush()
+        background_flush = (time.perf_counter() - start) * 1000
+    result[str(size)] = {name: _summary(values) for name, values in samples.items()}
+    result[str(size)]["background_flush_ms"] = round(background_flush, 2)
+  return result
+
+def bench_batch(items: int = 50, concurrency: int = 8, ttft: float = 0.05, rate: float = 200.0) -> dict:
+  """批量模式的吞吐量, 不限制每秒请求数"""
+  import asyncio
+  from engine import Session
+  from batch import run_batch
+  from prompts import Translator
+
+  async def run(base_url: str) -> float:
+    async with Session(base_url = base_url, api_key = "mock") as session:
+      start = time.perf_counter()
+      await run_batch(session, [f"word{index}" for index in range(items)], Translator.explain_word,
+                      concurrency, 0, use_cache = False)
+      return time.perf_counter() - start
+
+  with _mock_server(ttft = ttft, rate = rate) as server:
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+      elapsed = asyncio.run(run(server.base_url))
+    failures = server.failures
+  return {
+    "items": items,
+    "concurrency": concurrency,
+    "elapsed_s": round(elapsed, 3),
+    "items_per_s": round(items / elapsed, 2),
+    "server_failures": failures
+  }
+
+def bench_pack(items: int = 40, pack_size: int = 8, concurrency: int = 4, ttft: float = 0.05, rate: float = 200.0) -> dict:
+  """同样的单词分别逐条请求和打包请求, 比较请求次数、发送的提示词 token 数和总耗时"""
+  import asyncio
+  from engine import Session
+  from batch import run_batch
+  from pack import run_packed
+  from prompts import Translator
+
+  words = [f"word{index}" for index in range(items)]
+
+  async def run(base_url: str, packed: bool) -> tuple:
+    async with Session(base_url = base_url, api_key = "mock") as session:
+      start = time.perf_counter()
+      if packed:
+        results = await run_packed(session, words, Translator.explain_word, pack_size, concurrency, 0, use_cache = False)
+      else:
+        results = await run_batch(session, words, Translator.explain_word, concurrency, 0, use_cache = False)
+      return time.perf_counter() - start, sum(1 for answer, _, _ in results if answer)
+
+  result = {"items": items, "pack_size": pack_size, "concurrency": concurrency}
+  for name, packed in (("single", False), ("packed", True)):
+    with _mock_server(ttft = ttft, rate = rate) as server:
+      with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        elapsed, answered = asyncio.run(run(server.base_url, packed))
+      result[name] = {
+        "requests": server.requests,
+        "prompt_tokens": server.prompt_tokens,
+        "elapsed_s": round(elapsed, 3),
+        "answered": answered
+      }
+  result["prompt_token_ratio"] = round(result["packed"]["prompt_tokens"] / max(1, result["single"]["prompt_tokens"]), 3)
+  return result
+
+def bench_prefix(runs: int = 10, ttft: float = 0.02, prefill_rate: float = 1000.0) -> dict:
+  """
+  对每个内置模板用不同的输入各请求若干次, 比较两种结构的提示词缓存命中率和首字延迟:
+    prefix_first  当前的结构, 固定前缀 + 输入内容
+    text_first    输入内容在前, 相当于修改之前 explain_sentence 等模板的结构
+  模拟接口按未命中缓存的 token 数增加首字延迟
+  """
+  import asyncio
+  from engine import Session
+  from templates import builtin_templates
+
+  async def run(base_url: str, layout: str, template) -> list:
+    samples = []
+    async with Session(base_url = base_url, api_key = "mock") as session:
+      for index in range(runs):
+        text = f"sample input number {index}"
+        prompt = template.render(text) if layout == "prefix_first" else f"{text}\n\n{template.prefix}"
+        reply = await session.complete(prompt)
+        hit, miss = reply.prompt_cache or (0, 0)
+        samples.append((hit, miss, (reply.first_token_at - reply.sent_at) * 1000))
+    return samples
+
+  result = {"runs": runs, "prefill_rate": prefill_rate}
+  for layout in ("prefix_first", "text_first"):
+    modes = {}
+    for name, template in builtin_templates().items():
+      # 每个模板使用新的模拟接口, 缓存从空开始
+      with _mock_server(ttft = ttft, rate = 0, prefill_rate = prefill_rate) as server:
+        samples = asyncio.run(run(server.base_url, layout, template))
+      hit = sum(sample[0] for sample in samples)
+      total = hit + sum(sample[1] for sample in samples)
+      modes[name] = {"cache_hit_rate": round(hit / total, 3) if total else 0.0, "ttft": _summary([sample[2] for sample in samples])}
+    result[layout] = modes
+  return result
+
+def bench_tail(runs: int = 200, concurrency: int = 10, ttft: float = 0.05, stall_rate: float = 0.05, stall: float = 2.0) -> dict:
+  """
+  模拟接口中一部分请求卡住, 比较三种策略的首字延迟分布:
+    none   不重试也不对冲, 卡住的请求要等 stall 秒
+    retry  首字超时后重试, 首字超时设为 ttft 的 10 倍
+    hedge  超过 ttft 的 4 倍(相当于 router 根据 p95 计算的等待时间)还没有内容时发出对冲请求
+  """
+  import asyncio
+  from engine import Session
+  from resilience import Retry_Policy
+
+  strategies = {
+    "none": (Retry_Policy(max_retries = 0, first_token_timeout = None), None),
+    "retry": (Retry_Policy(max_retries = 2, base_delay = 0.0, first_token_timeout = ttft * 10, seed = 0), None),
+    "hedge": (Retry_Policy(max_retries = 2, base_delay = 0.0, first_token_timeout = ttft * 10, seed = 0), ttft * 4)
+  }
+
+  async def run(base_url: str, policy, hedge_after) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with Session(base_url = base_url, api_key = "mock", retry = policy, timeout = stall * 2) as session:
+      async def one(index: int):
+        async with semaphore:
+          reply = await session.stream(f"sample {index}", hedge_after = hedge_after)
+          return (reply.first_token_at - reply.sent_at) * 1000, reply.retries, reply.hedged
+      return await asyncio.gather(*(one(index) for index in range(runs)))
+
+  result = {"runs": runs, "ttft_s": ttft, "stall_rate": stall_rate, "stall_s": stall}
+  for name, (policy, hedge_after) in strategies.items():
+    # 每种策略使用相同的随机数种子, 卡住的请求比例相同
+    with _mock_server(ttft = ttft, rate = 0, stall_rate = stall_rate, stall = stall, seed = 0) as server:
+      samples = asyncio.run(run(server.base_url, policy, hedge_after))
+      requests = server.requests
+    summary = _summary([sample[0] for sample in samples])
+    sorted_samples = sorted(sample[0] for sample in samples)
+    summary["p99_ms"] = round(sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * 0.99))], 2)
+    summary["retries"] = sum(sample[1] for sample in samples)
+    summary["hedged"] = sum(1 for sample in samples if sample[2])
+    summary["extra_requests"] = requests - runs
+    result[name] = summary
+  return result
+
+def read_corpus(path: str) -> list:
+  """
+  读取标注语料, 每行为 期望的模式<TAB>输入内容[<TAB>known]
+  :return: (模式, 输入内容, 是否在生词本中) 组成的列表
+  """
+  samples = []
+  with open(path, "r", encoding = "utf-8") as file:
+    for line in file:
+      if not line.strip() or line.startswith("#"):
+        continue
+      label, text, *flags = line.rstrip("\n").split("\t")
+      samples.append((label, text, "known" in flags))
+  return samples
+
+def bench_auto(corpus: str = None, repeat: int = 200) -> dict:
+  """自动选择模式的准确率, 每个模式的召回率, 分错的样本, 以及每次判断的耗时"""
+  from cli import MODES
+  from classifier import classify
+  names = {prompt_type: name for name, prompt_type in MODES.items()}
+  samples = read_corpus(corpus or os.path.join(SOURCE_DIR, "auto_corpus.tsv"))
+  known = {text.lower() for _, text, flag in samples if flag}
+
+  def known_word(text: str) -> bool:
+    return text.lower() in known
+
+  per_mode = {}
+  errors = []
+  for label, text, _ in samples:
+    result = classify(text, known_word)
+    predicted = names[result.prompt_type]
+    stats = per_mode.setdefault(label, {"total": 0, "correct": 0})
+    stats["total"] += 1
+    if predicted == label:
+      stats["correct"] += 1
+    else:
+      errors.append({"text": text[:60], "expected": label, "predicted": predicted, "reason": result.reason})
+  start = time.perf_counter()
+  for _ in range(repeat):
+    for _, text, _ in samples:
+      classify(text, known_word)
+  per_call_us = (time.perf_counter() - start) / (repeat * len(samples)) * 1e6
+  correct = sum(stats["correct"] for stats in per_mode.values())
+  return {
+    "samples": len(samples),
+    "accuracy": round(correct / len(samples), 4),
+    "recall": {label: round(stats["correct"] / stats["total"], 3) for label, stats in sorted(per_mode.items())},
+    "per_call_us": round(per_call_us, 2),
+    "errors": errors
+  }
+
+# 拼写相近但意思不同的单词, 一个记录在索引中时查询另一个不能命中
+COLLIDING_WORDS = [
+  ("plan", "plane"), ("hop", "hope"), ("car", "care"), ("not", "note"), ("unit", "unite"), ("unit", "united"),
+  ("even", "evening"), ("morn", "morning"), ("wick", "wicked"), ("wed", "wedding"), ("crook", "crooked"), ("ceil", "ceiling"),
+  ("we're", "were"), ("he'll", "hell"), ("we'll", "well"), ("it's", "its")
+]
+# 同一个单词的不同词形, 互相查询应该命中
+INFLECTED_WORDS = [
+  ("run", "runs"), ("run", "running"), ("cat", "cats"), ("study", "studied"), ("make", "making"), ("hope", "hoping"),
+  ("box", "boxes"), ("walk", "walked")
+]
+
+def bench_fuzzy(entries: int = 100000, queries: int = 300) -> dict:
+  """
+  相似问题索引中已有 entries 条记录时, 三类查询的耗时和是否命中:
+  exact 只有大小写和标点不同, near 有一处拼写差异, miss 是没有出现过的句子
+  另外检查单词的复用: collisions 是 COLLIDING_WORDS 中每一对单词互相查询, 命中率必须为 0;
+  inflections 是 INFLECTED_WORDS 中同一个单词的不同词形互相查询的命中率
+  """
+  import random
+  from similar import Similar_Index
+
+  rng = random.Random(0)
+  vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+
+  def sentence() -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(6, 12)))
+
+  def typo(text: str) -> str:
+    position = rng.randrange(len(text))
+    return text[:position] + rng.choice("abcdefghijklmnopqrstuvwxyz") + text[position + 1:]
+
+  with tempfile.TemporaryDirectory() as data_dir:
+    questions = [sentence() for _ in range(entries)]
+    with Similar_Index(os.path.join(data_dir, "similar.db")) as index:
+      start = time.perf_counter()
+      index.add([{"ts": 0.0, "time": "2026-10-01 10:00:00", "mode": "explain_sentence", "question": question, "answer": "-"}
+                 for question in questions])
+      build_s = time.perf_counter() - start
+      cases = {
+        "exact": [question.upper() + "?" for question in rng.sample(questions, queries)],
+        "near": [typo(question) for question in rng.sample(questions, queries)],
+        "miss": [sentence() for _ in range(queries)]
+      }
+      result = {"entries": entries, "build_s": round(build_s, 2)}
+      for name, texts in cases.items():
+        samples, hits = [], 0
+        for text in texts:
+          start = time.perf_counter()
+          hits += index.find("explain_sentence", text) is not None
+          samples.append((time.perf_counter() - start) * 1000)
+        result[name] = dict(_summary(samples), hit_rate = round(hits / len(texts), 3))
+
+    def word_pairs(name: str, pairs: list) -> tuple:
+      """每一对单词各自单独建一个索引, 记录一个查询另一个, 两个方向都查; 返回命中率和命中的查询"""
+      hits = []
+      for number, pair in enumerate(pairs):
+        for direction, (stored, query) in enumerate((pair, pair[::-1])):
+          with Similar_Index(os.path.join(data_dir, f"{name}-{number}-{direction}.db")) as index:
+            index.add([{"ts": 0.0, "time": "2026-10-01 10:00:00", "mode": "explain_word", "question": stored, "answer": "-"}])
+            if index.find("explain_word", query) is not None:
+              hits.append(f"{query} -> {stored}")
+      return round(len(hits) / (len(pairs) * 2), 3), hits
+
+    hit_rate, wrong = word_pairs("collisions", COLLIDING_WORDS)
+    result["collisions"] = {"queries": len(COLLIDING_WORDS) * 2, "hit_rate": hit_rate, "wrong": wrong, "passed": not wrong}
+    hit_rate, _ = word_pairs("inflections", INFLECTED_WORDS)
+    result["inflections"] = {"queries": len(INFLECTED_WORDS) * 2, "hit_rate": hit_rate}
+  return result
+
+# 旧版 log.WORD_PATTERN, 作为识别率的对照
+LEGACY_WORD_PATTERN = (
+  r"最接近的中文解释:\s*(?P<ans1>.+?)\s*"
+  r"作为俚语或日常用法:\s*(?P<ans2>.+?)\s*"
+  r"常用语境:\s*(?P<ans3>.+?)\s*"
+  r"造句:\s*(?P<ans4>.+?)(?:\n|$)"
+)
+
+def read_word_corpus(path: str) -> list:
+  """读取单词解释的语料, 每行一条 JSON, 忽略 # 开头的注释行"""
+  with open(path, "r", encoding = "utf-8") as file:
+    return [json.loads(line) for line in file if line.strip() and not line.startswith("#")]
+
+def random_chunks(text: str, rng) -> list:
+  """把回答随机切成 1 到 8 个字符的片段, 模拟流式传输"""
+  chunks = []
+  position = 0
+  while position < len(text):
+    size = rng.randint(1, 8)
+    chunks.append(text[position:position + size])
+    position += size
+  return chunks
+
+def mutate(text: str, rng) -> str:
+  """随机改动回答: 删除、重复或插入换行、冒号、星号等容易影响解析的字符"""
+  chars = list(text)
+  for _ in range(rng.randint(1, 6)):
+    position = rng.randrange(len(chars) + 1)
+    operation = rng.random()
+    if operation < 0.3 and position < len(chars):
+      del chars[position]
+    elif operation < 0.5 and position < len(chars):
+      chars.insert(position, chars[position])
+    else:
+      chars.insert(position, rng.choice(["\n", ":", "：", "**", " ", "\n\n", "1. ", "造句:"]))
+  return "".join(chars)
+
+def bench_words(corpus: str = None, fuzz: int = 200, repeat: int = 200) -> dict:
+  """
+  单词解释的解析
+  - 语料中每条回答的字段是否与期望一致, 与旧版正则的识别率对比
+  - 随机分段、随机改动之后, 增量解析的结果是否与一次性解析完全一致, 是否抛出异常
+  - 每段内容的解析耗时, 以及回答结束到生词本记录准备好的耗时
+  """
+  import re
+  import random
+  from word_parser import Word_Parser, parse_word, WORD_FIELDS
+
+  samples = read_word_corpus(corpus or os.path.join(SOURCE_DIR, "word_corpus.jsonl"))
+  legacy = re.compile(LEGACY_WORD_PATTERN, re.S)
+  rng = random.Random(0)
+  result = {"samples": len(samples), "legacy_matched": 0, "complete": 0, "partial": 0, "none": 0, "correct": 0, "errors": []}
+  for sample in samples:
+    result["legacy_matched"] += legacy.search(sample["answer"]) is not None
+    fields = parse_word(sample["answer"]).fields
+    found = sum(1 for field in WORD_FIELDS if fields.get(field))
+    result["complete" if found == len(WORD_FIELDS) else "partial" if found else "none"] += 1
+    if fields == sample["expect"]:
+      result["correct"] += 1
+    else:
+      result["errors"].append({"word": sample["word"], "note": sample["note"], "got": fields, "expected": sample["expect"]})
+
+  # 随机分段和随机改动: 增量解析必须与一次性解析得到相同的结果
+  mismatches, exceptions, runs = [], 0, 0
+  for sample in samples:
+    for index in range(fuzz):
+      text = sample["answer"] if index % 2 == 0 else mutate(sample["answer"], rng)
+      runs += 1
+      try:
+        expected = parse_word(text).fields
+        parser = Word_Parser()
+        for chunk in random_chunks(text, rng):
+          parser.feed(chunk)
+        if parser.close() != expected:
+          mismatches.append({"word": sample["word"], "text": text[:80]})
+      except Exception as e:
+        exceptions += 1
+        mismatches.append({"word": sample["word"], "text": text[:80], "exception": repr(e)})
+  result["fuzz"] = {"runs": runs, "mismatches": len(mismatches), "exceptions": exceptions, "examples": mismatches[:5]}
+
+  # 耗时: 流式传输时每段的解析开销, 结束时确定最后一个字段的开销, 以及旧版在结束后匹配整段回答的开销
+  streams = [(sample["answer"], random_chunks(sample["answer"], rng)) for sample in samples]
+  feed_time, close_time, chunk_count = 0.0, 0.0, 0
+  for _ in range(repeat):
+    for _, chunks in streams:
+      parser = Word_Parser()
+      start = time.perf_counter()
+      for chunk in chunks:
+        parser.feed(chunk)
+      middle = time.perf_counter()
+      parser.close()
+      feed_time += middle - start
+      close_time += time.perf_counter() - middle
+      chunk_count += len(chunks)
+  start = time.perf_counter()
+  for _ in range(repeat):
+    for answer, _ in streams:
+      legacy.search(answer)
+  legacy_time = time.perf_counter() - start
+  runs = repeat * len(streams)
+  result["per_chunk_us"] = round(feed_time / chunk_count * 1e6, 2)
+  result["close_us"] = round(close_time / runs * 1e6, 2)
+  result["legacy_after_stream_us"] = round(legacy_time / runs * 1e6, 2)
+  return result
+
+def environment() -> dict:
+  """记录运行环境和版本, 便于比较不同版本的结果"""
+  try:
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = SOURCE_DIR,
+                            capture_output = True, text = True).stdout.strip() or None
+  except OSError:
+    commit = None
+  return {
+    "commit": commit,
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "time": time.strftime("%Y-%m-%d %H:%M:%S")
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description = "ds 性能检查")
+  sub = parser.add_subparsers(dest = "command", required = True)
+  startup = sub.add_parser("startup", help = "检查入口文件的导入耗时")
+  startup.add_argument("--budget", type = float, default = STARTUP_BUDGET_MS, help = f"导入耗时预算(毫秒), 默认为 {STARTUP_BUDGET_MS:g}")
+  e2e = sub.add_parser("e2e", help = "命令行端到端耗时")
+  e2e.add_argument("--runs", type = int, default = 10)
+  e2e.add_argument("--ttft", type = float, default = 0.05, help = "模拟接口的首字延迟(秒)")
+  e2e.add_argument("--rate", type = float, default = 0.0, help = "模拟接口每秒发出的 token 数, 0 表示不限制")
+  render = sub.add_parser("render", help = "流式输出渲染的开销")
+  render.add_argument("--chunks", type = int, default = 400)
+  render.add_argument("--interval", type = float, default = 0.005, help = "输入间隔(秒)")
+  persist = sub.add_parser("persist", help = "写入日志和生词本的耗时")
+  persist.add_argument("--sizes", type = int, nargs = "+", default = [0, 1000, 10000], help = "已有的记录数")
+  persist.add_argument("--repeat", type = int, default = 20)
+  batch = sub.add_parser("batch", help = "批量模式的吞吐量")
+  batch.add_argument("--items", type = int, default = 50)
+  batch.add_argument("--concurrency", type = int, default = 8)
+  pack = sub.add_parser("pack", help = "打包请求与逐条请求的比较")
+  pack.add_argument("--items", type = int, default = 40)
+  pack.add_argument("--pack-size", type = int, default = 8)
+  prefix = sub.add_parser("prefix", help = "模板结构对提示词缓存的影响")
+  prefix.add_argument("--runs", type = int, default = 10)
+  auto = sub.add_parser("auto", help = "自动选择模式的准确率和耗时")
+  auto.add_argument("--corpus", metavar = "FILE", help = "标注语料, 默认为 auto_corpus.tsv")
+  fuzzy = sub.add_parser("fuzzy", help = "查找相似问题的耗时和命中情况")
+  fuzzy.add_argument("--entries", type = int, default = 100000, help = "索引中已有的记录数")
+  words = sub.add_parser("words", help = "单词解释的解析识别率、随机分段时的一致性和耗时")
+  words.add_argument("--corpus", metavar = "FILE", help = "语料, 默认为 word_corpus.jsonl")
+  words.add_argument("--fuzz", type = int, default = 200, help = "每条语料随机分段和随机改动的次数")
+  tail = sub.add_parser("tail", help = "重试和对冲请求对长尾延迟的影响")
+  tail.add_argument("--runs", type = int, default = 200)
+  tail.add_argument("--stall-rate", type = float, default = 0.05, help = "模拟接口中请求卡住的概率")
+  everything = sub.add_parser("all", help = "运行全部基准测试")
+  for command in (e2e, render, persist, batch, pack, prefix, auto, fuzzy, words, tail, everything):
+    command.add_argument("--output", metavar = "FILE", help = "同时把结果写入文件")
+  args = parser.parse_args()
+
+  if args.command == "startup":
+    result = check_startup(args.budget)
+    print(json.dumps(result, ensure_ascii = False, indent = 2))
+    sys.exit(0 if result["passed"] else 1)
+
+  with tempfile.TemporaryDirectory() as data_dir:
+    # 在导入 config 之前设置, 基准测试写入的日志、缓存和指标都放在临时目录中
+    os.environ["DS_DATA_DIR"] = data_dir
+    results = {}
+    if args.command in ("e2e", "all"):
+      results["e2e"] = bench_e2e(**({"runs": args.runs, "ttft": args.ttft, "rate": args.rate} if args.command == "e2e" else {}))
+    if args.command in ("render", "all"):
+      results["render"] = bench_render(**({"chunks": args.chunks, "interval": args.interval} if args.command == "render" else {}))
+    if args.command in ("persist", "all"):
+      results["persist"] = bench_persist(**({"sizes": args.sizes, "repeat": args.repeat} if args.command == "persist" else {}))
+    if args.command in ("batch", "all"):
+      results["batch"] = bench_batch(**({"items": args.items, "concurrency": args.concurrency} if args.command == "batch" else {}))
+    if args.command in ("pack", "all"):
+      results["pack"] = bench_pack(**({"items": args.items, "pack_size": args.pack_size} if args.command == "pack" else {}))
+    if args.command in ("prefix", "all"):
+      results["prefix"] = bench_prefix(**({"runs": args.runs} if args.command == "prefix" else {}))
+    if args.command in ("auto", "all"):
+      results["auto"] = bench_auto(**({"corpus": args.corpus} if args.command == "auto" else {}))
+    if args.command in ("fuzzy", "all"):
+      results["fuzzy"] = bench_fuzzy(**({"entries": args.entries} if args.command == "fuzzy" else {}))
+    if args.command in ("words", "all"):
+      results["words"] = bench_words(**({"corpus": args.corpus, "fuzz": args.fuzz} if args.command == "words" else {}))
+    if args.command in ("tail", "all"):
+      results["tail"] = bench_tail(**({"runs": args.runs, "stall_rate": args.stall_rate} if args.command == "tail" else {}))
+    if args.command == "all":
+      results["startup"] = check_startup()
+  output = json.dumps({"environment": environment(), "results": results}, ensure_ascii = False, indent = 2)
+  print(output)
+  if args.output:
+    with open(args.output, "w", encoding = "utf-8") as file:
+      file.write(output + "\n")
+  if "fuzzy" in results and not results["fuzzy"]["collisions"]["passed"]:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
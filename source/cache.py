@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# 回答缓存, 相同的查询直接返回历史结果而不再请求 API
+# 以 (提示词模板, 规范化后的输入, 模型, 温度, 最大token数) 的哈希作为键
+# 每条缓存保存为一个独立的小文件, 读写都只涉及一个文件
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from utils import GREEN_DOT
+from config import DATA_DIR
+from templates import template_key
+
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+# 缓存有效期, 默认 30 天
+DEFAULT_TTL = 30 * 24 * 3600
+# 最多保留的缓存条数, 超出后按最近使用时间淘汰
+MAX_ENTRIES = 5000
+# 每写入多少条缓存检查一次容量, 不必每次都扫描目录
+EVICT_INTERVAL = 50
+
+def normalize_text(text: str) -> str:
+  """
+  规范化输入文本: 去掉首尾空白并合并连续空白
+  :param text: 输入文本
+  :return: 规范化后的文本
+  """
+  return " ".join(text.split())
+
+def make_key(prompt_type, input_text: str, model: str, temperature: float, max_tokens: int) -> str:
+  """
+  根据查询参数生成缓存键
+  :param prompt_type: 提示词枚举类型
+  :param input_text: 输入的文本
+  :return: sha256 十六进制字符串
+  """
+  payload = json.dumps(
+    [template_key(prompt_type), normalize_text(input_text), model, temperature, max_tokens],
+    ensure_ascii = False
+  )
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class Answer_Cache:
+  def __init__(self, cache_dir: str = None, ttl: float = DEFAULT_TTL, max_entries: int = MAX_ENTRIES):
+    self.cache_dir = cache_dir or CACHE_DIR
+    self.ttl = ttl
+    self.max_entries = max_entries
+
+  def _path(self, key: str) -> str:
+    """缓存文件路径, 按键的前两位分目录, 避免单个目录文件过多"""
+    return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+  def get(self, key: str) -> dict:
+    """
+    读取一条缓存
+    :return: 缓存的记录, 不存在或已过期时返回 None
+    """
+    path = self._path(key)
+    try:
+      with open(path, "r", encoding = "utf-8") as file:
+        record = json.load(file)
+    except (OSError, ValueError):
+      return None
+    if time.time() - record.get("created", 0) > self.ttl:
+      self._remove(path)
+      return None
+    # 更新访问时间, 淘汰时优先保留最近使用的缓存
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+    return record
+
+  def put(self, key: str, record: dict) -> None:
+    """
+    写入一条缓存
+    :param record: 需要缓存的内容, 至少包含 answer
+    """
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    record = dict(record, created = time.time())
+    # 原子写入, 避免并发的 ds 进程读到写了一半的文件
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = ".tmp_", suffix = ".json")
+    try:
+      with os.fdopen(fd, "w", encoding = "utf-8") as tmp_file:
+        json.dump(record, tmp_file, ensure_ascii = False)
+      os.replace(tmp_path, path)
+    except Exception:
+      self._remove(tmp_path)
+      raise
+    if self._count_write() % EVICT_INTERVAL == 0:
+      self.evict()
+
+  def _count_write(self) -> int:
+    """
+    累计写入次数, 保存在缓存目录的 .writes 文件中, 多个 ds 进程共用
+    并发写入时偶尔少计一次, 只会让下一次检查稍晚一些
+    :return: 加上本次之后的写入次数
+    """
+    path = os.path.join(self.cache_dir, ".writes")
+    try:
+      with open(path, "a+", encoding = "utf-8") as file:
+        file.seek(0)
+        try:
+          count = int(file.read().strip() or 0) + 1
+        except ValueError:
+          count = 1
+        file.seek(0)
+        file.truncate()
+        file.write(str(count))
+    except OSError:
+      return 0 # 无法计数时每次都检查
+    return count
+
+  def evict(self) -> int:
+    """
+    淘汰过期的缓存, 并在超出容量时删除最久未使用的缓存
+    :return: 删除的条数
+    """
+    now = time.time()
+    entries = []
+    removed = 0
+    if not os.path.isdir(self.cache_dir):
+      return 0
+    for sub in os.listdir(self.cache_dir):
+      sub_dir = os.path.join(self.cache_dir, sub)
+      if not os.path.isdir(sub_dir):
+        continue
+      for name in os.listdir(sub_dir):
+        path = os.path.join(sub_dir, name)
+        try:
+          mtime = os.path.getmtime(path)
+        except OSError:
+          continue
+        if now - mtime > self.ttl:
+          removed += self._remove(path)
+        else:
+          entries.append((mtime, path))
+    if len(entries) > self.max_entries:
+      entries.sort()
+      for _, path in entries[:len(entries) - self.max_entries]:
+        removed += self._remove(path)
+    return removed
+
+  def _remove(self, path: str) -> int:
+    try:
+      os.remove(path)
+      return 1
+    except OSError:
+      return 0
+
+def show_cached(record: dict) -> None:
+  """
+  直接输出缓存中的回答, 不启动动画也不发起网络请求
+  :param record: 缓存记录
+  """
+  model = f", 模型: {record['model']}" if record.get("model") else ""
+  print(f"{GREEN_DOT} 命中缓存 (原始请求时间: {record.get('request_time')}{model})")
+  print(record["answer"])
+  print(f"\n使用的token数: 0 || 总字符数: {len(record['answer'])}")
+
+def main():
+  print("cache主程序已运行!")
+
+if __name__ == "__main__":
+  main()
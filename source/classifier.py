@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# 自动判断输入内容应该使用的模式, 不需要记住 -tr/-w/-s/-e 等选项
+# 完全在本地判断, 不额外请求大模型, 耗时在微秒级别
+#
+# 判断依据:
+#   文字种类  按 Unicode 范围统计汉字、假名、谚文和拉丁字母
+#   长度      英文按单词数, 中文按汉字数
+#   标点      句末标点、问号以及疑问词
+#   生词本    较短的英文词组如果以前查过, 视为单词/短语
+# 判断规则:
+#   包含假名                              -> 翻译 (日文)
+#   以中文为主: 提问                        -> 问答
+#               不超过 4 个汉字且没有标点    -> 英文同义词
+#               其他                        -> 翻译
+#   以英文为主: 不超过 3 个词且没有句末标点  -> 单词解释
+#               不超过 5 个词, 小写开头或者在生词本中 -> 单词解释
+#               询问词义、用法或区别的问题  -> 问答
+#               超过 60 个词                -> 翻译
+#               其他                        -> 句子解释
+#   其他                                    -> 问答
+
+import os
+from functools import lru_cache
+
+from prompts import Translator, User_prompt
+
+# 文字种类对应的 Unicode 范围
+# 直接比较码位和子串, 不使用正则表达式: 这个模块在每次启动时导入, 编译这些正则表达式就需要数毫秒
+SCRIPTS = (
+  ("han", ((0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff))),
+  ("kana", ((0x3040, 0x30ff), (0x31f0, 0x31ff), (0xff66, 0xff9f))), # 平假名, 片假名, 半角片假名
+  ("hangul", ((0x1100, 0x11ff), (0x3130, 0x318f), (0xac00, 0xd7af)))
+)
+PUNCTUATION = frozenset(",.!?;:，。！？；：、…")
+SENTENCE_END = tuple(".!?。！？…")
+QUESTION_END = ("?", "？", "吗", "呢", "吗?", "吗？", "呢?", "呢？")
+ZH_QUESTION_WORDS = ("什么", "为什么", "为何", "怎么", "怎样", "如何", "哪", "谁", "多少", "几个", "几种", "几次",
+                     "是否", "能否", "是不是", "有没有", "区别", "请问")
+# 询问词义、用法和区别的英文问题, 更适合直接回答而不是逐句解释, 比较时转为小写
+EN_QUESTION_PHRASES = ("difference between", "differences between", "meaning of", "how do i use", "how can i use",
+                       "how should i use", "how to use", "what is the origin", "what is the etymology",
+                       "synonym of", "synonyms of", "synonym for", "synonyms for", "explain ")
+
+# 英文单词数的界限
+MAX_WORD_TOKENS = 3
+MAX_KNOWN_PHRASE_TOKENS = 5
+MIN_TRANSLATE_TOKENS = 60
+# 中文词语的最大汉字数
+MAX_TERM_CHARS = 4
+
+class Classification:
+  """判断结果"""
+  def __init__(self, prompt_type, reason: str):
+    self.prompt_type = prompt_type
+    self.reason = reason
+
+  def __repr__(self) -> str:
+    return f"Classification({self.prompt_type}, {self.reason!r})"
+
+def script_counts(text: str) -> dict:
+  """各文字种类的字数"""
+  counts = {name: 0 for name, _ in SCRIPTS}
+  for char in text:
+    code = ord(char)
+    if code < 0x1100:
+      continue
+    for name, ranges in SCRIPTS:
+      if any(start <= code <= end for start, end in ranges):
+        counts[name] += 1
+        break
+  return counts
+
+def count_words(text: str) -> int:
+  """英文单词数: 包含拉丁字母的空白分隔片段, don't, well-known 这类写法算作一个词"""
+  return sum(1 for token in text.split() if any(char.isalpha() and ord(char) < 0x250 for char in token))
+
+def is_en_question(text: str) -> bool:
+  """是否为询问词义、用法或区别的英文问题"""
+  lowered = text.lower()
+  if lowered.startswith("what does") and "mean" in lowered:
+    return True
+  return any(phrase in lowered for phrase in EN_QUESTION_PHRASES)
+
+def features(text: str) -> dict:
+  """统计判断所需的特征"""
+  stripped = text.strip()
+  return {
+    **script_counts(stripped),
+    "words": count_words(stripped),
+    "punctuation": sum(1 for char in stripped if char in PUNCTUATION),
+    "sentence_end": stripped.endswith(SENTENCE_END),
+    "question_end": stripped.endswith(QUESTION_END)
+  }
+
+def classify(text: str, known_word = None) -> Classification:
+  """
+  判断输入内容应该使用的模式
+  :param text: 输入内容
+  :param known_word: 判断词组是否在生词本中的函数, 为 None 时不使用生词本
+  """
+  stripped = text.strip()
+  f = features(stripped)
+  if f["kana"]:
+    return Classification(Translator.fast_translate, "包含假名, 判断为日文")
+  if f["han"] and f["han"] >= f["words"]:
+    if f["question_end"] or any(word in stripped for word in ZH_QUESTION_WORDS):
+      return Classification(User_prompt.default_answer, "中文提问")
+    if f["han"] <= MAX_TERM_CHARS and not f["words"] and not f["punctuation"]:
+      return Classification(Translator.en_synonyms, f"中文词语, {f['han']} 个字")
+    return Classification(Translator.fast_translate, "中文句子")
+  if f["words"] and not f["hangul"]:
+    words = f["words"]
+    if words <= MAX_WORD_TOKENS and not f["sentence_end"]:
+      return Classification(Translator.explain_word, f"英文单词/短语, {words} 个词")
+    if words <= MAX_KNOWN_PHRASE_TOKENS and not f["sentence_end"]:
+      # 句子通常以大写字母开头, 小写开头的较短词组视为短语
+      if stripped[0].islower():
+        return Classification(Translator.explain_word, f"小写开头的短语, {words} 个词")
+      if known_word is not None and known_word(stripped):
+        return Classification(Translator.explain_word, f"生词本中的短语, {words} 个词")
+    if is_en_question(stripped):
+      return Classification(User_prompt.default_answer, "询问词义或用法的问题")
+    if words > MIN_TRANSLATE_TOKENS:
+      return Classification(Translator.fast_translate, f"英文段落, {words} 个词")
+    return Classification(Translator.explain_sentence, f"英文句子, {words} 个词")
+  return Classification(User_prompt.default_answer, "无法判断语言")
+
+@lru_cache(maxsize = None)
+def _known_words(data_file: str) -> frozenset:
+  from word_book import Word_Book
+  return frozenset(str(record.get("word", "")).strip().lower() for record in Word_Book(data_file).records())
+
+def in_word_book(text: str, data_file: str = None) -> bool:
+  """
+  是否查过这个单词/短语, 第一次调用时读取生词本
+  :param data_file: 生词本路径, 默认为 ../data/word_data.json
+  """
+  if data_file is None:
+    from word_book import DEFAULT_DATA_FILE
+    data_file = DEFAULT_DATA_FILE
+  if not os.path.exists(data_file) and not os.path.exists(os.path.splitext(data_file)[0] + ".jsonl"):
+    return False
+  return " ".join(text.split()).lower() in _known_words(data_file)
+
+def main():
+  print("classifier主程序已运行!")
+
+if __name__ == "__main__":
+  main()
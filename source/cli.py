@@ -1,5 +1,16 @@
 import argparse
 from prompts import Translator, User_prompt
+from config import BALANCE_CACHE_TTL
+
+# 命令行中的模式名称 -> 提示词类型, 与选项的长名称一致
+MODES = {
+  "translate": Translator.fast_translate,
+  "word": Translator.explain_word,
+  "translate-jp": Translator.translate_jp,
+  "sentence": Translator.explain_sentence,
+  "en-synonyms": Translator.en_synonyms,
+  "answer": User_prompt.default_answer
+}
 
 def parse_arguments() -> tuple:
   """
@@ -8,10 +19,11 @@ def parse_arguments() -> tuple:
   """
   parser = argparse.ArgumentParser(
     description = "DeepSeek API 多模式工具", 
+    epilog = "错峰预取: ds prefetch FILE, 使用 ds prefetch -h 查看说明",
     formatter_class = argparse.RawTextHelpFormatter
   )
 
-  parser.add_argument("text", nargs = "+", help = "输入需要处理的文本, 如果不传入参数则默认问答\n可以不使用引号来输入有间隔的英文单词, 但是问号需要转义字符\\")
+  parser.add_argument("text", nargs = "*", help = "输入需要处理的文本, 不指定模式时根据输入内容自动选择\n可以不使用引号来输入有间隔的英文单词, 但是问号需要转义字符\\")
   # parser.add_argument("text", nargs = argparse.REMAINDER, help = "输入需要处理的文本(不需要加引号, 所有后续内容都会被捕获)")
   
   parser.add_argument(
@@ -24,8 +36,165 @@ def parse_arguments() -> tuple:
     action = "store_true",
     help = "采用流式传输，适用于长文本"
   )
+  parser.add_argument(
+    "--no-typewriter",
+    action = "store_true",
+    help = "流式传输时收到内容立即原样输出, 不做平滑处理"
+  )
+  parser.add_argument(
+    "--timing",
+    action = "store_true",
+    help = "输出启动耗时: 解释器启动及导入, 以及从进程启动到发出请求"
+  )
+  parser.add_argument(
+    "--model",
+    metavar = "NAME",
+    help = "指定使用的模型, 如 deepseek-chat 或 deepseek-reasoner\n默认根据服务器时间(错峰时段)、模式和最近的请求情况自动选择"
+  )
+  parser.add_argument(
+    "--no-hedge",
+    action = "store_true",
+    help = "首字延迟超过最近的 p95 时不发出对冲请求"
+  )
+  parser.add_argument(
+    "--no-cache",
+    action = "store_true",
+    help = "不读取也不写入回答缓存"
+  )
+  parser.add_argument(
+    "--refresh",
+    action = "store_true",
+    help = "忽略已有的缓存重新请求, 并用新的回答更新缓存"
+  )
+  parser.add_argument(
+    "--no-fuzzy",
+    action = "store_true",
+    help = "没有命中缓存时不复用相似问题(如大小写、词形或标点不同)的回答"
+  )
+  parser.add_argument(
+    "--daemon",
+    action = "store_true",
+    help = "在前台启动常驻进程, 保持与 API 的连接, 之后的 ds 命令会自动通过常驻进程发起请求"
+  )
+  parser.add_argument(
+    "--no-daemon",
+    action = "store_true",
+    help = "不使用常驻进程, 直接请求 API"
+  )
+  parser.add_argument(
+    "--batch",
+    metavar = "FILE",
+    help = "批量模式: 从文件中逐行读取需要处理的内容, 传入 - 则从标准输入读取"
+  )
+  parser.add_argument(
+    "--file",
+    metavar = "FILE",
+    help = "翻译长文档: 按段落切分后分段翻译, 按原文顺序输出, 中断后重新运行会从未完成的段落继续\n传入 - 则从标准输入读取, 只能与 -tr 一起使用"
+  )
+  parser.add_argument(
+    "--continue",
+    dest = "continue_session",
+    action = "store_true",
+    help = "继续最近的对话进行追问, 最近一次单独提问之后没有追问过时以它作为第一轮\n较早的轮次超过 token 上限时自动压缩为摘要"
+  )
+  parser.add_argument(
+    "--session",
+    metavar = "NAME",
+    help = "使用名为 NAME 的对话, 不存在时以本次输入作为第一轮新建"
+  )
+  parser.add_argument(
+    "--sessions",
+    action = "store_true",
+    help = "列出最近的对话, 以及与每次发送完整历史相比节省的 token 数, 可以用 --limit 指定数量"
+  )
+  parser.add_argument(
+    "--concurrency",
+    type = int,
+    default = 4,
+    help = "批量模式和长文档翻译时最多同时进行的请求数, 默认为 4"
+  )
+  parser.add_argument(
+    "--rps",
+    type = float,
+    default = 2.0,
+    help = "批量模式下每秒最多发出的请求数, 0 表示不限制, 默认为 2"
+  )
+  parser.add_argument(
+    "--pack",
+    action = "store_true",
+    help = "与 -w 或 -e 一起使用, 把多个单词放进同一个请求, 要求模型以 JSON 输出后再拆分, 减少请求次数和重复发送的提示词; 不使用 --batch 时每个参数作为一个单词"
+  )
+  parser.add_argument(
+    "--pack-size",
+    type = int,
+    default = 8,
+    metavar = "N",
+    help = "打包请求时每个请求最多包含的单词数, 默认为 8"
+  )
+  parser.add_argument(
+    "--template",
+    metavar = "NAME",
+    help = "使用 data/templates/NAME.txt 中的自定义提示词模板, 模板中用 {text} 表示输入内容, 并且必须放在最后"
+  )
+  parser.add_argument(
+    "--templates",
+    action = "store_true",
+    help = "列出内置和自定义的提示词模板"
+  )
+  parser.add_argument(
+    "--history",
+    action = "store_true",
+    help = "查看问答日志, 可以配合 --since, --until, --mode 和 --limit 筛选"
+  )
+  parser.add_argument(
+    "--search",
+    metavar = "TERMS",
+    help = "搜索以前的问答和生词本, 多个搜索词用空格分隔, 按相关度和时间排序, 同样可以用 --since, --until, --mode 和 --limit 筛选"
+  )
+  parser.add_argument(
+    "--stats",
+    action = "store_true",
+    help = "按模式和模型统计各阶段耗时的 p50/p95/p99, 默认统计最近 7 天, 可以用 --since, --until 和 --mode 筛选"
+  )
+  parser.add_argument(
+    "--usage",
+    action = "store_true",
+    help = "按模式和模型汇总 token 用量和费用, 默认统计本月, 可以用 --since, --until 和 --mode 筛选"
+  )
+  parser.add_argument(
+    "--balance",
+    action = "store_true",
+    help = f"查询账户余额, {BALANCE_CACHE_TTL} 秒内重复查询时使用上一次的结果, 配合 --refresh 重新查询"
+  )
+  parser.add_argument(
+    "--prometheus",
+    action = "store_true",
+    help = "与 --stats 一起使用, 以 Prometheus 文本格式输出"
+  )
+  parser.add_argument(
+    "--since",
+    metavar = "TIME",
+    help = "只显示该时间之后的日志, 格式为 YYYY-MM-DD 或 \"YYYY-MM-DD HH:MM\""
+  )
+  parser.add_argument(
+    "--until",
+    metavar = "TIME",
+    help = "只显示该时间之前的日志, 格式同 --since"
+  )
+  parser.add_argument(
+    "--mode",
+    choices = list(MODES),
+    help = "只显示某一模式的日志"
+  )
+  parser.add_argument(
+    "--limit",
+    type = int,
+    default = 20,
+    help = "最多显示最近的多少条日志, 0 表示全部显示, 默认为 20"
+  )
   
-  group = parser.add_mutually_exclusive_group()
+  # 可以同时指定多个模式, 并发请求后分段输出(见 multi.py)
+  group = parser.add_argument_group("模式", "可以同时指定多个模式, 例如 -tr -s, 各模式同时请求, 先返回的先输出")
   group.add_argument(
     "-tr", "--translate",
     action = "store_true",
@@ -51,8 +220,49 @@ def parse_arguments() -> tuple:
     action = "store_true",
     help = "查询英文同义词/近义词, 输出表格"
   )
-  # 如果都不传，就默认走问答模式
+  group.add_argument(
+    "-a", "--answer",
+    action = "store_true",
+    help = "问答模式, 直接回答输入的问题"
+  )
+  group.add_argument(
+    "--auto",
+    action = "store_true",
+    help = "根据输入内容自动选择模式(默认), 在本地按文字种类、长度、标点和生词本判断, 不额外请求\n批量模式下不能自动选择, 使用问答模式"
+  )
+  # 如果都不传，就根据输入内容自动选择模式
   args = parser.parse_args()
+  args.auto_reason = None
+  # 指定的全部模式, 按 MODES 中的顺序
+  args.modes = [member for name, member in MODES.items() if getattr(args, name.replace("-", "_"))]
+  if args.auto and args.modes:
+    parser.error("--auto 不能与 -tr, -w, -tj, -s, -e 或 -a 一起使用")
+  if len(args.modes) > 1 and (args.batch or args.file or args.pack or args.template or args.continue_session or args.session):
+    parser.error("同时指定多个模式时不能使用 --batch, --file, --pack, --template, --continue 或 --session")
+  if not args.text and not args.batch and not args.file and not args.daemon and not args.history and not args.search \
+     and not args.stats and not args.templates and not args.sessions and not args.usage and not args.balance:
+    parser.error("需要输入处理的文本, 或者使用 --batch 指定批量输入")
+  if args.continue_session or args.session:
+    if args.batch or args.file or args.pack or args.template:
+      parser.error("--continue 和 --session 不能与 --batch, --file, --pack 或 --template 一起使用")
+    if not (args.translate or args.word or args.translate_jp or args.sentence or args.en_synonyms):
+      # 追问原样发送, 不需要自动选择模式; 新建对话时第一轮默认为问答模式
+      return args, User_prompt.default_answer
+  if args.file:
+    if args.text or args.batch or args.pack or args.template or args.word or args.translate_jp or args.sentence \
+       or args.en_synonyms or args.answer:
+      parser.error("--file 只能与 -tr 一起使用, 不能同时输入文本或使用 --batch, --pack, --template")
+    return args, Translator.document_translate
+  if args.pack and not (args.word or args.en_synonyms):
+    parser.error("--pack 只能与 -w 或 -e 一起使用")
+  if args.template:
+    if args.translate or args.word or args.translate_jp or args.sentence or args.en_synonyms or args.pack:
+      parser.error("--template 不能与 -tr, -w, -tj, -s, -e 或 --pack 一起使用")
+    from templates import get_registry
+    try:
+      return args, get_registry().get(args.template)
+    except KeyError as e:
+      parser.error(f"{e.args[0]}, 可以用 --templates 查看全部模板")
   if args.translate:
     prompt_type = Translator.fast_translate
   elif args.word:
@@ -63,8 +273,50 @@ def parse_arguments() -> tuple:
     prompt_type = Translator.explain_sentence
   elif args.en_synonyms:
     prompt_type = Translator.en_synonyms
-  else:
-    # 默认走问答模式
+  elif args.answer or not args.text:
     prompt_type = User_prompt.default_answer
-  
-  return args, prompt_type
\ No newline at end of file
+  else:
+    # 没有指定模式时根据输入内容自动选择
+    from classifier import classify, in_word_book
+    result = classify(' '.join(args.text), in_word_book)
+    prompt_type = result.prompt_type
+    mode = next(name for name, member in MODES.items() if member == prompt_type)
+    args.auto_reason = f"{mode} ({result.reason})"
+
+  return args, prompt_type
+
+def parse_prefetch_arguments(argv: list):
+  """
+  解析 ds prefetch 的参数
+  :param argv: prefetch 之后的命令行参数
+  """
+  from config import PREFETCH_CONCURRENCY, PREFETCH_TOKEN_BUDGET
+  parser = argparse.ArgumentParser(
+    prog = "ds prefetch",
+    description = "错峰预取: 把词表加入任务队列, 在错峰时段请求并写入回答缓存和生词本, 之后查询时直接命中缓存\n"
+                  "常驻进程(ds --daemon)会在错峰时段自动执行队列, 也可以使用 --run 在前台执行",
+    formatter_class = argparse.RawTextHelpFormatter
+  )
+  parser.add_argument("files", nargs = "*", metavar = "FILE", help = "词表文件, 每行一条, 忽略空行和 # 开头的注释行, 传入 - 则从标准输入读取")
+  parser.add_argument("--mode", choices = MODES, help = "词表使用的模式, 默认每条分别根据内容自动选择")
+  parser.add_argument(
+    "--run",
+    action = "store_true",
+    help = "在前台执行队列: 等待错峰时段开始, 时段结束、用完 token 预算或队列清空时退出\n中断后再次执行会从未完成的任务继续"
+  )
+  parser.add_argument("--now", action = "store_true", help = "不等待错峰时段, 立即执行队列")
+  parser.add_argument(
+    "--concurrency",
+    type = int,
+    default = PREFETCH_CONCURRENCY,
+    help = f"同时进行的请求数, 默认为 {PREFETCH_CONCURRENCY}"
+  )
+  parser.add_argument(
+    "--budget",
+    type = int,
+    default = PREFETCH_TOKEN_BUDGET,
+    help = f"每个错峰时段最多使用的 token 数, 0 表示不限制, 默认为 {PREFETCH_TOKEN_BUDGET}\n使用 --now 时为本次执行的预算"
+  )
+  parser.add_argument("--model", metavar = "NAME", help = "指定使用的模型, 默认按批量模式的规则自动选择")
+  parser.add_argument("--retry-failed", action = "store_true", help = "把失败的任务重新加入队列")
+  return parser.parse_args(argv)
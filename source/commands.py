@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# 需要发起请求的命令的具体实现
+# 由 main.py 在解析完参数、确认需要请求 API 之后才导入, 这里可以放心地导入 asyncio 和请求引擎
+
+import asyncio
+
+from prompts import Translator
+from log import log_message, word_format
+from cache import Answer_Cache, make_key, show_cached
+from engine import Session, RequestError, TEMPERATURE, MAX_TOKENS
+from batch import read_items, run_batch
+from utils import Animation, loading_animation, measure_time, separator, \
+RED_DOT, RequestStatus
+from render import Stream_Renderer
+from metrics import Request_Trace, Metrics_Store, format_cache_rate
+from query_log import mode_name
+from router import Model_Router, Route
+from templates import render_prompt
+from conversation import save_last_query
+from word_parser import Word_Parser
+
+# input_text 只是从命令行中输入的一小段核心问题
+# prompt 则是根据预设的提示词加上 input_text 生成的完整提示词
+
+def describe_attempts(reply) -> str:
+  """重试和对冲的情况, 没有发生时返回空字符串"""
+  notes = []
+  if reply.retries:
+    notes.append(f"重试 {reply.retries} 次")
+  if reply.hedged:
+    notes.append("首字延迟过长, 发出了对冲请求")
+  return f" || {', '.join(notes)}" if notes else ""
+
+@measure_time
+async def send_messages(session: Session,
+                        input_text: str,
+                        prompt: str,
+                        prompt_type,
+                        isStream: bool = True,
+                        typewriter: bool = True,
+                        timing = None,
+                        show_timing: bool = False,
+                        trace: Request_Trace = None,
+                        route: Route = None,
+                        history: list = None,
+                        parser = None,
+                        ) -> tuple:
+  """
+  发起请求到 DeepSeek API
+  默认为流式传输模式
+  :param session: 请求会话
+  :param input_text: 输入的文本
+  :param prompt: 生成的提示词
+  :param prompt_type: 提示词类型
+  :param typewriter: 流式传输时是否平滑输出, 为 False 时收到内容立即原样输出
+  :param timing: utils.Startup_Timer, 传入时统计从进程启动到发出请求的耗时
+  :param show_timing: 是否输出启动耗时
+  :param trace: 记录各阶段耗时, 由调用方写入指标文件
+  :param route: 选择的模型, 默认使用 Session 的模型
+  :param history: 多轮对话中之前的消息, prompt 作为最后一条消息
+  :param parser: 流式传输时同时把收到的内容交给它增量解析, 如 word_parser.Word_Parser
+  :return: 返回内容: 大模型的回答内容, 使用的token数, 请求时间
+  """
+  # 启动加载动画, 收到第一段内容(流式传输)或请求完成(非流式传输)时停止
+  ready = asyncio.Event()
+  animation_task = asyncio.create_task(loading_animation(ready, Animation.spin, isStream))
+  renderer = Stream_Renderer(typewriter = typewriter)
+
+  async def render() -> None:
+    await ready.wait()
+    await animation_task # 等待动画打印完状态行, 再开始输出回答
+    await renderer.run()
+  render_task = asyncio.create_task(render())
+
+  def on_chunk(text: str) -> None:
+    ready.set()
+    renderer.feed(text)
+    if parser is not None:
+      parser.feed(text)
+
+  model = route.model if route is not None else session.model
+  hedge_after = route.hedge_after if route is not None else None
+  if trace is None:
+    trace = Request_Trace(mode_name(prompt_type), model)
+  answer = ""
+  tokens_used = 0
+  request_time = None
+  reply_sent_at = None
+  failed = False
+  failure = None # 失败时记入日志的回答
+  resilience_note = ""
+  # 发送请求
+  try:
+    if isStream:
+      reply = await session.stream(prompt, on_chunk = on_chunk, on_finish = renderer.close, model = model,
+                                   hedge_after = hedge_after, history = history)
+    else:
+      reply = await session.complete(prompt, model = model, hedge_after = hedge_after, history = history)
+    answer, tokens_used, request_time = reply.answer, reply.tokens_used, reply.request_time
+    reply_sent_at = reply.sent_at
+    trace.from_reply(reply)
+    resilience_note = describe_attempts(reply)
+  except RequestError as e:
+    failed = True
+    failure = "请求失败"
+    trace.ok = False
+    print(f"\n{RED_DOT} 请求失败: {e}")
+  except Exception as e:
+    failed = True
+    failure = "未知错误"
+    trace.ok = False
+    print(f"\n{RED_DOT} 未知错误: {e}")
+  finally:
+    # 停止加载动画, 写完缓冲区中剩余的内容
+    renderer.close()
+    ready.set()
+    await render_task
+
+  if isStream:
+    print()
+    print(separator(), flush = True)
+    print(f"{RequestStatus.failed.value if failed else RequestStatus.completed.value}", flush = True)
+  else:
+    print(f"\n{answer}")
+  cache_rate = format_cache_rate(trace.cache_hit, trace.cache_miss) if trace.cache_hit is not None else ""
+  print(f"\n使用的token数: {tokens_used} || 总字符数: {len(answer)}{' || ' + cache_rate if cache_rate else ''}")
+  if route is not None:
+    print(f"模型: {route.model} ({route.reason}){resilience_note}")
+  if timing is not None and reply_sent_at is not None:
+    trace.add("startup", timing.since_exec(reply_sent_at))
+    if show_timing:
+      print(timing.report(reply_sent_at))
+  if isStream and answer:
+    trace.add("render", renderer.display_lag)
+    print(f"显示延迟: {renderer.display_lag * 1000:.1f}毫秒 (网络传输结束到显示完毕)")
+  # 成功和失败都只记录一次日志, 由后台线程写入(见 persist.py)
+  with trace.span("persist"):
+    log_message(question = input_text, answer = failure or answer, prompt_type = prompt_type, model = model)
+  return answer, tokens_used, request_time
+
+async def translate(session: Session,
+                    input_text,
+                    prompt_type,
+                    isStream: bool = True,
+                    use_cache: bool = True,
+                    refresh: bool = False,
+                    typewriter: bool = True,
+                    timing = None,
+                    show_timing: bool = False,
+                    model: str = None,
+                    router: Model_Router = None,
+                    hedge: bool = True):
+  """
+  根据输入文本和提示词类型调用API并处理返回结果
+  :param use_cache: 是否使用缓存, 为 False 时既不读取也不写入缓存
+  :param refresh: 忽略已有缓存重新请求, 并用新的回答覆盖缓存
+  :param typewriter: 流式传输时是否平滑输出
+  :param timing: utils.Startup_Timer, 传入时统计启动耗时
+  :param show_timing: 是否输出启动耗时
+  :param model: 指定使用的模型, 为 None 时由 router 选择
+  :param router: 选择模型的规则, 默认新建一个 Model_Router
+  :param hedge: 首字延迟超过最近的 p95 时是否发出对冲请求
+  """
+  # 获取对应的prompt
+  prompt = render_prompt(prompt_type, input_text)
+  route = (router or Model_Router()).choose(mode_name(prompt_type), model, hedge = hedge)
+  cache = Answer_Cache() if use_cache else None
+  key = make_key(prompt_type, input_text, route.model, TEMPERATURE, MAX_TOKENS)
+  trace = None
+
+  try:
+    if cache is not None and not refresh:
+      record = cache.get(key)
+      if record is not None:
+        show_cached(record)
+        save_last_query(prompt_type, input_text, record["answer"])
+        return
+
+    trace = Request_Trace(mode_name(prompt_type), route.model)
+    # 单词解释在接收的同时解析, 回答结束时生词本记录就已经准备好
+    parser = Word_Parser() if prompt_type == Translator.explain_word and isStream else None
+    answer, tokens_used, request_time = await send_messages(
+      session, input_text, prompt, prompt_type, isStream, typewriter, timing, show_timing, trace, route, parser = parser
+    )
+    if not answer: # 确保返回值有效
+      print(f"\n{RED_DOT} 未能获取有效的回答")
+      return
+    with trace.span("persist"):
+      # 被截断的回答不完整, 不写入缓存, 下次重新请求
+      if trace.truncated:
+        print(f"{RED_DOT} 回答达到最大 token 数被截断, 不写入缓存")
+      elif cache is not None:
+        cache.put(key, {"answer": answer, "tokens_used": tokens_used, "request_time": request_time, "model": route.model})
+      # 如果提示词类型属于[单词解释], 则触发 json 输出
+      if prompt_type == Translator.explain_word:
+        word_format(input_text, answer, request_time, parser = parser)
+      save_last_query(prompt_type, input_text, answer)
+  except Exception as e:
+    print(f"\n{RED_DOT} 程序发生错误: {e}")
+    log_message(question = input_text, answer = "程序发生错误", prompt_type = prompt_type, model = route.model)
+    if trace is not None:
+      trace.ok = False
+  finally:
+    # 命中缓存时没有发起请求, 不记录
+    if trace is not None:
+      Metrics_Store().append([trace.record()])
+
+async def run(args, prompt_type, timing = None) -> None:
+  """
+  命令行入口的异步部分, 整个进程只使用一个 Session
+  :param timing: utils.Startup_Timer, 用于统计启动耗时, 使用 --timing 时同时输出
+  """
+  use_cache = not args.no_cache
+  async with Session(use_daemon = not args.no_daemon) as session:
+    if args.pack:
+      from pack import run_packed
+      items = read_items(args.batch) if args.batch else args.text
+      await run_packed(session, items, prompt_type, args.pack_size, args.concurrency, args.rps,
+                       use_cache = use_cache, refresh = args.refresh, model = args.model, batch = bool(args.batch))
+      return
+    if args.file:
+      from document import run_document
+      await run_document(session, args, prompt_type)
+      return
+    if args.continue_session or args.session:
+      from conversation import run_conversation
+      await run_conversation(session, args, prompt_type, timing)
+      return
+    if len(args.modes) > 1:
+      from multi import run_modes
+      await run_modes(session, args, args.modes, timing)
+      return
+    if args.batch:
+      await run_batch(session, read_items(args.batch), prompt_type, args.concurrency, args.rps,
+                      use_cache = use_cache, refresh = args.refresh, model = args.model)
+      return
+    is_stream = True # 默认采用流式传输
+    if args.stream_false:
+      is_stream = False
+    elif args.stream_true:
+      is_stream = True
+    await translate(session, ' '.join(args.text), prompt_type, is_stream, use_cache, args.refresh,
+                    typewriter = not args.no_typewriter, timing = timing, show_timing = args.timing,
+                    model = args.model, hedge = not args.no_hedge)
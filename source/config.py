@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# 请求参数
+# 单独放在一个不依赖其他模块的文件中, 命中缓存等不需要发起请求的路径可以直接导入而不用加载请求引擎
+
+import os
+
+# API 地址, 可以用环境变量 DS_BASE_URL 改为其他兼容 OpenAI 接口的服务, 例如 mock_server.py
+BASE_URL = (os.getenv("DS_BASE_URL") or "https://api.deepseek.com").rstrip("/")
+# 日志、缓存和生词本等数据的目录, 可以用环境变量 DS_DATA_DIR 指定, 例如基准测试时使用临时目录
+DATA_DIR = os.getenv("DS_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data")
+# 请求参数, 同时也是缓存键的一部分
+MODEL = "deepseek-chat"
+TEMPERATURE = 0.3
+MAX_TOKENS = 1024
+# 推理模型, 错峰时段与 MODEL 价格相同
+REASONER_MODEL = "deepseek-reasoner"
+# 推理模型的 max_tokens 包括思考过程, 需要更大的上限
+MODEL_MAX_TOKENS = {REASONER_MODEL: 8192}
+# 每百万 token 的价格(元): (输入命中缓存, 输入未命中缓存, 输出), 用于在本地计算费用(见 ledger.py)
+# 具体参考: https://api-docs.deepseek.com/zh-cn/quick_start/pricing
+MODEL_PRICES = {MODEL: (0.5, 2.0, 8.0), REASONER_MODEL: (1.0, 4.0, 16.0)}
+# 错峰时段的价格折扣
+OFF_PEAK_DISCOUNTS = {MODEL: 0.5, REASONER_MODEL: 0.25}
+# 支持 JSON 输出(response_format)的模型
+JSON_MODE_MODELS = (MODEL,)
+# 大模型服务器所在时区, 以及该时区下的错峰优惠时段(开始, 结束)
+# 具体参考: https://api-docs.deepseek.com/zh-cn/quick_start/pricing
+SERVER_TIMEZONE = "Asia/Shanghai"
+OFF_PEAK_WINDOWS = (("00:30", "08:30"),)
+# 单次请求的默认超时时间(秒), 包括流式传输的全部时间
+REQUEST_TIMEOUT = 120.0
+# 建立连接的超时时间(秒)
+CONNECT_TIMEOUT = 10.0
+# 发出请求到收到第一段内容(包括推理模型的思考过程)的超时时间(秒), 超时后重试
+FIRST_TOKEN_TIMEOUT = 30.0
+# 连接错误、超时、429 和 5xx 错误的最多重试次数, 以及重试间隔的初始值和上限(秒)
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# 对冲请求: 首字延迟超过该模型最近的 p95 时再发出一个相同的请求, 至少需要这么多条请求记录
+HEDGE_MIN_SAMPLES = 20
+# 对冲请求的最短等待时间(秒), 避免 p95 很低时频繁对冲
+HEDGE_MIN_DELAY = 1.0
+# 长文档翻译时每段原文的 token 上限(本地估算), 译文需要在 MAX_TOKENS 之内, 中英互译时译文的 token 数与原文相近
+DOCUMENT_CHUNK_TOKENS = 500
+# 没有命中回答缓存时复用相似问题的回答(见 similar.py): 参与复用的模式, 以及需要达到的相似度(字符三元组的 Jaccard 相似度)
+FUZZY_MODES = ("explain_word", "en_synonyms", "explain_sentence")
+FUZZY_THRESHOLD = 0.85
+# 其中不比较相似度的模式: 单词相差一个字母或词尾就可能是另一个词(plan/plane, even/evening), 只复用词形还原之后完全相同的问题
+FUZZY_EXACT_MODES = ("explain_word", "en_synonyms")
+# 多轮对话每次发送的上下文(包括本次提问)的 token 上限(本地估算)
+CONTEXT_TOKEN_BUDGET = 6000
+# 超出上限时把较早的轮次压缩为摘要, 直到上下文不超过上限的这一比例, 留出余量使之后几轮的提示词前缀不变
+CONTEXT_LOW_WATER = 0.6
+# 日志和生词本在后台写入(见 persist.py): 收到记录后等待多久(秒)合并写入, 以及进程退出时最多等待写完的时间(秒)
+# 超时没有写完的记录保存在 data/pending 中, 下次运行时补写
+PERSIST_GROUP_DELAY = 0.02
+PERSIST_FLUSH_TIMEOUT = 2.0
+# 错峰预取同时进行的请求数
+PREFETCH_CONCURRENCY = 4
+# 错峰预取在每个错峰时段最多使用的 token 数, 0 表示不限制
+PREFETCH_TOKEN_BUDGET = 200000
+# 预取任务最多尝试的次数, 超过后标记为失败, 可以用 ds prefetch --retry-failed 重新加入队列
+PREFETCH_MAX_ATTEMPTS = 3
+# 模型列表和账户余额的缓存时间(秒), 见 model.py
+MODELS_CACHE_TTL = 24 * 3600
+BALANCE_CACHE_TTL = 60
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+# 多轮对话: ds --continue 和 ds --session NAME
+# 单独提问(包括命中缓存)后, 问题和回答保存在 data/last_query.json 中
+#   --continue        继续最近的对话; 最近一次单独提问比最近的对话更新时, 以它作为第一轮开始新的对话
+#   --session NAME    使用命名的对话, 不存在时以本次输入作为第一轮新建
+# 对话保存在 data/conversations.db, 第一轮按模式使用模板生成提示词, 之后的追问原样发送
+#
+# 每次请求的上下文按以下顺序排列, 请求之间的提示词前缀尽量保持不变, 可以命中服务器的提示词缓存(见 templates.py):
+#   [第一轮: 模板 + 输入, 回答] [较早轮次的摘要] [最近的若干轮] [本次追问]
+# 第一轮始终保留, 模板前缀与单独提问时相同
+# 上下文超过 CONTEXT_TOKEN_BUDGET 时, 从最早的轮次开始移出, 直到不超过上限的 CONTEXT_LOW_WATER,
+# 移出的轮次与之前的摘要合并为新的摘要; 一次移出多轮, 之后几轮的前缀不再变化, 而不是每轮都移出一轮、每次前缀都不同
+# 每轮显示实际发送的 token 数, 以及每次都发送完整历史时需要的 token 数(均为本地估算)
+
+import os
+import json
+import time
+
+from config import DATA_DIR, CONTEXT_TOKEN_BUDGET, CONTEXT_LOW_WATER
+from query_log import mode_name
+from utils import GREEN_DOT, RED_DOT, estimate_tokens, write_json_atomic
+
+CONVERSATION_FILE = os.path.join(DATA_DIR, "conversations.db")
+LAST_QUERY_FILE = os.path.join(DATA_DIR, "last_query.json")
+
+def save_last_query(prompt_type, question: str, answer: str, path: str = None) -> None:
+  """
+  记录最近一次单独提问, 供 ds --continue 继续
+  命中缓存时也会调用, 只写一个小文件, 不导入 sqlite3
+  """
+  path = path or LAST_QUERY_FILE
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+  write_json_atomic(path, {"ts": time.time(), "mode": mode_name(prompt_type), "question": question, "answer": answer})
+
+def load_last_query(path: str = None) -> dict:
+  """:return: 最近一次单独提问, 没有时返回 None"""
+  try:
+    with open(path or LAST_QUERY_FILE, "r", encoding = "utf-8") as file:
+      return json.load(file)
+  except (OSError, ValueError):
+    return None
+
+class Conversation_Store:
+  def __init__(self, db_file: str = None):
+    """
+    :param db_file: 数据库路径, 默认为 ../data/conversations.db
+    """
+    import sqlite3
+    self.db_file = db_file or CONVERSATION_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok = True)
+    self.conn = sqlite3.connect(self.db_file, timeout = 10)
+    self.conn.row_factory = sqlite3.Row
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    with self.conn:
+      # naive_tokens: 每轮都发送完整历史时的 token 数之和, sent_tokens: 实际发送的 token 数之和
+      # summary_tokens: 生成摘要的请求使用的 token 数之和, 计算节省的 token 数时需要扣除
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS conversations ("
+        "id INTEGER PRIMARY KEY, name TEXT UNIQUE, mode TEXT, summary TEXT DEFAULT '', "
+        "created REAL, updated REAL, naive_tokens INTEGER DEFAULT 0, sent_tokens INTEGER DEFAULT 0, "
+        "summary_tokens INTEGER DEFAULT 0)"
+      )
+      # active 为 0 的轮次已经合并到摘要中, 不再发送, 但保留原文
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS turns ("
+        "id INTEGER PRIMARY KEY, conversation INTEGER, ts REAL, question TEXT, prompt TEXT, answer TEXT, "
+        "tokens INTEGER, active INTEGER DEFAULT 1)"
+      )
+      self.conn.execute("CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation, id)")
+
+  def close(self) -> None:
+    self.conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def get(self, name: str) -> dict:
+    row = self.conn.execute("SELECT * FROM conversations WHERE name = ?", (name,)).fetchone()
+    return dict(row) if row else None
+
+  def latest(self) -> dict:
+    """:return: 最近更新的对话, 没有时返回 None"""
+    row = self.conn.execute("SELECT * FROM conversations ORDER BY updated DESC LIMIT 1").fetchone()
+    return dict(row) if row else None
+
+  def list(self, limit: int = 20) -> list:
+    """:return: 最近更新的若干个对话, 附带轮数"""
+    rows = self.conn.execute(
+      "SELECT c.*, (SELECT COUNT(*) FROM turns t WHERE t.conversation = c.id) AS turn_count "
+      "FROM conversations c ORDER BY updated DESC" + (" LIMIT ?" if limit > 0 else ""),
+      (limit,) if limit > 0 else ()
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+  def create(self, name: str, mode: str, question: str, prompt: str, answer: str) -> dict:
+    """
+    新建对话, 第一轮为 (question, prompt, answer)
+    :param name: 对话名称, 由 --continue 开始的对话没有名称
+    """
+    now = time.time()
+    with self.conn:
+      cursor = self.conn.execute(
+        "INSERT INTO conversations (name, mode, created, updated) VALUES (?, ?, ?, ?)", (name, mode, now, now)
+      )
+      self._insert_turn(cursor.lastrowid, question, prompt, answer, now)
+    return dict(self.conn.execute("SELECT * FROM conversations WHERE id = ?", (cursor.lastrowid,)).fetchone())
+
+  def turns(self, conversation: int, active_only: bool = True) -> list:
+    """:return: 按顺序排列的轮次, 第一轮始终在最前"""
+    rows = self.conn.execute(
+      "SELECT * FROM turns WHERE conversation = ?" + (" AND active = 1" if active_only else "") + " ORDER BY id",
+      (conversation,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+  def total_tokens(self, conversation: int) -> int:
+    """全部轮次(包括已经合并到摘要中的)的 token 数之和"""
+    return self.conn.execute("SELECT COALESCE(SUM(tokens), 0) FROM turns WHERE conversation = ?", (conversation,)).fetchone()[0]
+
+  def add_turn(self, conversation: int, question: str, prompt: str, answer: str, naive_tokens: int, sent_tokens: int) -> None:
+    now = time.time()
+    with self.conn:
+      self._insert_turn(conversation, question, prompt, answer, now)
+      self.conn.execute(
+        "UPDATE conversations SET updated = ?, naive_tokens = naive_tokens + ?, sent_tokens = sent_tokens + ? WHERE id = ?",
+        (now, naive_tokens, sent_tokens, conversation)
+      )
+
+  def compact(self, conversation: int, turn_ids: list, summary: str, summary_tokens: int) -> None:
+    """把 turn_ids 中的轮次移出上下文, 并保存合并后的摘要"""
+    with self.conn:
+      self.conn.executemany("UPDATE turns SET active = 0 WHERE id = ?", [(turn_id,) for turn_id in turn_ids])
+      self.conn.execute(
+        "UPDATE conversations SET summary = ?, summary_tokens = summary_tokens + ? WHERE id = ?",
+        (summary, summary_tokens, conversation)
+      )
+
+  def _insert_turn(self, conversation: int, question: str, prompt: str, answer: str, ts: float) -> None:
+    self.conn.execute(
+      "INSERT INTO turns (conversation, ts, question, prompt, answer, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+      (conversation, ts, question, prompt, answer, estimate_tokens(prompt) + estimate_tokens(answer))
+    )
+
+def conversation_label(conversation: dict) -> str:
+  return conversation["name"] or f"#{conversation['id']}"
+
+def summary_messages(summary: str) -> list:
+  """摘要以一问一答的形式放在第一轮之后"""
+  from prompts import Conversation_prompt
+  return [
+    {"role": "user", "content": Conversation_prompt.summary_note.value.format(summary = summary)},
+    {"role": "assistant", "content": Conversation_prompt.summary_ack.value}
+  ]
+
+def build_messages(turns: list, summary: str = "") -> list:
+  """
+  :param turns: 当前保留的轮次, 第一个为第一轮
+  :return: 发送给模型的历史消息, 不包括本次追问
+  """
+  messages = [{"role": "user", "content": turns[0]["prompt"]}, {"role": "assistant", "content": turns[0]["answer"]}]
+  if summary:
+    messages += summary_messages(summary)
+  for turn in turns[1:]:
+    messages += [{"role": "user", "content": turn["prompt"]}, {"role": "assistant", "content": turn["answer"]}]
+  return messages
+
+def messages_tokens(messages: list) -> int:
+  return sum(estimate_tokens(message["content"]) for message in messages)
+
+def plan_compaction(turns: list, summary: str, question: str,
+                    budget: int = CONTEXT_TOKEN_BUDGET, low_water: float = CONTEXT_LOW_WATER) -> list:
+  """
+  上下文超过 budget 时, 从第二轮开始依次移出, 直到不超过 budget * low_water
+  第一轮总是保留, 只剩第一轮时即使仍然超过上限也不再移出
+  :return: 需要移出的轮次
+  """
+  total = messages_tokens(build_messages(turns, summary)) + estimate_tokens(question)
+  if total <= budget:
+    return []
+  dropped = []
+  for turn in turns[1:]:
+    if total <= budget * low_water:
+      break
+    dropped.append(turn)
+    total -= turn["tokens"]
+  return dropped
+
+async def summarize(session, summary: str, turns: list):
+  """
+  把之前的摘要和移出的轮次合并为新的摘要, 使用 Session 的默认模型
+  :return: engine.Reply
+  """
+  from prompts import Conversation_prompt
+  from metrics import Request_Trace, Metrics_Store
+  text = "\n\n".join(f"问: {turn['question']}\n答: {turn['answer']}" for turn in turns)
+  reply = await session.complete(Conversation_prompt.summarize.value.format(summary = summary or "无", turns = text))
+  # 生成摘要的请求同样计入指标和用量账本
+  trace = Request_Trace("conversation_summary", reply.model)
+  trace.from_reply(reply)
+  Metrics_Store().append([trace.record()])
+  return reply
+
+def resolve_conversation(store: Conversation_Store, name: str = None) -> tuple:
+  """
+  找到要继续的对话
+  :param name: --session 指定的名称, 为 None 时继续最近的对话
+  :return: (对话, 提示信息), 需要新建对话时对话为 None
+  """
+  if name:
+    conversation = store.get(name)
+    if conversation is None:
+      return None, f"新建对话 {name}"
+    return conversation, f"继续对话 {name}"
+  latest = store.latest()
+  last = load_last_query()
+  if last is not None and (latest is None or last["ts"] > latest["updated"]):
+    # 最近一次单独提问比最近的对话更新, 以它作为第一轮
+    from templates import render_prompt
+    try:
+      prompt = render_prompt(last["mode"], last["question"])
+    except KeyError:
+      prompt = last["question"] # 使用的用户模板已经删除
+    conversation = store.create(None, last["mode"], last["question"], prompt, last["answer"])
+    return conversation, f"继续最近的提问: {last['question'][:40]}"
+  if latest is not None:
+    return latest, f"继续对话 {conversation_label(latest)}"
+  return None, "没有可以继续的对话, 作为新的对话开始"
+
+def format_context(turn_number: int, sent: int, naive: int) -> str:
+  """一轮追问的上下文大小, 以及与每次都发送完整历史相比节省的 token 数"""
+  saved = naive - sent
+  return f"上下文: 第 {turn_number} 轮 || 发送约 {sent} tokens, 完整历史约 {naive} tokens, 节省 {saved} ({saved / naive:.0%})"
+
+def format_conversations(conversations: list) -> str:
+  """列出对话, 以及扣除生成摘要的 token 数之后累计节省的 token 数"""
+  from datetime import datetime
+  lines = []
+  for conversation in conversations:
+    saved = conversation["naive_tokens"] - conversation["sent_tokens"] - conversation["summary_tokens"]
+    updated = datetime.fromtimestamp(conversation["updated"]).strftime("%Y-%m-%d %H:%M")
+    lines.append(
+      f"{conversation_label(conversation):<16}{conversation['mode']:<18}{conversation['turn_count']:>4} 轮  {updated}"
+      f"  发送 {conversation['sent_tokens']} / 完整历史 {conversation['naive_tokens']} tokens, "
+      f"摘要 {conversation['summary_tokens']}, 节省 {saved}"
+    )
+  lines.append(f"共 {len(conversations)} 个对话")
+  return "\n".join(lines)
+
+async def run_conversation(session, args, prompt_type, timing = None) -> None:
+  """
+  ds --continue / ds --session NAME 的入口
+  :param prompt_type: 新建对话时第一轮使用的提示词类型, 继续已有的对话时不使用
+  """
+  from commands import send_messages
+  from engine import RequestError
+  from metrics import Request_Trace, Metrics_Store
+  from router import Model_Router
+  from templates import render_prompt
+
+  question = ' '.join(args.text)
+  with Conversation_Store() as store:
+    conversation, note = resolve_conversation(store, args.session)
+    print(f"{GREEN_DOT} {note}")
+    if conversation is None:
+      mode = mode_name(prompt_type)
+      prompt = render_prompt(prompt_type, question)
+      history = None
+    else:
+      mode = conversation["mode"]
+      prompt = question
+      turns = store.turns(conversation["id"])
+      dropped = plan_compaction(turns, conversation["summary"], question)
+      if dropped:
+        print(f"上下文超过 {CONTEXT_TOKEN_BUDGET} tokens, 正在把较早的 {len(dropped)} 轮压缩为摘要...")
+        try:
+          reply = await summarize(session, conversation["summary"], dropped)
+          conversation["summary"] = reply.answer.strip()
+          store.compact(conversation["id"], [turn["id"] for turn in dropped], conversation["summary"], reply.tokens_used)
+        except RequestError as e:
+          # 摘要失败时保留之前的摘要, 这几轮仍然移出, 保证请求不超过上限
+          print(f"{RED_DOT} 生成摘要失败, 直接移出较早的轮次: {e}")
+          store.compact(conversation["id"], [turn["id"] for turn in dropped], conversation["summary"], 0)
+        dropped_ids = {turn["id"] for turn in dropped}
+        turns = [turn for turn in turns if turn["id"] not in dropped_ids]
+      history = build_messages(turns, conversation["summary"])
+
+    route = Model_Router().choose(mode, args.model, hedge = not args.no_hedge)
+    trace = Request_Trace(mode, route.model)
+    answer, _, _ = await send_messages(
+      session, question, prompt, mode, not args.stream_false, not args.no_typewriter, timing, args.timing, trace, route,
+      history
+    )
+    Metrics_Store().append([trace.record()])
+    if not answer:
+      print(f"\n{RED_DOT} 未能获取有效的回答, 本轮没有加入对话")
+      return
+    if conversation is None:
+      conversation = store.create(args.session, mode, question, prompt, answer)
+      command = f"ds --session {args.session}" if args.session else "ds --continue"
+      print(f"对话 {conversation_label(conversation)} 已保存, 使用 {command} 继续追问")
+      return
+    sent = messages_tokens(history) + estimate_tokens(prompt)
+    naive = store.total_tokens(conversation["id"]) + estimate_tokens(prompt)
+    store.add_turn(conversation["id"], question, prompt, answer, naive, sent)
+    print(format_context(len(store.turns(conversation["id"], active_only = False)), sent, naive))
+
+def main():
+  print("conversation主程序已运行!")
+
+if __name__ == "__main__":
+  main()
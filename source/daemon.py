@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# 常驻进程
+# ds --daemon 启动一个常驻进程, 提前导入 openai、创建客户端并建立连接, 在 Unix 套接字上等待请求
+# 之后的 ds 命令把请求转发给常驻进程, 由常驻进程复用已经建立好的连接, 并把回答逐段传回
+# 省去了每次启动时导入 openai、DNS 查询和 TLS 握手的时间
+# 多个 ds 同时发起完全相同的请求时, 常驻进程只向 API 发起一次请求, 并把结果同时传给所有等待的客户端
+# 错峰时段内定期执行 ds prefetch 加入的预取任务(见 prefetch.py)
+#
+# 通信协议: 每行一个 JSON 对象
+#   客户端 -> 常驻进程: {"params": {...请求参数...}, "hedge_after": 对冲等待时间或 null}
+#   常驻进程 -> 客户端: {"type": "chunk", "text": "..."} 回答的一段内容
+#                       {"type": "finish"}                回答内容已完整
+#                       {"type": "done", ...}             请求结束, 附带用量等信息
+#                       {"type": "error", "message": "..."}
+
+import os
+import sys
+import json
+import time
+import asyncio
+
+from engine import Session, Reply, RequestError
+from log import get_current_time
+from utils import GREEN_DOT, RED_DOT
+
+SOCKET_PATH = os.path.join(
+  os.getenv("XDG_RUNTIME_DIR") or "/tmp",
+  f"ds-{os.getuid() if hasattr(os, 'getuid') else 'user'}.sock"
+)
+# 空闲连接保留的时间(秒)
+KEEPALIVE = 300.0
+# 空闲时每隔多久请求一次模型列表, 避免连接被服务器关闭
+WARM_INTERVAL = 60.0
+# 最后一次请求之后, 继续保持连接的时间(秒)
+WARM_WINDOW = 1800.0
+# 每隔多久检查一次是否处于错峰时段以及预取队列中是否有任务(秒)
+PREFETCH_INTERVAL = 300.0
+
+class Daemon_Unavailable(Exception):
+  """常驻进程没有运行"""
+
+def _encode(message: dict) -> bytes:
+  return (json.dumps(message, ensure_ascii = False) + "\n").encode("utf-8")
+
+async def request_via_daemon(socket_path: str, params: dict, on_chunk = None, on_finish = None, hedge_after: float = None) -> Reply:
+  """
+  把请求转发给常驻进程
+  :param socket_path: Unix 套接字路径, None 时使用默认路径
+  :param params: 请求参数, 与 chat.completions.create 的参数相同
+  :param hedge_after: 常驻进程发出对冲请求的等待时间(秒), None 表示不对冲
+  :return: 请求结果
+  """
+  socket_path = socket_path or SOCKET_PATH
+  if not os.path.exists(socket_path):
+    raise Daemon_Unavailable(socket_path)
+  try:
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit = 2 ** 20)
+  except OSError as e:
+    raise Daemon_Unavailable(str(e)) from e
+
+  reply = Reply(get_current_time(), params.get("model"))
+  reply.via = "daemon"
+  try:
+    writer.write(_encode({"params": params, "hedge_after": hedge_after}))
+    await writer.drain()
+    reply.sent_at = time.perf_counter()
+    parts = []
+    while True:
+      line = await reader.readline()
+      if not line:
+        raise RequestError("常驻进程意外断开连接")
+      message = json.loads(line)
+      kind = message.get("type")
+      if kind == "chunk":
+        reply.mark_chunk()
+        parts.append(message["text"])
+        if on_chunk is not None:
+          on_chunk(message["text"])
+      elif kind == "finish":
+        if on_finish is not None:
+          on_finish()
+      elif kind == "done":
+        reply.finished_at = time.perf_counter()
+        reply.answer = "".join(parts)
+        reply.tokens_used = message.get("tokens_used", 0)
+        reply.usage = message.get("usage")
+        reply.finish_reason = message.get("finish_reason")
+        reply.request_time = message.get("request_time", reply.request_time)
+        reply.model = message.get("model", reply.model)
+        reply.attempts = message.get("attempts", 1)
+        reply.retries = message.get("retries", 0)
+        reply.hedged = message.get("hedged", False)
+        return reply
+      elif kind == "error":
+        raise RequestError(message.get("message", "常驻进程请求失败"))
+  finally:
+    writer.close()
+
+class _Inflight:
+  """
+  一个正在进行中的请求, 可以有多个客户端同时等待
+  后加入的客户端会先收到已经产生的内容, 再接着收到后续内容
+  """
+  def __init__(self):
+    self.history = []
+    self.queues = []
+
+  def subscribe(self) -> asyncio.Queue:
+    queue = asyncio.Queue()
+    for message in self.history:
+      queue.put_nowait(message)
+    self.queues.append(queue)
+    return queue
+
+  def unsubscribe(self, queue: asyncio.Queue) -> None:
+    if queue in self.queues:
+      self.queues.remove(queue)
+
+  def publish(self, message: dict) -> None:
+    self.history.append(message)
+    for queue in self.queues:
+      queue.put_nowait(message)
+
+class Daemon:
+  def __init__(self, session: Session, socket_path: str = None):
+    """
+    :param session: 常驻进程使用的请求会话
+    :param socket_path: Unix 套接字路径
+    """
+    self.session = session
+    self.socket_path = socket_path or SOCKET_PATH
+    self.inflight = {}
+    self.tasks = set() # 保存进行中的请求任务, 避免被垃圾回收
+    self.last_request = time.monotonic()
+    self.requests = 0
+    self.coalesced = 0
+
+  async def warm_up(self) -> None:
+    """请求一次模型列表, 提前完成 DNS 查询和 TLS 握手"""
+    try:
+      await self.session.client.models.list()
+    except Exception as e:
+      print(f"{RED_DOT} 预热连接失败: {e}", flush = True)
+
+  async def keep_warm(self) -> None:
+    """空闲时定期请求模型列表, 在最后一次请求后的一段时间内保持连接"""
+    while True:
+      await asyncio.sleep(WARM_INTERVAL)
+      if time.monotonic() - self.last_request < WARM_WINDOW:
+        await self.warm_up()
+
+  async def prefetch_loop(self) -> None:
+    """错峰时段内定期执行预取队列中的任务, 中断后未完成的任务留在队列中"""
+    from router import Model_Router
+    from prefetch import QUEUE_FILE, Prefetch_Queue, drain, format_result
+    router = Model_Router()
+    while True:
+      await asyncio.sleep(PREFETCH_INTERVAL)
+      # 没有使用过 ds prefetch 时不创建队列文件
+      if not os.path.exists(QUEUE_FILE) or not router.is_off_peak():
+        continue
+      try:
+        with Prefetch_Queue() as queue:
+          if not queue.counts()["pending"]:
+            continue
+          # 每次执行使用新的 Model_Router, 根据最近的请求情况选择模型
+          stats = await drain(self.session, queue, progress = False)
+      except Exception as e:
+        print(f"{RED_DOT} 预取失败: {e}", flush = True)
+        continue
+      if stats["done"] or stats["skipped"] or stats["failed"]:
+        print(f"{GREEN_DOT} 预取: {format_result(stats)}", flush = True)
+
+  async def _produce(self, key: str, params: dict, inflight: _Inflight, hedge_after: float = None) -> None:
+    """向 API 发起请求, 把结果发布给所有等待的客户端"""
+    try:
+      reply = await self.session.stream_params(
+        params,
+        on_chunk = lambda text: inflight.publish({"type": "chunk", "text": text}),
+        on_finish = lambda: inflight.publish({"type": "finish"}),
+        hedge_after = hedge_after
+      )
+      inflight.publish({
+        "type": "done",
+        "tokens_used": reply.tokens_used,
+        "finish_reason": reply.finish_reason,
+        "usage": reply.usage,
+        "request_time": reply.request_time,
+        "model": reply.model,
+        "attempts": reply.attempts,
+        "retries": reply.retries,
+        "hedged": reply.hedged
+      })
+    except Exception as e:
+      inflight.publish({"type": "error", "message": str(e)})
+    finally:
+      self.inflight.pop(key, None)
+
+  async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """处理一个客户端连接"""
+    queue = None
+    inflight = None
+    try:
+      line = await reader.readline()
+      if not line:
+        return
+      message = json.loads(line)
+      params = message["params"]
+      self.requests += 1
+      self.last_request = time.monotonic()
+      key = json.dumps(params, ensure_ascii = False, sort_keys = True)
+      inflight = self.inflight.get(key)
+      if inflight is None:
+        inflight = self.inflight[key] = _Inflight()
+        queue = inflight.subscribe()
+        task = asyncio.create_task(self._produce(key, params, inflight, message.get("hedge_after")))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+      else:
+        self.coalesced += 1
+        queue = inflight.subscribe()
+      while True:
+        message = await queue.get()
+        writer.write(_encode(message))
+        await writer.drain()
+        if message["type"] in ("done", "error"):
+          break
+    except (ConnectionError, ValueError, KeyError):
+      pass # 客户端断开或请求格式错误, 请求本身继续进行, 其他等待的客户端不受影响
+    finally:
+      if inflight is not None and queue is not None:
+        inflight.unsubscribe(queue)
+      writer.close()
+
+  async def serve(self) -> None:
+    """启动常驻进程, 直到被中断"""
+    if os.path.exists(self.socket_path):
+      try:
+        _, writer = await asyncio.open_unix_connection(self.socket_path)
+        writer.close()
+        raise RuntimeError(f"常驻进程已经在运行: {self.socket_path}")
+      except OSError:
+        os.remove(self.socket_path) # 上次没有正常退出留下的套接字文件
+    server = await asyncio.start_unix_server(self.handle, path = self.socket_path, limit = 2 ** 20)
+    os.chmod(self.socket_path, 0o600) # 只允许当前用户使用, 请求会使用该用户的 API 密钥
+    await self.warm_up()
+    warm_task = asyncio.create_task(self.keep_warm())
+    prefetch_task = asyncio.create_task(self.prefetch_loop())
+    print(f"{GREEN_DOT} 常驻进程已启动: {self.socket_path}", flush = True)
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      warm_task.cancel()
+      prefetch_task.cancel()
+      await self.session.close()
+      if os.path.exists(self.socket_path):
+        os.remove(self.socket_path)
+      print(f"\n常驻进程已退出, 共处理 {self.requests} 个请求, 其中 {self.coalesced} 个与进行中的相同请求合并")
+
+def run_daemon(socket_path: str = None, **session_kwargs) -> None:
+  """
+  在前台运行常驻进程, Ctrl+C 退出
+  :param session_kwargs: 传给 Session 的参数, 例如 base_url
+  """
+  session = Session(keepalive = KEEPALIVE, max_concurrency = 64, **session_kwargs)
+  try:
+    asyncio.run(Daemon(session, socket_path).serve())
+  except KeyboardInterrupt:
+    pass
+  except RuntimeError as e:
+    print(f"{RED_DOT} {e}")
+    sys.exit(1)
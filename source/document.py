@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+# 长文档翻译: ds -tr --file doc.txt (传入 - 则从标准输入读取)
+# 整篇文档放在一个提示词中时, 译文会超过 max_tokens 被截断, 因此先在本地切分再分段翻译:
+#   切分  按段落(空行)切分, 段落过长时按句子切分, 句子过长时按长度切分, 每段的 token 数(本地估算)不超过上限
+#   翻译  多段同时请求, 同时进行的请求数有上限; 译文仍被截断(finish_reason 为 length)时把这一段分成两半重新翻译
+#   输出  按原文顺序输出, 前面的段落全部完成后立即输出, 不必等整篇完成
+#   断点  每段的译文完成后保存到 data/checkpoints.db, 中断后重新运行同一命令时已完成的段落直接使用保存的译文
+# 边读边切分, 等待输出的段落数也有上限, 内存占用与文档大小无关
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import hashlib
+from collections import deque
+
+from config import DATA_DIR, DOCUMENT_CHUNK_TOKENS
+from templates import render_prompt, template_key
+from utils import CLEAN_SEQ, RED_DOT, estimate_tokens
+
+CHECKPOINT_FILE = os.path.join(DATA_DIR, "checkpoints.db")
+# 保存的译文的有效期
+CHECKPOINT_TTL = 30 * 24 * 3600
+# 每次最多读取的字符数, 没有换行的超长文本也不会一次读入内存
+READ_LIMIT = 64 * 1024
+# 积累多少条请求记录后写入一次 metrics.jsonl
+TRACE_FLUSH = 200
+# 句末标点, 其后为句子的边界
+SENTENCE_END = frozenset(".!?。！？…")
+# 句末标点之后可以跟随的引号和括号
+CLOSING = frozenset("\"'”’)）」』]")
+
+def read_paragraphs(file, max_tokens: int):
+  """
+  逐段读取文本, 空行为段落的边界
+  没有空行的文本超过 max_tokens 的 4 倍时也作为一段, 保证每次只在内存中保留有限的内容
+  :return: 生成器, 每次返回一个段落
+  """
+  lines = []
+  size = 0
+  for line in iter(lambda: file.readline(READ_LIMIT), ""):
+    if not line.strip():
+      if lines:
+        yield "".join(lines).strip()
+        lines, size = [], 0
+      continue
+    lines.append(line)
+    size += estimate_tokens(line)
+    if size > max_tokens * 4:
+      yield "".join(lines).strip()
+      lines, size = [], 0
+  if lines:
+    yield "".join(lines).strip()
+
+def split_sentences(paragraph: str) -> list:
+  """按句末标点切分, 标点和其后的引号、括号留在前一句"""
+  sentences = []
+  start = 0
+  index = 0
+  while index < len(paragraph):
+    if paragraph[index] in SENTENCE_END:
+      end = index + 1
+      while end < len(paragraph) and (paragraph[end] in SENTENCE_END or paragraph[end] in CLOSING):
+        end += 1
+      # 英文句号之后需要有空白, 避免切开 3.14 和 e.g. 这样的写法
+      if paragraph[index] in ".!?" and end < len(paragraph) and not paragraph[end].isspace():
+        index = end
+        continue
+      sentences.append(paragraph[start:end])
+      start = index = end
+      continue
+    index += 1
+  if start < len(paragraph):
+    sentences.append(paragraph[start:])
+  return [sentence for sentence in sentences if sentence.strip()]
+
+def split_by_size(text: str, max_tokens: int) -> list:
+  """按长度切分没有句末标点的超长句子, 尽量在空白处切开"""
+  pieces = []
+  while estimate_tokens(text) > max_tokens:
+    # 全部为中文时每个 token 约 1.7 个字符, 按这个比例取一段, 保证不超过上限
+    cut = max(1, int(max_tokens / 0.6))
+    space = text.rfind(" ", cut // 2, cut)
+    cut = space + 1 if space > 0 else cut
+    pieces.append(text[:cut])
+    text = text[cut:]
+  if text.strip():
+    pieces.append(text)
+  return pieces
+
+def split_units(paragraph: str, max_tokens: int) -> list:
+  """
+  把过长的段落切分为不超过 max_tokens 的片段
+  :return: [(片段, 与前一个片段之间的分隔符)], 第一个片段的分隔符为空行
+           同一段落中的片段保留了原文中的空白, 直接拼接即可还原
+  """
+  if estimate_tokens(paragraph) <= max_tokens:
+    return [(paragraph, "\n\n")]
+  units = []
+  for sentence in split_sentences(paragraph):
+    for piece in split_by_size(sentence, max_tokens):
+      units.append((piece, "" if units else "\n\n"))
+  return units
+
+def split_chunks(file, max_tokens: int = DOCUMENT_CHUNK_TOKENS):
+  """
+  把文档切分为不超过 max_tokens 的段落组, 尽量保持段落完整
+  :param file: 文本文件对象
+  :return: 生成器, 每次返回一段需要翻译的文本
+  """
+  parts = []
+  tokens = 0
+  for paragraph in read_paragraphs(file, max_tokens):
+    for unit, separator in split_units(paragraph, max_tokens):
+      size = estimate_tokens(unit)
+      if parts and tokens + size > max_tokens:
+        yield "".join(parts).strip()
+        parts, tokens = [], 0
+      parts.append((separator if parts else "") + unit)
+      tokens += size
+  if parts:
+    yield "".join(parts).strip()
+
+def split_in_half(text: str) -> list:
+  """
+  把一段文本分成大致相等的两半, 用于译文被截断时重新翻译
+  :return: 两段文本, 无法再分时返回空列表
+  """
+  separator = "\n\n" if "\n\n" in text else ""
+  units = text.split("\n\n") if separator else split_sentences(text)
+  if len(units) < 2:
+    units = split_by_size(text, max(1, estimate_tokens(text) // 2))
+  if len(units) < 2:
+    return []
+  total = sum(estimate_tokens(unit) for unit in units)
+  size = 0
+  for index, unit in enumerate(units[:-1], start = 1):
+    size += estimate_tokens(unit)
+    if size >= total / 2:
+      break
+  return [separator.join(units[:index]).strip(), separator.join(units[index:]).strip()]
+
+class Checkpoint_Store:
+  """
+  已完成的段落的译文, 按提示词模板和原文的摘要保存, 与使用的模型无关
+  同一段原文在其他文档中出现时也可以直接使用
+  """
+  def __init__(self, checkpoint_file: str = None, ttl: float = CHECKPOINT_TTL):
+    """
+    :param checkpoint_file: 数据库路径, 默认为 ../data/checkpoints.db
+    :param ttl: 译文的有效期(秒), 过期的记录在打开时删除
+    """
+    self.checkpoint_file = checkpoint_file or CHECKPOINT_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_file)), exist_ok = True)
+    self.conn = sqlite3.connect(self.checkpoint_file, timeout = 10)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    with self.conn:
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunks (key TEXT PRIMARY KEY, answer TEXT, model TEXT, tokens INTEGER, ts REAL)"
+      )
+      self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_ts ON chunks(ts)")
+      self.conn.execute("DELETE FROM chunks WHERE ts < ?", (time.time() - ttl,))
+
+  def close(self) -> None:
+    self.conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc) -> None:
+    self.close()
+
+  @staticmethod
+  def key(prompt_type, text: str) -> str:
+    return hashlib.sha256(f"{template_key(prompt_type)}\n{text}".encode("utf-8")).hexdigest()
+
+  def get(self, key: str) -> str:
+    row = self.conn.execute("SELECT answer FROM chunks WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+  def put(self, key: str, answer: str, model: str, tokens: int) -> None:
+    with self.conn:
+      self.conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", (key, answer, model, tokens, time.time()))
+
+def show_progress(stats: dict) -> None:
+  """在标准错误输出中刷新进度, 不影响标准输出中的译文"""
+  sys.stderr.write(f"{CLEAN_SEQ}翻译进度: 已输出 {stats['written']} 段, 进行中 {stats['running']} 段, "
+                   f"失败 {stats['failed']} 段 || 使用的token数: {stats['tokens']}")
+  sys.stderr.flush()
+
+async def translate_document(session,
+                             file,
+                             prompt_type,
+                             concurrency: int = 4,
+                             model: str = None,
+                             use_checkpoints: bool = True,
+                             refresh: bool = False,
+                             max_tokens: int = DOCUMENT_CHUNK_TOKENS,
+                             output = None) -> dict:
+  """
+  分段翻译长文档, 按原文顺序输出译文
+  :param session: engine.Session
+  :param file: 文本文件对象
+  :param prompt_type: 提示词类型, 一般为 Translator.document_translate
+  :param concurrency: 同时进行的请求数
+  :param model: 指定使用的模型, 为 None 时由 router 选择
+  :param use_checkpoints: 是否读取和保存已完成的段落
+  :param refresh: 忽略已保存的译文重新翻译
+  :param max_tokens: 每段原文的 token 上限(本地估算)
+  :param output: 译文的输出位置, 默认为标准输出
+  :return: {"chunks", "written", "resumed", "split", "failed", "tokens"}
+  """
+  from metrics import Request_Trace, Metrics_Store
+  from query_log import mode_name
+  from router import Model_Router
+
+  output = output or sys.stdout
+  mode = mode_name(prompt_type)
+  route = Model_Router().choose(mode, model)
+  checkpoints = Checkpoint_Store() if use_checkpoints else None
+  semaphore = asyncio.Semaphore(max(1, concurrency))
+  stats = {"chunks": 0, "written": 0, "running": 0, "resumed": 0, "split": 0, "failed": 0, "tokens": 0}
+  traces = []
+
+  def record_trace(trace) -> None:
+    """分批写入请求记录, 不在内存中保留整篇文档的记录"""
+    traces.append(trace.record())
+    if len(traces) >= TRACE_FLUSH:
+      Metrics_Store().append(traces)
+      traces.clear()
+
+  async def translate(text: str) -> str:
+    key = Checkpoint_Store.key(prompt_type, text)
+    if checkpoints is not None and not refresh:
+      answer = checkpoints.get(key)
+      if answer is not None:
+        stats["resumed"] += 1
+        return answer
+    trace = Request_Trace(mode, route.model)
+    async with semaphore:
+      try:
+        reply = await session.complete(render_prompt(prompt_type, text), model = route.model)
+      except Exception:
+        trace.ok = False
+        record_trace(trace)
+        raise
+    trace.from_reply(reply)
+    record_trace(trace)
+    stats["tokens"] += reply.tokens_used
+    halves = split_in_half(text) if reply.finish_reason == "length" else []
+    if halves:
+      # 译文被截断, 分成两半重新翻译, 每一半同样可能继续切分
+      stats["split"] += 1
+      answer = "\n\n".join(await asyncio.gather(*(translate(half) for half in halves)))
+    else:
+      answer = reply.answer.strip()
+    if checkpoints is not None and answer:
+      checkpoints.put(key, answer, route.model, reply.tokens_used)
+    return answer
+
+  async def run(text: str) -> str:
+    stats["running"] += 1
+    try:
+      return await translate(text)
+    finally:
+      stats["running"] -= 1
+
+  def write(index: int, task: asyncio.Task) -> None:
+    try:
+      answer = task.result()
+    except Exception as e:
+      stats["failed"] += 1
+      answer = f"[第 {index} 段翻译失败, 重新运行同一命令可以从这里继续: {e}]"
+    sys.stderr.write(CLEAN_SEQ)
+    output.write(("\n\n" if stats["written"] else "") + answer)
+    output.flush()
+    stats["written"] += 1
+    show_progress(stats)
+
+  # 按原文顺序排列的任务, 最多同时有 concurrency 的两倍在等待输出, 前面的段落较慢时后面的段落也不会无限堆积
+  window = deque()
+  try:
+    for index, text in enumerate(split_chunks(file, max_tokens), start = 1):
+      stats["chunks"] = index
+      window.append((index, asyncio.create_task(run(text))))
+      while len(window) >= max(1, concurrency) * 2 or (window and window[0][1].done()):
+        head_index, head = window.popleft()
+        await asyncio.wait([head])
+        write(head_index, head)
+    while window:
+      head_index, head = window.popleft()
+      await asyncio.wait([head])
+      write(head_index, head)
+  finally:
+    for _, task in window:
+      task.cancel()
+    sys.stderr.write(CLEAN_SEQ)
+    output.write("\n")
+    output.flush()
+    if checkpoints is not None:
+      checkpoints.close()
+    if traces:
+      Metrics_Store().append(traces)
+  return stats
+
+def format_result(stats: dict) -> str:
+  notes = [f"共 {stats['chunks']} 段"]
+  if stats["resumed"]:
+    notes.append(f"{stats['resumed']} 段使用已保存的译文")
+  if stats["split"]:
+    notes.append(f"{stats['split']} 段因译文被截断分开翻译")
+  notes.append(f"失败 {stats['failed']} 段")
+  return f"{', '.join(notes)} || 使用的token数: {stats['tokens']}"
+
+def open_document(path: str):
+  """:param path: 文件路径, "-" 表示标准输入"""
+  if path == "-":
+    return sys.stdin
+  return open(path, "r", encoding = "utf-8")
+
+async def run_document(session, args, prompt_type) -> None:
+  """ds -tr --file 的入口"""
+  try:
+    file = open_document(args.file)
+  except OSError as e:
+    print(f"{RED_DOT} 无法读取文件: {e}")
+    return
+  try:
+    stats = await translate_document(session, file, prompt_type, args.concurrency, args.model,
+                                     use_checkpoints = not args.no_cache, refresh = args.refresh)
+  finally:
+    if file is not sys.stdin:
+      file.close()
+  print(format_result(stats), file = sys.stderr)
+
+def main():
+  print("document主程序已运行!")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+# 异步请求引擎
+# Session 自己持有客户端和并发控制, 不依赖任何模块级的全局状态
+# 同一个 Session 可以同时发起多个请求, 也可以在其他程序中直接作为库使用:
+#
+#   async with Session() as session:
+#     reply = await session.complete("你好")
+#     print(reply.answer)
+#
+# use_daemon 为 True 时, 请求优先转发给 ds --daemon 启动的常驻进程(见 daemon.py)
+# 常驻进程没有运行时自动改为直接请求
+
+import os
+import sys
+import time
+import asyncio
+
+from log import get_current_time
+from config import BASE_URL, MODEL, TEMPERATURE, MAX_TOKENS, MODEL_MAX_TOKENS, REQUEST_TIMEOUT
+from resilience import Retry_Policy, Race, Deadline_Exceeded, is_retryable, retry_after
+
+class RequestError(Exception):
+  """请求失败, 包括网络错误, API 返回的错误和超时"""
+
+def usage_dict(usage) -> dict:
+  """将 openai 返回的用量对象转换为普通字典, 方便序列化"""
+  if usage is None:
+    return None
+  if hasattr(usage, "model_dump"):
+    return usage.model_dump(exclude_none = True)
+  return dict(usage)
+
+class Reply:
+  """
+  一次请求的结果
+  """
+  def __init__(self, request_time: str, model: str):
+    self.request_time = request_time
+    self.model = model
+    self.answer = ""
+    self.tokens_used = 0
+    self.usage = None # 用量统计字典, 如 prompt_tokens, completion_tokens, total_tokens
+    self.finish_reason = None # 结束原因, 回答因为 max_tokens 被截断时为 length
+    self.via = "api" # 直接请求 API 为 api, 通过常驻进程为 daemon
+    # 以下时间点均为 time.perf_counter, 用于统计启动耗时和各阶段耗时(见 metrics.py)
+    self.sent_at = None # 请求实际发出
+    self.connected_at = None # 收到响应头
+    self.first_token_at = None # 收到第一段内容
+    self.last_token_at = None # 收到最后一段内容
+    self.finished_at = None # 请求结束
+    self.gaps = [] # 相邻两段内容之间的间隔(秒)
+    self.attempts = 1 # 实际发出的请求数, 包括重试和对冲
+    self.retries = 0
+    self.hedged = False # 是否发出了对冲请求
+
+  @property
+  def prompt_cache(self) -> tuple:
+    """
+    提示词中命中和未命中服务器缓存的 token 数
+    :return: (命中, 未命中), 接口没有返回时为 None
+    """
+    usage = self.usage or {}
+    if "prompt_cache_hit_tokens" not in usage:
+      return None
+    return usage["prompt_cache_hit_tokens"], usage.get("prompt_cache_miss_tokens", 0)
+
+  def mark_chunk(self) -> None:
+    """收到一段内容时记录时间"""
+    now = time.perf_counter()
+    if self.first_token_at is None:
+      self.first_token_at = now
+    else:
+      self.gaps.append(now - self.last_token_at)
+    self.last_token_at = now
+
+  def __repr__(self) -> str:
+    return f"Reply(model={self.model!r}, tokens_used={self.tokens_used}, answer={self.answer[:20]!r}...)"
+
+class Session:
+  def __init__(self,
+               api_key: str = None,
+               base_url: str = BASE_URL,
+               model: str = MODEL,
+               temperature: float = TEMPERATURE,
+               max_tokens: int = MAX_TOKENS,
+               timeout: float = REQUEST_TIMEOUT,
+               max_concurrency: int = 16,
+               keepalive: float = None,
+               use_daemon: bool = False,
+               socket_path: str = None,
+               retry: Retry_Policy = None):
+    """
+    :param api_key: API 密钥, 默认读取环境变量 DEEPSEEK_API_KEY
+    :param timeout: 单次请求的默认超时时间(秒), 包括重试
+    :param max_concurrency: 同时进行的最大请求数
+    :param keepalive: 空闲连接保留的时间(秒), 默认使用 openai 客户端的设置
+    :param use_daemon: 是否优先通过常驻进程发起请求
+    :param socket_path: 常驻进程的 Unix 套接字路径, 默认为 daemon.SOCKET_PATH
+    :param retry: 连接和首字超时以及重试的规则, 默认使用 config.py 中的设置
+    """
+    self.api_key = api_key or os.getenv('DEEPSEEK_API_KEY')
+    self.base_url = base_url
+    self.model = model
+    self.temperature = temperature
+    self.max_tokens = max_tokens
+    self.timeout = timeout
+    self.keepalive = keepalive
+    self.use_daemon = use_daemon
+    self.socket_path = socket_path
+    self.retry = retry or Retry_Policy()
+    self._semaphore = asyncio.Semaphore(max_concurrency)
+    self._client = None
+
+  @property
+  def client(self):
+    """
+    第一次请求时才创建客户端, 之后的请求复用同一个连接池
+    openai 导入需要数百毫秒, 因此只在真正发起请求时才导入
+    重试由 _resilient 负责, 关闭 openai 客户端自带的重试, 避免两层重试叠加
+    """
+    if self._client is None:
+      from openai import AsyncOpenAI, Timeout
+      self._client = AsyncOpenAI(
+        api_key = self.api_key,
+        base_url = self.base_url,
+        http_client = self._http_client(),
+        max_retries = 0,
+        timeout = Timeout(self.timeout, connect = self.retry.connect_timeout)
+      )
+    return self._client
+
+  def _http_client(self):
+    """
+    设置了 keepalive 时, 创建保留空闲连接更久的连接池, 支持 HTTP/2 时启用 HTTP/2
+    openai 使用的 httpx 不可用时返回 None, 使用 openai 的默认设置
+    """
+    if self.keepalive is None:
+      return None
+    try:
+      import httpx
+      from openai import DefaultAsyncHttpxClient
+    except ImportError:
+      return None
+    kwargs = {
+      "limits": httpx.Limits(max_connections = 100, max_keepalive_connections = 20, keepalive_expiry = self.keepalive)
+    }
+    try:
+      import h2 # noqa: F401 httpx 的 HTTP/2 支持需要 h2
+      kwargs["http2"] = True
+    except ImportError:
+      pass
+    return DefaultAsyncHttpxClient(**kwargs)
+
+  async def close(self) -> None:
+    """关闭连接池"""
+    if self._client is not None:
+      await self._client.close()
+      self._client = None
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info) -> None:
+    await self.close()
+
+  def _params(self, prompt: str, model: str = None, response_format: dict = None, history: list = None) -> dict:
+    model = model or self.model
+    params = {
+      "model": model,
+      "messages": [
+        *(history or []),
+        {"role": "user", "content": prompt}
+      ],
+      "temperature": self.temperature,
+      # 推理模型的思考过程也计入 max_tokens
+      "max_tokens": max(self.max_tokens, MODEL_MAX_TOKENS.get(model, 0))
+    }
+    if response_format is not None:
+      params["response_format"] = response_format
+    return params
+
+  async def stream(self, prompt: str, on_chunk = None, on_finish = None, model: str = None, timeout: float = None,
+                   hedge_after: float = None, history: list = None) -> Reply:
+    """
+    以流式传输发起请求
+    :param prompt: 完整的提示词
+    :param on_chunk: 每收到一段内容时调用 on_chunk(text)
+    :param on_finish: 收到结束标记(回答内容已完整)时调用 on_finish(), 早于用量统计和连接关闭
+    :param model: 使用的模型, 默认为 Session 的模型
+    :param timeout: 超时时间(秒), 包括重试, 默认为 Session 的超时时间
+    :param hedge_after: 超过该时间(秒)还没有收到第一段内容时发出对冲请求, None 表示不对冲
+    :param history: 多轮对话中之前的消息, 如 [{"role": "user", "content": ...}, {"role": "assistant", "content": ...}]
+    :return: 请求结果
+    """
+    return await self.stream_params(self._params(prompt, model, history = history), on_chunk, on_finish, timeout, hedge_after)
+
+  async def stream_params(self, params: dict, on_chunk = None, on_finish = None, timeout: float = None,
+                          hedge_after: float = None) -> Reply:
+    """
+    使用完整的请求参数以流式传输发起请求, 参数与 chat.completions.create 相同
+    """
+    if self.use_daemon:
+      reply = await self._via_daemon(params, on_chunk, on_finish, timeout, hedge_after)
+      if reply is not None:
+        return reply
+    return await self._run(self._resilient(params, True, on_chunk, on_finish, hedge_after), timeout)
+
+  async def complete(self, prompt: str, model: str = None, timeout: float = None, response_format: dict = None,
+                     hedge_after: float = None, history: list = None) -> Reply:
+    """
+    以非流式传输发起请求
+    :param response_format: 输出格式, 如 {"type": "json_object"}
+    :param history: 多轮对话中之前的消息
+    :return: 请求结果
+    """
+    params = self._params(prompt, model, response_format, history)
+    if self.use_daemon:
+      reply = await self._via_daemon(params, None, None, timeout, hedge_after)
+      if reply is not None:
+        return reply
+    return await self._run(self._resilient(params, False, None, None, hedge_after), timeout)
+
+  async def _resilient(self, params: dict, stream: bool, on_chunk, on_finish, hedge_after: float = None) -> Reply:
+    """
+    按 self.retry 的规则发起请求: 可以重试的错误在收到任何内容之前重试, 首字延迟过长时发出对冲请求
+    :return: 胜出的请求结果, 时间点从第一次发出请求开始计算
+    """
+    request_time = get_current_time()
+    sent_at = None
+    attempts = 0
+    for retry in range(self.retry.max_retries + 1):
+      race = Race()
+      replies = []
+
+      def launch() -> None:
+        reply = Reply(request_time, params["model"])
+        replies.append(reply)
+        race.tasks.append(asyncio.create_task(self._attempt(params, stream, reply, race, on_chunk, on_finish)))
+
+      launch()
+      try:
+        reply = await self._race(race, launch, hedge_after)
+      except Exception as e:
+        # 已经输出了部分内容时不能重试, 否则会重复输出
+        if race.winner is not None or not is_retryable(e) or retry == self.retry.max_retries:
+          raise
+        error = e
+      else:
+        reply.sent_at = sent_at or reply.sent_at
+        reply.attempts = attempts + len(replies)
+        reply.retries = retry
+        reply.hedged = len(replies) > 1
+        return reply
+      finally:
+        sent_at = sent_at or next((reply.sent_at for reply in replies if reply.sent_at is not None), None)
+        attempts += len(replies)
+        for task in race.tasks:
+          task.cancel()
+        # 等待落败的副本关闭连接, 避免留下未结束的任务
+        await asyncio.gather(*race.tasks, return_exceptions = True)
+      await asyncio.sleep(self.retry.backoff(retry, retry_after(error)))
+
+  async def _race(self, race: Race, launch, hedge_after: float = None) -> Reply:
+    """
+    等待请求的各个副本, 超过 hedge_after 还没有收到内容时再发出一个副本
+    :return: 胜出的副本, 全部失败时抛出最后一个错误
+    """
+    if hedge_after is not None:
+      started = asyncio.create_task(race.started.wait())
+      done, _ = await asyncio.wait([started, *race.tasks], timeout = hedge_after, return_when = asyncio.FIRST_COMPLETED)
+      started.cancel()
+      if not done:
+        launch()
+    error = None
+    pending = set(race.tasks)
+    while pending:
+      done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+      for task in done:
+        if task.cancelled():
+          continue
+        if task.exception() is not None:
+          error = task.exception()
+          # 胜出的副本在输出过程中失败, 其他副本已经取消
+          if task is race.winner_task:
+            raise error
+          continue
+        if task.result() is not None:
+          return task.result()
+    raise error if error is not None else RequestError("请求被取消")
+
+  async def _attempt(self, params: dict, stream: bool, reply: Reply, race: Race, on_chunk, on_finish) -> Reply:
+    """
+    请求的一个副本, 第一次收到内容(回答或者思考过程)时参与竞争, 未胜出时立即结束
+    :return: 请求结果, 未胜出时返回 None
+    """
+    client = self.client
+    reply.sent_at = time.perf_counter()
+    first_token_timeout = self.retry.first_token_timeout
+    if not stream:
+      response = await client.chat.completions.create(stream = False, **params)
+      # 非流式传输时回答一次性到达, 第一段内容的时间即为请求结束的时间
+      reply.connected_at = reply.first_token_at = reply.finished_at = time.perf_counter()
+      if not race.claim(reply):
+        return None
+      reply.answer = response.choices[0].message.content or ""
+      reply.finish_reason = response.choices[0].finish_reason
+      reply.usage = usage_dict(response.usage)
+      reply.tokens_used = response.usage.total_tokens if response.usage else 0
+      return reply
+
+    def remaining() -> float:
+      """距离首字超时还剩的时间"""
+      if first_token_timeout is None:
+        return None
+      left = first_token_timeout - (time.perf_counter() - reply.sent_at)
+      if left <= 0:
+        raise Deadline_Exceeded(f"{first_token_timeout} 秒内没有收到内容")
+      return left
+
+    parts = []
+    progressed = False # 收到了回答内容或者思考过程, 已经参与竞争
+    try:
+      response = await asyncio.wait_for(
+        client.chat.completions.create(stream = True, stream_options = {"include_usage": True}, **params),
+        remaining()
+      )
+      reply.connected_at = time.perf_counter()
+      async with response:
+        chunks = response.__aiter__()
+        while True:
+          try:
+            chunk = await (chunks.__anext__() if progressed else asyncio.wait_for(chunks.__anext__(), remaining()))
+          except StopAsyncIteration:
+            break
+          if chunk.usage is not None:
+            reply.usage = usage_dict(chunk.usage)
+            reply.tokens_used = chunk.usage.total_tokens
+          if not chunk.choices:
+            continue
+          delta = chunk.choices[0].delta
+          text = delta.content
+          # 推理模型先只输出思考过程, 收到思考过程就说明请求没有卡住, 不需要再发出对冲请求
+          if not progressed and (text or getattr(delta, "reasoning_content", None)):
+            if not race.claim(reply):
+              return None
+            progressed = True
+          if text:
+            reply.mark_chunk()
+            parts.append(text)
+            if on_chunk is not None:
+              on_chunk(text)
+          if chunk.choices[0].finish_reason is not None:
+            reply.finish_reason = chunk.choices[0].finish_reason
+            # 没有任何内容的回答也需要参与竞争
+            if not progressed and not race.claim(reply):
+              return None
+            progressed = True
+            if on_finish is not None:
+              on_finish()
+    except asyncio.TimeoutError:
+      raise Deadline_Exceeded(f"{first_token_timeout} 秒内没有收到内容")
+    if not progressed and not race.claim(reply):
+      return None
+    reply.finished_at = time.perf_counter()
+    reply.answer = "".join(parts)
+    return reply
+
+  async def _via_daemon(self, params: dict, on_chunk, on_finish, timeout: float = None, hedge_after: float = None) -> Reply:
+    """
+    通过常驻进程发起请求, 重试和对冲由常驻进程负责
+    :return: 请求结果, 常驻进程没有运行时返回 None, 并且本次会话不再尝试
+    """
+    from daemon import Daemon_Unavailable, request_via_daemon
+    try:
+      return await self._run(request_via_daemon(self.socket_path, params, on_chunk, on_finish, hedge_after), timeout)
+    except Daemon_Unavailable:
+      self.use_daemon = False
+      return None
+
+  async def _run(self, coroutine, timeout: float = None):
+    """在并发限制和超时时间内执行请求, 并将错误统一转换为 RequestError"""
+    async with self._semaphore:
+      try:
+        return await asyncio.wait_for(coroutine, timeout or self.timeout)
+      except asyncio.TimeoutError:
+        raise RequestError(f"请求超时 ({timeout or self.timeout} 秒)")
+      except Deadline_Exceeded as e:
+        raise RequestError(f"请求超时 ({e})") from e
+      except Exception as e:
+        # 重试之后仍然失败的 API 错误(如 5xx)也是请求失败, 而不是未知错误
+        # 没有导入过 openai 时(例如通过常驻进程请求), 错误不可能来自 openai, 也不必为此导入
+        openai = sys.modules.get("openai")
+        if openai is not None and isinstance(e, openai.APIError):
+          raise RequestError(str(e)) from e
+        raise
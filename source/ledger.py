@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# 用量账本: 每次请求的 token 用量和费用, 保存在 data/usage.db
+# 由 metrics.Metrics_Store 在写入指标记录时一并写入, 不需要在各个发起请求的地方分别记录
+#
+#   entries  每次请求一行: 时间, API 密钥标识, 模式, 模型, 提示词/命中缓存/回答的 token 数, 费用, 是否错峰
+#   rollups  按 (天/月, API 密钥标识, 模式, 模型) 汇总, 与 entries 在同一个事务中累加
+# ds --usage 只读取 rollups 中的几行, 耗时与历史记录的多少无关
+#
+# 费用按 config.MODEL_PRICES 在写入时计算, 错峰时段使用 config.OFF_PEAK_DISCOUNTS 的折扣, 之后调整价格不影响已有的记录
+# 日期按服务器时间(config.SERVER_TIMEZONE)划分, 与账单一致
+# 多人共用 API 密钥时, 用密钥的哈希前缀区分各个密钥的用量, 账本中不保存密钥本身
+
+import os
+import time
+import sqlite3
+import hashlib
+from datetime import datetime
+
+from config import DATA_DIR, MODEL_PRICES, OFF_PEAK_DISCOUNTS
+
+LEDGER_FILE = os.path.join(DATA_DIR, "usage.db")
+# 汇总的粒度和日期格式
+PERIODS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+COLUMNS = ("requests", "prompt", "cache_hit", "completion", "cost")
+
+def key_id(api_key: str = None) -> str:
+  """API 密钥的标识: sha256 的前 8 位, 没有密钥时为 -"""
+  api_key = api_key if api_key is not None else os.getenv("DEEPSEEK_API_KEY")
+  if not api_key:
+    return "-"
+  return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+def compute_cost(model: str, prompt: int, cache_hit: int, completion: int, off_peak: bool = False) -> float:
+  """
+  :return: 费用(元), 没有该模型的价格时为 0
+  """
+  prices = MODEL_PRICES.get(model)
+  if prices is None:
+    return 0.0
+  hit_price, miss_price, output_price = prices
+  cost = (cache_hit * hit_price + (prompt - cache_hit) * miss_price + completion * output_price) / 1_000_000
+  if off_peak:
+    cost *= OFF_PEAK_DISCOUNTS.get(model, 1.0)
+  return cost
+
+def server_time(ts: float) -> datetime:
+  from log import SERVER_TIMEZONE
+  return datetime.fromtimestamp(ts, SERVER_TIMEZONE)
+
+class Usage_Ledger:
+  def __init__(self, ledger_file: str = None):
+    """
+    :param ledger_file: 账本路径, 默认为 ../data/usage.db
+    """
+    self.ledger_file = ledger_file or LEDGER_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(self.ledger_file)), exist_ok = True)
+    self.conn = sqlite3.connect(self.ledger_file, timeout = 10)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    with self.conn:
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS entries ("
+        "id INTEGER PRIMARY KEY, ts REAL, key TEXT, mode TEXT, model TEXT, "
+        "prompt INTEGER, cache_hit INTEGER, completion INTEGER, cost REAL, off_peak INTEGER)"
+      )
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS rollups ("
+        "period TEXT, bucket TEXT, key TEXT, mode TEXT, model TEXT, requests INTEGER, "
+        "prompt INTEGER, cache_hit INTEGER, completion INTEGER, cost REAL, "
+        "PRIMARY KEY (period, bucket, key, mode, model)) WITHOUT ROWID"
+      )
+
+  def close(self) -> None:
+    self.conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def add(self, records: list, api_key: str = None) -> int:
+    """
+    记入多条指标记录(见 metrics.Request_Trace.record), 没有 token 用量的记录(如失败的请求)跳过
+    :param api_key: 请求使用的 API 密钥, 默认读取环境变量 DEEPSEEK_API_KEY
+    :return: 记入的条数
+    """
+    from router import in_windows
+    key = key_id(api_key)
+    entries = []
+    for record in records:
+      if "prompt_tokens" not in record:
+        continue
+      moment = server_time(record["ts"])
+      off_peak = in_windows(moment)
+      prompt, cache_hit, completion = record["prompt_tokens"], record.get("cache_hit") or 0, record["completion_tokens"]
+      cost = compute_cost(record.get("model"), prompt, cache_hit, completion, off_peak)
+      entries.append((moment, (record["ts"], key, record.get("mode"), record.get("model"),
+                               prompt, cache_hit, completion, cost, int(off_peak))))
+    if not entries:
+      return 0
+    with self.conn:
+      self.conn.executemany(
+        "INSERT INTO entries (ts, key, mode, model, prompt, cache_hit, completion, cost, off_peak) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [entry for _, entry in entries]
+      )
+      self.conn.executemany(
+        "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?) "
+        "ON CONFLICT (period, bucket, key, mode, model) DO UPDATE SET "
+        "requests = requests + 1, prompt = prompt + excluded.prompt, cache_hit = cache_hit + excluded.cache_hit, "
+        "completion = completion + excluded.completion, cost = cost + excluded.cost",
+        [(period, moment.strftime(fmt), *entry[1:4], *entry[4:8])
+         for moment, entry in entries for period, fmt in PERIODS.items()]
+      )
+    return len(entries)
+
+  def totals(self, period: str, start: str, end: str = None, mode: str = None, group_by: str = "mode, model") -> list:
+    """
+    汇总一段时间内的用量
+    :param period: day 或 month
+    :param start: 起始的日期(含), 格式见 PERIODS
+    :param end: 结束的日期(不含), None 表示不限制
+    :param group_by: 分组的列, 如 "mode, model", "bucket" 或 "key"
+    :return: [{分组列..., requests, prompt, cache_hit, completion, cost}]
+    """
+    sql = (f"SELECT {group_by}, SUM(requests), SUM(prompt), SUM(cache_hit), SUM(completion), SUM(cost) "
+           "FROM rollups WHERE period = ? AND bucket >= ?")
+    params = [period, start]
+    if end is not None:
+      sql += " AND bucket < ?"
+      params.append(end)
+    if mode is not None:
+      sql += " AND mode = ?"
+      params.append(mode)
+    cursor = self.conn.execute(sql + f" GROUP BY {group_by} ORDER BY {group_by}", params)
+    names = [column[0] for column in cursor.description[:-len(COLUMNS)]]
+    return [dict(zip(names + list(COLUMNS), row)) for row in cursor.fetchall()]
+
+def usage_range(since: float = None, until: float = None) -> tuple:
+  """
+  ds --usage 统计的范围, 默认为服务器时间的本月
+  :return: (粒度, 起始日期, 结束日期, 标题)
+  """
+  if since is None and until is None:
+    month = server_time(time.time()).strftime(PERIODS["month"])
+    return "month", month, None, f"{month} (服务器时间)"
+  start = server_time(since).strftime(PERIODS["day"]) if since is not None else "0000-00-00"
+  end = server_time(until).strftime(PERIODS["day"]) if until is not None else None
+  return "day", start, end, f"{start if since is not None else '最早'} 至 {end or '现在'} (服务器时间)"
+
+def format_row(label: str, row: dict) -> str:
+  # 中文在终端中占两个字符的宽度
+  width = 40 - sum(1 for char in label if ord(char) > 0x2e80)
+  return (f"  {label:<{width}}{row['requests']:>6}  {row['prompt']:>10}  {row['cache_hit']:>10}  "
+          f"{row['completion']:>10}  ¥{row['cost']:>9.4f}")
+
+def format_usage(ledger: Usage_Ledger, since: float = None, until: float = None, mode: str = None) -> str:
+  """按模式和模型汇总的用量和费用, 以及每天的合计和各个 API 密钥的合计"""
+  period, start, end, title = usage_range(since, until)
+  groups = ledger.totals(period, start, end, mode)
+  if not groups:
+    return f"{title} 没有用量记录"
+  header = f"  {'':<40}{'请求':>4}{'提示词':>9}{'命中缓存':>8}{'回答':>10}{'费用':>10}"
+  lines = [f"{title} 的用量", header]
+  for group in groups:
+    lines.append(format_row(f"{group['mode']} / {group['model']}", group))
+  total = {column: sum(group[column] for group in groups) for column in COLUMNS}
+  lines.append(format_row("合计", total))
+  days = ledger.totals("day", start if period == "day" else start + "-01", end, mode, "bucket")
+  if len(days) > 1:
+    lines += ["", "按天:"]
+    lines += [format_row(day["bucket"], day) for day in days]
+  keys = ledger.totals(period, start, end, mode, "key")
+  if len(keys) > 1:
+    lines += ["", "按 API 密钥 (sha256 前缀):"]
+    lines += [format_row(row["key"] + (" (当前)" if row["key"] == key_id() else ""), row) for row in keys]
+  return "\n".join(lines)
+
+def main():
+  print("ledger主程序已运行!")
+
+if __name__ == "__main__":
+  main()
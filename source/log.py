@@ -4,90 +4,140 @@
 # 对于查询的单词等, 使用另一个文件进行存储
 
 import os
-import re
+import time
 from datetime import datetime
-from zoneinfo import ZoneInfo
-from tzlocal import get_localzone
-from utils import append_dict_to_json
+from functools import lru_cache
+from word_book import Word_Book
+from query_log import Query_Log, LOG_DIR, mode_name
+from search import update_index
+from similar import update_similar
+from config import DATA_DIR, SERVER_TIMEZONE as SERVER_TIMEZONE_NAME
 
-# 保存时区
-LOCAL_ZONE = get_localzone()
-SERVER_TIMEZONE = ZoneInfo("Asia/Shanghai")
+# 时区 LOCAL_ZONE 和 SERVER_TIMEZONE 在第一次使用时才创建
+# 查询本地时区需要读取系统配置, 不应该拖慢 ds -h 或命中缓存这类不需要时间的路径
+@lru_cache(maxsize = None)
+def _zones() -> dict:
+  from zoneinfo import ZoneInfo
+  from tzlocal import get_localzone
+  return {"LOCAL_ZONE": get_localzone(), "SERVER_TIMEZONE": ZoneInfo(SERVER_TIMEZONE_NAME)}
 
-def get_current_time(timezone = LOCAL_ZONE) -> str:
+def __getattr__(name: str):
+  if name in ("LOCAL_ZONE", "SERVER_TIMEZONE"):
+    return _zones()[name]
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_current_time(timezone = "local") -> str:
   """
   获取当前时间
   :param timezone: 时区对象, 默认为本地时区
   :return: 当前时间字符串
   """
+  if timezone == "local":
+    timezone = _zones()["LOCAL_ZONE"]
   if timezone == None:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
   else:
     return datetime.now(timezone).strftime("%Y-%m-%d %H:%M:%S %Z")
 
-def log_message(question: str, answer: str, prompt_type: str, log_file: str = None) -> None:
+def default_path(file_name: str) -> str:
+  """数据文件的默认路径 ../data/<file_name>, 并确保目录存在"""
+  path = os.path.join(DATA_DIR, file_name)
+  os.makedirs(os.path.dirname(path), exist_ok = True)
+  return path
+
+def log_message(question: str, answer: str, prompt_type, log_dir: str = None, model: str = None) -> None:
   """
-  记录问答日志到log.txt文件
+  记录问答日志
   :param question: 提问内容
   :param answer: 回答内容
   :param prompt_type: 使用的提问枚举类型
-  :param log_file: 日志文件名, 默认路径为 ../data/log.txt
+  :param log_dir: 日志目录, 默认路径为 ../data/log
+  :param model: 使用的模型
+  """
+  log_messages([(question, answer, prompt_type)], log_dir, model)
+
+def log_messages(entries: list, log_dir: str = None, model: str = None) -> None:
+  """
+  一次记录多条问答日志
+  记录交给后台线程写入(见 persist.py), 这里只追加到预写日志, 不等待写入日志文件和更新索引
+  :param entries: (提问内容, 回答内容, 提问枚举类型[, 使用的模型]) 组成的列表
+  :param log_dir: 日志目录, 默认路径为 ../data/log
+  :param model: 没有单独指定模型的记录使用的模型
   """
-  # 获取脚本所在目录
-  base_dir = os.path.dirname(os.path.abspath(__file__))
-  if log_file is None:
-    log_file = os.path.join(base_dir, "../data/log.txt")
-  log_dir = os.path.dirname(log_file)
-  if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-  timestamp = get_current_time(LOCAL_ZONE)
-  log_entry = f"[{timestamp} || Prompt Type: {prompt_type}\nQuestion: {question}\nAnswer: {answer}]\n\n"
-  # 将日志写入文件
-  with open(log_file, "a", encoding = "utf-8") as file:
-    file.write(log_entry)
-  print(f"日志已记录到 {log_file} 文件中")
-
-def word_format(input_text: str, answer: str, request_time: str, data_file: str = None):
+  from persist import submit
+  ts = time.time()
+  timestamp = get_current_time()
+  records = []
+  for question, answer, prompt_type, *entry_model in entries:
+    record = {
+      "ts": ts,
+      "time": timestamp,
+      "mode": mode_name(prompt_type),
+      "question": question,
+      "answer": answer
+    }
+    if entry_model or model:
+      record["model"] = entry_model[0] if entry_model else model
+    records.append(record)
+  log_dir = log_dir or LOG_DIR
+  submit("log", log_dir, records)
+  print("日志已提交, 在后台写入")
+
+def write_log_records(records: list, log_dir: str = None) -> None:
+  """
+  写入问答日志并更新索引, 只加锁和打开一次文件, 由 persist.py 的后台线程调用
+  :param records: 字典列表, 见 Query_Log.append
+  """
+  Query_Log(log_dir).append(records)
+  update_index(records)
+  update_similar(records)
+
+def extract_word_data(input_text: str, answer: str, request_time: str, parser = None) -> dict:
+  """
+  提取大模型输出的单词解释, 格式稍有变化时也能识别, 缺少的字段留空(见 word_parser.py)
+  :param parser: 流式传输时已经增量解析了这段回答的 word_parser.Word_Parser, 不需要再解析一遍
+  :return: 生词本记录, 一个字段都没有识别出时返回 None
+  """
+  from word_parser import parse_word
+  if parser is None or parser.text != answer:
+    parser = parse_word(answer)
+  return parser.record(input_text, request_time)
+
+def word_format(input_text: str, answer: str, request_time: str, data_file: str = None, parser = None):
   """
   提取大模型输出的数据
   格式化输出为json数据
+  :param parser: 流式传输时增量解析回答的 word_parser.Word_Parser
   """
-  base_dir = os.path.dirname(os.path.abspath(__file__))
   if data_file is None:
-    data_file = os.path.join(base_dir, "../data/word_data.json")
-  data_dir = os.path.dirname(data_file)
-  if not os.path.exists(data_dir):
-    os.makedirs(data_dir)
-
-  pattern = re.compile(
-    r"最接近的中文解释:\s*(?P<ans1>.+?)\s*"
-    r"作为俚语或日常用法:\s*(?P<ans2>.+?)\s*"
-    r"常用语境:\s*(?P<ans3>.+?)\s*"
-    r"造句:\s*(?P<ans4>.+?)(?:\n|$)",
-    re.S
-  )
-  # 正则匹配回答中的关键信息
-  match = pattern.search(answer)
-  if match:
-    ans1 = match.group("ans1")
-    ans2 = match.group("ans2")
-    ans3 = match.group("ans3")
-    ans4 = match.group("ans4")
-  else:
+    data_file = default_path("word_data.json")
+
+  word_data = extract_word_data(input_text, answer, request_time, parser)
+  if word_data is None:
     print("未匹配到内容")
     return 1
-  
-  word_data = {
-    "word": input_text,
-    "closest_chinese": ans1,
-    "slang_or_usage": ans2,
-    "context": ans3,
-    "example": ans4,
-    "time": request_time
-  }
-  append_dict_to_json(data_file, word_data)
+  save_words([word_data], data_file)
+  from word_parser import WORD_FIELDS
+  missing = [field for field in WORD_FIELDS if not word_data[field]]
+  if missing:
+    print(f"部分内容未能识别 ({', '.join(missing)}), 已保存识别出的部分")
+  print("单词记录已提交, 在后台写入生词本")
+
+def save_words(word_records: list, data_file: str = None) -> None:
+  """
+  把多条单词记录写入生词本, 由后台线程写入(见 persist.py)
+  :param data_file: 生词本路径, 默认路径为 ../data/word_data.json
+  """
+  if not word_records:
+    return
+  from persist import submit
+  submit("word", data_file or default_path("word_data.json"), word_records)
 
+def write_word_records(word_records: list, data_file: str) -> None:
+  """追加生词本并更新索引, 由 persist.py 的后台线程调用"""
+  Word_Book(data_file).extend(word_records)
+  update_index(word_records, "word")
+  update_similar(word_records, "word")
 
 def main():
   print("log主程序已运行!")
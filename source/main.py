@@ -1,151 +1,196 @@
 #!/usr/bin/env python3
 
+# 命令行入口
+# 这里只导入解析参数和读取缓存需要的轻量模块, ds -h 和命中缓存时不会加载 asyncio 和 openai
+# 确认需要发起请求之后才导入 commands.py
+
+from utils import Startup_Timer
+STARTUP = Startup_Timer() # 尽早记录启动时间
+
 import os
-import threading
-import requests
 import sys
-from openai import OpenAI
 
-from prompts import Translator
 from cli import parse_arguments
-from log import log_message, get_current_time, word_format
-from utils import Animation, loading_animation, measure_time, \
-animation_event, request_done, RED_DOT, print_lock, typewriter
-
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
-
-client = OpenAI(api_key = os.getenv('DEEPSEEK_API_KEY'), base_url = "https://api.deepseek.com")
+from cache import Answer_Cache, make_key, show_cached
+from config import TEMPERATURE, MAX_TOKENS
+from router import candidate_models
+from query_log import mode_name
+from utils import RED_DOT
 
-# HEADERS = {
-#   "Authorization": f"Bearer {os.getenv('DEEPSEEK_API_KEY')}",
-#   "Content-Type": "application/json"
-# } 
-
-# input_text 只是从命令行中输入的一小段核心问题
-# prompt 则是根据预设的提示词加上 input_text 生成的完整提示词
-
-@measure_time
-def send_messages(input_text: str, 
-                  prompt: str, 
-                  prompt_type, 
-                  isStream: bool = True,
-                  ) -> tuple:
+def try_cache(args, prompt_type) -> bool:
   """
-  发起请求到 DeepSeek API
-  默认为非流式传输模式
-  :param input_text: 输入的文本
-  :param prompt: 生成的提示词
-  :param prompt_type: 提示词类型
-  :return: 返回内容: 大模型的回答内容, 使用的token数, 请求时间
+  不发起请求, 直接查询缓存
+  :return: 是否命中缓存并已输出回答
   """
-  # 启动加载动画线程
-  animation_thread = threading.Thread(target = loading_animation, args = (Animation.spin, isStream)) # 只能这么写
-  animation_event.clear()
-  request_done.clear()
-  animation_thread.start()
-  
-  # 发送请求
-  try:
-    request_time = get_current_time()
-    response = client.chat.completions.create(
-      model = "deepseek-chat",
-      messages = [
-        {"role": "user", "content": prompt}
-      ],
-      # response_format = "text",
-      stream = isStream,
-      temperature = 0.3,
-      max_tokens = 1024
-    )
-    
-    answer = ""
-    tokens_used = 0
-    # 获取返回的内容
-    if isStream:
-      for chunk in response:
-        with print_lock:
-          if chunk.choices[0].finish_reason == 'stop':
-            print()
-            request_done.set()
-            tokens_used = chunk.usage.total_tokens
-            break
-          else:
-            reply = chunk.choices[0].delta.content
-            if reply == '':
-              animation_event.set() # 设置动画状态为正在请求，API返回的第一个内容是空
-            answer += reply
-            typewriter(reply, delay = 0.02, end = '')
-    else:
-      request_done.set()
-      answer = response.choices[0].message.content
-      tokens_used = response.usage.total_tokens
-    
-  except requests.exceptions.RequestException as e:
-    print(f"\n{RED_DOT} 请求失败: {e}")
-    log_message(question = input_text, answer = "请求失败", prompt_type = prompt_type)
-  except Exception as e:
-    print(f"\n{RED_DOT} 未知错误: {e}")
-    log_message(question = input_text, answer = "未知错误", prompt_type = prompt_type)
-  finally:
-    # 停止加载动画
-    request_done.set()
-    animation_thread.join() # 等待动画线程结束
-    if not isStream:
-      print(f"\n{answer}")
-    print(f"\n使用的token数: {tokens_used} || 总字符数: {len(answer)}")
-    log_message(question = input_text, answer = answer, prompt_type = prompt_type)
-    return answer, tokens_used, request_time
-
-def translate(input_text, prompt_type, isStream: bool = True):
+  if args.batch or args.file or args.pack or args.daemon or args.history or args.search or args.stats or args.templates \
+     or args.sessions or args.usage or args.balance or args.continue_session or args.session or args.no_cache or args.refresh \
+     or len(args.modes) > 1:
+    return False
+  input_text = ' '.join(args.text)
+  cache = Answer_Cache()
+  # 这里还没有选择模型, 该模式可能使用的任何一个模型的回答都可以直接使用
+  models = [args.model] if args.model else candidate_models(mode_name(prompt_type))
+  for model in models:
+    record = cache.get(make_key(prompt_type, input_text, model, TEMPERATURE, MAX_TOKENS))
+    if record is not None:
+      show_cached(record)
+      from conversation import save_last_query
+      save_last_query(prompt_type, input_text, record["answer"])
+      return True
+  if args.no_fuzzy:
+    return False
+  # 没有完全相同的查询时, 复用规范化后相同或足够相似的问题的回答
+  from similar import find_similar, show_reused
+  match = find_similar(mode_name(prompt_type), input_text)
+  if match is None:
+    return False
+  show_reused(match)
+  from conversation import save_last_query
+  save_last_query(prompt_type, input_text, match["answer"])
+  return True
+
+def query_filters(args) -> tuple:
   """
-  根据输入文本恶化提示词类型调用API并处理返回结果
+  解析 --since, --until 和 --mode
+  :return: (起始时间戳, 结束时间戳, 模式名称)
   """
-  # 获取对应的prompt
-  prompt = prompt_type.value.format(text = input_text)
+  from cli import MODES
+  from query_log import mode_name, parse_time
+  try:
+    since = parse_time(args.since) if args.since else None
+    until = parse_time(args.until) if args.until else None
+  except ValueError as e:
+    print(f"{RED_DOT} {e}")
+    sys.exit(2)
+  return since, until, mode_name(MODES[args.mode]) if args.mode else None
+
+def show_history(args) -> None:
+  """按时间范围和模式查询问答日志, 输出最近的若干条"""
+  from collections import deque
+  from query_log import Query_Log
+  records = Query_Log().query(*query_filters(args))
+  # 只保留最后 limit 条, 不需要把全部日志读入内存
+  records = deque(records, maxlen = args.limit) if args.limit > 0 else list(records)
+  for record in records:
+    model = f" || {record['model']}" if record.get("model") else ""
+    print(f"[{record['time']} || {record['mode']}{model}]")
+    print(f"Question: {record['question']}")
+    print(f"Answer: {record['answer']}\n")
+  print(f"共 {len(records)} 条记录")
+
+def show_search(args) -> None:
+  """全文搜索以前的问答和生词本"""
+  import time
+  from query_log import Query_Log
+  from search import Search_Index
+  from word_book import Word_Book
+  from log import default_path
+  since, until, mode = query_filters(args)
+  with Search_Index() as index:
+    if not index.is_built:
+      print("第一次搜索, 正在为已有的日志和生词本建立索引...")
+      count = index.build(Query_Log(), Word_Book(default_path("word_data.json")))
+      print(f"已建立索引, 共 {count} 条记录")
+    start = time.perf_counter()
+    results = index.search(args.search, args.limit if args.limit > 0 else 1000, since, until, mode)
+    elapsed = (time.perf_counter() - start) * 1000
+  for result in results:
+    source = "生词本" if result["source"] == "word" else result["mode"]
+    print(f"[{result['time']} || {source}]")
+    print(f"Question: {result['question']}")
+    print(f"Answer: {result['answer']}\n")
+  print(f"共 {len(results)} 条结果, 耗时 {elapsed:.1f}ms")
 
+def show_stats(args) -> None:
+  """统计各阶段耗时的百分位数"""
+  import time
+  from metrics import Metrics_Store, summarize, format_stats, format_prometheus
+  since, until, mode = query_filters(args)
+  if since is None:
+    since = time.time() - 7 * 86400
+  groups = summarize(Metrics_Store().records(since, until, mode))
+  print(format_prometheus(groups) if args.prometheus else format_stats(groups), end = "\n" if not args.prometheus else "")
+
+def show_usage(args) -> None:
+  """按模式和模型汇总 token 用量和费用, 只读取用量账本中预先汇总的数据"""
+  from ledger import Usage_Ledger, format_usage
+  since, until, mode = query_filters(args)
+  with Usage_Ledger() as ledger:
+    print(format_usage(ledger, since, until, mode))
+
+def show_balance(args) -> None:
+  """查询账户余额, 短时间内重复查询时使用缓存"""
+  from model import check_balance, format_balance
   try:
-    # 如果提示词类型属于[单词解释], 则触发 json 输出
-    if prompt_type == Translator.explain_word:
-      answer, tokens_used, request_time = send_messages(input_text, prompt, prompt_type, isStream)
-      if answer: # 确保返回值有效
-        word_format(input_text, answer, request_time)
-      else:
-        print(f"\n{RED_DOT} 未能获取有效的回答")
-    else:
-      # 其他类型直接调用API
-      send_messages(input_text, prompt, prompt_type)
-  except KeyboardInterrupt:
-    print(f"\n{RED_DOT} 请求已中断，程序已安全退出")
+    print(format_balance(check_balance(refresh = args.refresh)))
   except Exception as e:
-    print(f"\n{RED_DOT} 程序发生错误: {e}")
-    log_message(question = input_text, answer = "程序发生错误", prompt_type = prompt_type)
+    print(f"{RED_DOT} 查询余额失败: {e}")
+    sys.exit(1)
+
+def prefetch() -> None:
+  """ds prefetch 子命令, 见 prefetch.py"""
+  from cli import parse_prefetch_arguments
+  from batch import read_items
+  from prefetch import prefetch_command
+  args = parse_prefetch_arguments(sys.argv[2:])
+  items = [item for path in args.files for item in read_items(path)]
+  prefetch_command(args, items)
 
 def main():
+  # 第一个参数为 prefetch 时作为子命令, 查询单词 prefetch 本身需要使用 ds -w prefetch
+  if sys.argv[1:2] == ["prefetch"]:
+    prefetch()
+    return
   args, prompt_type = parse_arguments()
 
-  input_text = ' '.join(args.text)
-  
+  if args.history:
+    show_history(args)
+    return
+  if args.search:
+    show_search(args)
+    return
+  if args.stats:
+    show_stats(args)
+    return
+  if args.usage:
+    show_usage(args)
+    return
+  if args.sessions:
+    from conversation import Conversation_Store, format_conversations
+    with Conversation_Store() as store:
+      print(format_conversations(store.list(args.limit)))
+    return
+  if args.templates:
+    from templates import get_registry, format_templates
+    print(format_templates(get_registry()))
+    return
+
+  if args.auto_reason:
+    print(f"自动选择模式: {args.auto_reason}, 可以用 -tr/-w/-tj/-s/-e/-a 指定")
+  if try_cache(args, prompt_type):
+    return
+
   if not os.getenv('DEEPSEEK_API_KEY'):
     print("请设置环境变量 DEEPSEEK_API_KEY")
     sys.exit(1)
-    
-  is_stream = True # 默认采用流式传输
-  if args.stream_false:
-    is_stream = False
-  elif args.stream_true:
-    is_stream = True
 
+  if args.balance:
+    show_balance(args)
+    return
+
+  if args.daemon:
+    from daemon import run_daemon
+    run_daemon()
+    return
+
+  import asyncio
+  from commands import run
   try:
-    main_tread = threading.Thread(target = translate, args = (input_text, prompt_type, is_stream))
-    main_tread.start()
+    asyncio.run(run(args, prompt_type, STARTUP))
   except KeyboardInterrupt:
-    # 捕获 Ctrl+C 中断
+    # 捕获 Ctrl+C 中断, asyncio.run 会先取消所有进行中的请求
     print(f"\n{RED_DOT} 请求已中断，程序已安全退出")
-  except Exception as e:
-    print(f"\n{RED_DOT} 程序发生错误: {e}")
-    log_message(question = input_text, answer = "程序发生错误", prompt_type = prompt_type)
-  finally:
-    main_tread.join() # 等待主线程结束
-  
+    sys.exit(130)
+
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+# 请求各阶段的耗时统计
+# 每次请求结束后把各阶段耗时写成一行 JSON, 追加到 data/metrics.jsonl, ds --stats 按模式和模型汇总百分位数
+#
+# 记录的阶段(毫秒):
+#   startup   进程启动到发出请求 (解释器启动, 导入模块, 读取缓存等)
+#   connect   发出请求到收到响应头 (连接建立, TLS 握手, 服务器排队)
+#   ttft      发出请求到收到第一段内容
+#   stream    第一段内容到最后一段内容
+#   total     发出请求到请求结束
+#   gap_mean / gap_p95 / gap_max  相邻两段内容之间的间隔
+#   render    网络传输结束到显示完毕
+#   persist   写入日志、缓存和生词本
+# 以及 tps (每秒输出的 token 数), cache_hit / cache_miss (提示词命中和未命中服务器缓存的 token 数),
+# prompt_tokens / completion_tokens (提示词和回答的 token 数)
+# 有 token 用量的记录同时写入用量账本 data/usage.db, 见 ledger.py
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+from utils import file_lock
+from config import DATA_DIR
+
+METRICS_FILE = os.path.join(DATA_DIR, "metrics.jsonl")
+# 指标文件超过该大小(字节)时, 转存为 metrics.1.jsonl, 只保留最近的两个文件
+ROTATE_BYTES = 8 * 1024 * 1024
+# ds --stats 汇总的阶段, 按显示顺序排列
+PHASES = ("startup", "connect", "ttft", "stream", "total", "gap_mean", "gap_p95", "gap_max", "render", "persist", "tps")
+QUANTILES = (0.5, 0.95, 0.99)
+
+def percentile(values: list, q: float) -> float:
+  """
+  线性插值的百分位数
+  :param values: 已排序的数值列表
+  :param q: 0 到 1 之间
+  """
+  if not values:
+    return None
+  position = (len(values) - 1) * q
+  lower = int(position)
+  upper = min(lower + 1, len(values) - 1)
+  return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+class Request_Trace:
+  """
+  一次请求各阶段的耗时, 由发起请求的各个环节分别填写, 最后转换为一条指标记录
+  """
+  def __init__(self, mode: str, model: str = None):
+    self.ts = time.time()
+    self.mode = mode
+    self.model = model
+    self.ok = True
+    self.via = None
+    self.tokens = 0
+    self.retries = 0
+    self.hedged = False
+    self.truncated = False # 回答因为 max_tokens 被截断
+    self.cache_hit = None # 提示词命中服务器缓存的 token 数
+    self.cache_miss = None
+    self.prompt_tokens = None
+    self.completion_tokens = None
+    self.spans = {} # 阶段名称 -> 毫秒
+
+  @contextmanager
+  def span(self, name: str):
+    """统计一段代码的耗时, 同名的阶段累加"""
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(name, time.perf_counter() - start)
+
+  def add(self, name: str, seconds: float) -> None:
+    if seconds is not None:
+      self.spans[name] = self.spans.get(name, 0.0) + seconds * 1000
+
+  def from_reply(self, reply) -> None:
+    """根据 engine.Reply 中记录的时间点计算网络相关的阶段"""
+    self.model = reply.model or self.model
+    self.via = reply.via
+    self.tokens = reply.tokens_used
+    self.retries = reply.retries
+    self.hedged = reply.hedged
+    self.truncated = reply.finish_reason == "length"
+    if reply.prompt_cache is not None:
+      self.cache_hit, self.cache_miss = reply.prompt_cache
+    usage = reply.usage or {}
+    self.prompt_tokens = usage.get("prompt_tokens")
+    self.completion_tokens = usage.get("completion_tokens")
+    sent_at = reply.sent_at
+    if sent_at is None:
+      return
+    if reply.connected_at is not None:
+      self.add("connect", reply.connected_at - sent_at)
+    if reply.first_token_at is not None:
+      self.add("ttft", reply.first_token_at - sent_at)
+      if reply.last_token_at is not None:
+        self.add("stream", reply.last_token_at - reply.first_token_at)
+    if reply.finished_at is not None:
+      self.add("total", reply.finished_at - sent_at)
+    gaps = sorted(reply.gaps)
+    if gaps:
+      self.add("gap_mean", sum(gaps) / len(gaps))
+      self.add("gap_p95", percentile(gaps, 0.95))
+      self.add("gap_max", gaps[-1])
+    completion = (reply.usage or {}).get("completion_tokens")
+    stream_ms = self.spans.get("stream")
+    if completion and stream_ms:
+      self.spans["tps"] = completion / (stream_ms / 1000)
+
+  def record(self) -> dict:
+    """转换为写入指标文件的记录, 耗时保留一位小数"""
+    record = {"ts": round(self.ts, 3), "mode": self.mode, "model": self.model, "ok": self.ok}
+    if self.via:
+      record["via"] = self.via
+    if self.tokens:
+      record["tokens"] = self.tokens
+    if self.retries:
+      record["retries"] = self.retries
+    if self.hedged:
+      record["hedged"] = True
+    if self.truncated:
+      record["truncated"] = True
+    if self.cache_hit is not None:
+      record["cache_hit"] = self.cache_hit
+      record["cache_miss"] = self.cache_miss
+    if self.prompt_tokens is not None:
+      record["prompt_tokens"] = self.prompt_tokens
+      record["completion_tokens"] = self.completion_tokens or 0
+    for name, value in self.spans.items():
+      record[name] = round(value, 1)
+    return record
+
+class Metrics_Store:
+  def __init__(self, metrics_file: str = None, rotate_bytes: int = ROTATE_BYTES, ledger: bool = True):
+    """
+    :param metrics_file: 指标文件路径, 默认为 ../data/metrics.jsonl
+    :param ledger: 是否同时把 token 用量写入用量账本
+    """
+    self.metrics_file = metrics_file or METRICS_FILE
+    self.old_file = os.path.splitext(self.metrics_file)[0] + ".1.jsonl"
+    self.rotate_bytes = rotate_bytes
+    self.ledger = ledger
+
+  def append(self, records: list) -> None:
+    """追加多条指标记录"""
+    if not records:
+      return
+    os.makedirs(os.path.dirname(os.path.abspath(self.metrics_file)), exist_ok = True)
+    lines = "".join(json.dumps(record, ensure_ascii = False, separators = (",", ":")) + "\n" for record in records)
+    with file_lock(self.metrics_file + ".lock"):
+      try:
+        if os.path.getsize(self.metrics_file) >= self.rotate_bytes:
+          os.replace(self.metrics_file, self.old_file)
+      except OSError:
+        pass
+      with open(self.metrics_file, "a", encoding = "utf-8") as file:
+        file.write(lines)
+    if self.ledger:
+      from ledger import Usage_Ledger
+      with Usage_Ledger() as ledger:
+        ledger.add(records)
+
+  def recent(self, max_bytes: int = 256 * 1024) -> list:
+    """
+    读取最近的指标记录, 只读取文件末尾的一部分, 耗时与文件大小无关
+    :param max_bytes: 最多读取的字节数
+    """
+    try:
+      with open(self.metrics_file, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(0, size - max_bytes))
+        data = file.read()
+    except OSError:
+      return []
+    lines = data.split(b"\n")
+    if size > max_bytes:
+      lines = lines[1:] # 第一行可能不完整
+    records = []
+    for line in lines:
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        continue
+    return records
+
+  def records(self, since: float = None, until: float = None, mode: str = None):
+    """按时间范围和模式读取指标记录"""
+    for path in (self.old_file, self.metrics_file):
+      try:
+        file = open(path, "r", encoding = "utf-8")
+      except OSError:
+        continue
+      with file:
+        for line in file:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue
+          if since is not None and record["ts"] < since:
+            continue
+          if until is not None and record["ts"] >= until:
+            continue
+          if mode is not None and record.get("mode") != mode:
+            continue
+          yield record
+
+def summarize(records) -> dict:
+  """
+  按 (模式, 模型) 汇总
+  :return: {(模式, 模型): {"count": 次数, "errors": 失败次数, "retries": 重试次数, "hedged": 发出对冲请求的次数,
+                          "cache_hit": 命中缓存的提示词 token 数,
+                          "cache_miss": 未命中的 token 数, "phases": {阶段: 已排序的数值列表}}}
+  """
+  groups = {}
+  for record in records:
+    group = groups.setdefault((record.get("mode"), record.get("model")),
+                              {"count": 0, "errors": 0, "retries": 0, "hedged": 0, "cache_hit": 0, "cache_miss": 0, "phases": {}})
+    group["count"] += 1
+    group["retries"] += record.get("retries", 0)
+    group["hedged"] += 1 if record.get("hedged") else 0
+    group["cache_hit"] += record.get("cache_hit", 0)
+    group["cache_miss"] += record.get("cache_miss", 0)
+    if not record.get("ok", True):
+      group["errors"] += 1
+    for phase in PHASES:
+      if phase in record:
+        group["phases"].setdefault(phase, []).append(record[phase])
+  for group in groups.values():
+    for values in group["phases"].values():
+      values.sort()
+  return groups
+
+def format_cache_rate(hit: int, miss: int) -> str:
+  """提示词缓存命中率, 没有数据时返回空字符串"""
+  if not hit and not miss:
+    return ""
+  return f"提示词缓存命中 {hit}/{hit + miss} token ({hit / (hit + miss):.0%})"
+
+def format_stats(groups: dict) -> str:
+  """以表格形式输出各阶段的 p50/p95/p99"""
+  if not groups:
+    return "没有符合条件的请求记录"
+  lines = []
+  for (mode, model), group in sorted(groups.items(), key = lambda item: (str(item[0][0]), str(item[0][1]))):
+    notes = [f"共 {group['count']} 次", f"失败 {group['errors']} 次"]
+    if group.get("retries"):
+      notes.append(f"重试 {group['retries']} 次")
+    if group.get("hedged"):
+      notes.append(f"对冲 {group['hedged']} 次")
+    cache = format_cache_rate(group.get("cache_hit", 0), group.get("cache_miss", 0))
+    if cache:
+      notes.append(cache)
+    lines.append(f"{mode} / {model} ({', '.join(notes)})")
+    if not group["phases"]:
+      lines.append("")
+      continue
+    lines.append(f"  {'阶段':<8}{'p50':>9}  {'p95':>9}  {'p99':>9}  {'样本':>3}")
+    for phase in PHASES:
+      values = group["phases"].get(phase)
+      if not values:
+        continue
+      unit = "" if phase == "tps" else "ms"
+      cells = "  ".join(f"{percentile(values, q):>7.1f}{unit:<2}" for q in QUANTILES)
+      lines.append(f"  {phase:<10}{cells}  {len(values):>5}")
+    lines.append("")
+  return "\n".join(lines).rstrip()
+
+def format_prometheus(groups: dict) -> str:
+  """以 Prometheus 文本格式输出, 各阶段作为 summary, 请求数作为 counter"""
+  def labels(**pairs) -> str:
+    return ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in pairs.items())
+
+  lines = [
+    "# HELP ds_requests_total Requests made by ds.",
+    "# TYPE ds_requests_total counter"
+  ]
+  for (mode, model), group in groups.items():
+    lines.append(f"ds_requests_total{{{labels(mode = mode, model = model, status = 'ok')}}} {group['count'] - group['errors']}")
+    lines.append(f"ds_requests_total{{{labels(mode = mode, model = model, status = 'error')}}} {group['errors']}")
+  lines += [
+    "# HELP ds_retries_total Retries and hedged requests sent by ds.",
+    "# TYPE ds_retries_total counter"
+  ]
+  for (mode, model), group in groups.items():
+    lines.append(f"ds_retries_total{{{labels(mode = mode, model = model, kind = 'retry')}}} {group.get('retries', 0)}")
+    lines.append(f"ds_retries_total{{{labels(mode = mode, model = model, kind = 'hedge')}}} {group.get('hedged', 0)}")
+  lines += [
+    "# HELP ds_prompt_cache_tokens_total Prompt tokens that hit or missed the provider's prefix cache.",
+    "# TYPE ds_prompt_cache_tokens_total counter"
+  ]
+  for (mode, model), group in groups.items():
+    for status in ("hit", "miss"):
+      lines.append(f"ds_prompt_cache_tokens_total{{{labels(mode = mode, model = model, status = status)}}} {group.get('cache_' + status, 0)}")
+  lines += [
+    "# HELP ds_request_phase_milliseconds Time spent in each phase of a request.",
+    "# TYPE ds_request_phase_milliseconds summary"
+  ]
+  tps_lines = [
+    "# HELP ds_tokens_per_second Completion tokens per second while streaming.",
+    "# TYPE ds_tokens_per_second summary"
+  ]
+  for (mode, model), group in groups.items():
+    for phase, values in group["phases"].items():
+      if phase == "tps":
+        name, target, extra = "ds_tokens_per_second", tps_lines, {}
+      else:
+        name, target, extra = "ds_request_phase_milliseconds", lines, {"phase": phase}
+      for q in QUANTILES:
+        target.append(f"{name}{{{labels(mode = mode, model = model, **extra, quantile = q)}}} {percentile(values, q):.3f}")
+      target.append(f"{name}_sum{{{labels(mode = mode, model = model, **extra)}}} {sum(values):.3f}")
+      target.append(f"{name}_count{{{labels(mode = mode, model = model, **extra)}}} {len(values)}")
+  return "\n".join(lines + tps_lines) + "\n"
+
+def main():
+  print("metrics主程序已运行!")
+
+if __name__ == "__main__":
+  main()
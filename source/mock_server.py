@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+# 本地模拟的 OpenAI 兼容接口, 用于在不请求真实 API 的情况下测量本程序自身的开销
+# 用法: python mock_server.py [--port 8765] [--ttft 0.3] [--rate 50] [--fail-rate 0.1]
+# 然后: DS_BASE_URL=http://127.0.0.1:8765 DEEPSEEK_API_KEY=mock ds --no-daemon -w apple
+#
+# 支持的接口:
+#   POST /chat/completions, /v1/chat/completions  流式 (SSE) 和非流式
+#   GET  /models, /user/balance
+# 回答内容可以是合成的(按提示词类型生成格式正确的回答), 也可以从录制文件中回放
+# 录制文件为 JSON: {"chunks": ["最接近", "的中文解释: ...", ...]} 或 {"answer": "..."}
+#
+# 可以控制的行为:
+#   ttft       收到请求到发出第一段内容的时间(秒)
+#   rate       每秒发出的 token 数, 0 表示一次全部发出
+#   fail_rate  请求直接返回 500 错误的概率
+#   drop_rate  流式传输到一半时断开连接的概率
+#   stall_rate 请求卡住(首字延迟增加 stall 秒)的概率, 用于模拟长尾延迟
+#   prefill_rate  每秒处理的未命中缓存的提示词 token 数, 用于模拟提示词缓存对首字延迟的影响, 0 表示忽略
+# 回答超过请求中的 max_tokens 时截断, finish_reason 为 length
+# 与 DeepSeek 一样以 64 个 token 为单位缓存提示词前缀, 在 usage 中返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens
+
+import sys
+import json
+import time
+import random
+import hashlib
+import asyncio
+import argparse
+import threading
+
+# 合成的单词解释, 与 prompts.Translator.explain_word 要求的格式一致, 可以被 word_parser.Word_Parser 完整解析
+WORD_ANSWER = (
+  "最接近的中文解释: {text}的意思\n"
+  "作为俚语或日常用法: 日常对话中常用来表示{text}\n"
+  "常用语境: 在朋友之间聊天或者写作时使用, 语气比较随意\n"
+  "造句: I came across the word {text} yesterday. 我昨天遇到了{text}这个词。\n"
+)
+DEFAULT_ANSWER = (
+  "这是一个由本地模拟服务器生成的回答, 用于测量客户端本身的开销。"
+  "The quick brown fox jumps over the lazy dog. "
+) * 4
+
+# 长文档翻译的提示词中原文之前的标记
+DOCUMENT_MARKER = "\n原文:\n"
+
+def split_tokens(text: str) -> list:
+  """把回答粗略地切分为 token: 英文按单词, 中文按两个字"""
+  tokens = []
+  buffer = ""
+  for char in text:
+    buffer += char
+    if char.isspace() or (ord(char) > 0x2e80 and len(buffer) >= 2) or char in "。，,.\n":
+      tokens.append(buffer)
+      buffer = ""
+  if buffer:
+    tokens.append(buffer)
+  return tokens
+
+# 提示词前缀缓存的单位(token 数)
+CACHE_BLOCK = 64
+# 最多记住的前缀数, 超出后清空
+CACHE_CAPACITY = 100000
+
+def packed_answer(prompt: str) -> str:
+  """
+  打包请求(见 prompts.Packed_prompt)的合成回答, 最后一行冒号之后为输入内容组成的 JSON 数组
+  :return: JSON 格式的回答, 无法识别时返回 None
+  """
+  try:
+    items = json.loads(prompt.strip().splitlines()[-1].split(": ", 1)[-1])
+  except ValueError:
+    return None
+  if not isinstance(items, list):
+    return None
+  if "synonyms" in prompt:
+    entries = [{"word": item, "synonyms": [
+      {"english": f"{item}-like", "meaning": f"{item}的近义词", "tags": "中性", "collocations": f"a {item}", "usage": "日常使用"}
+    ]} for item in items]
+  else:
+    entries = [dict(zip(("closest_chinese", "slang_or_usage", "context", "example"), WORD_ANSWER.format(text = item).splitlines()))
+               for item in items]
+    entries = [dict({key: value.split(": ", 1)[1] for key, value in entry.items()}, word = item)
+               for item, entry in zip(items, entries)]
+  return json.dumps({"items": entries}, ensure_ascii = False)
+
+class Mock_Server:
+  def __init__(self,
+               host: str = "127.0.0.1",
+               port: int = 0,
+               ttft: float = 0.3,
+               rate: float = 50.0,
+               fail_rate: float = 0.0,
+               drop_rate: float = 0.0,
+               replay: str = None,
+               seed: int = None,
+               prefill_rate: float = 0.0,
+               stall_rate: float = 0.0,
+               stall: float = 10.0):
+    """
+    :param port: 监听端口, 0 表示自动选择空闲端口
+    :param ttft: 收到请求到发出第一段内容的时间(秒)
+    :param rate: 每秒发出的 token 数, 0 表示不限制
+    :param fail_rate: 返回 500 错误的概率
+    :param drop_rate: 流式传输中途断开连接的概率
+    :param replay: 录制文件路径, 设置后所有请求都回放该文件中的回答
+    :param seed: 随机数种子, 便于复现故障注入的结果
+    :param prefill_rate: 每秒处理的未命中缓存的提示词 token 数, 0 表示不增加首字延迟
+    :param stall_rate: 请求卡住的概率
+    :param stall: 卡住的请求额外增加的首字延迟(秒)
+    """
+    self.host = host
+    self.port = port
+    self.ttft = ttft
+    self.rate = rate
+    self.fail_rate = fail_rate
+    self.drop_rate = drop_rate
+    self.prefill_rate = prefill_rate
+    self.stall_rate = stall_rate
+    self.stall = stall
+    self.random = random.Random(seed)
+    self.chunks = None
+    if replay:
+      with open(replay, "r", encoding = "utf-8") as file:
+        recording = json.load(file)
+      self.chunks = recording.get("chunks") or split_tokens(recording["answer"])
+    self.requests = 0
+    self.failures = 0
+    self.stalls = 0
+    self.prompt_tokens = 0
+    self.cache_hit_tokens = 0
+    self._prefixes = set()
+    self._server = None
+    self._loop = None
+    self._thread = None
+
+  @property
+  def base_url(self) -> str:
+    return f"http://{self.host}:{self.port}"
+
+  def answer_chunks(self, prompt: str) -> list:
+    """根据提示词生成回答, 提示词的最后一行视为用户输入"""
+    if self.chunks is not None:
+      return self.chunks
+    if '"items"' in prompt:
+      packed = packed_answer(prompt)
+      if packed is not None:
+        return split_tokens(packed)
+    if DOCUMENT_MARKER in prompt:
+      # 长文档翻译(见 prompts.Translator.document_translate): 回答长度与原文成正比
+      return split_tokens("[译文] " + prompt.split(DOCUMENT_MARKER, 1)[1])
+    text = prompt.strip().splitlines()[-1].strip() if prompt.strip() else ""
+    text = text.rsplit(":", 1)[-1].strip()[:40] or "text"
+    if "最接近的中文解释" in prompt:
+      return split_tokens(WORD_ANSWER.format(text = text))
+    return split_tokens(DEFAULT_ANSWER)
+
+  def prefix_hit(self, tokens: list) -> int:
+    """
+    提示词命中前缀缓存的 token 数, 并记住该提示词的所有前缀
+    只有完整的 CACHE_BLOCK 个 token 才会被缓存
+    """
+    if len(self._prefixes) > CACHE_CAPACITY:
+      self._prefixes.clear()
+    hit = 0
+    digest = hashlib.sha256()
+    for end in range(CACHE_BLOCK, len(tokens) + 1, CACHE_BLOCK):
+      digest.update("".join(tokens[end - CACHE_BLOCK:end]).encode("utf-8"))
+      key = digest.copy().hexdigest()
+      if key in self._prefixes and hit == end - CACHE_BLOCK:
+        hit = end
+      self._prefixes.add(key)
+    return hit
+
+  async def start(self) -> None:
+    self._server = await asyncio.start_server(self._handle, self.host, self.port)
+    self.port = self._server.sockets[0].getsockname()[1]
+
+  async def close(self) -> None:
+    if self._server is not None:
+      self._server.close()
+      # 客户端放弃的请求(如对冲请求中落败的一方)可能仍在等待, 直接取消
+      handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+      for task in handlers:
+        task.cancel()
+      await asyncio.gather(*handlers, return_exceptions = True)
+      await self._server.wait_closed()
+
+  def start_in_thread(self) -> str:
+    """
+    在后台线程中运行, 供同一进程中的基准测试使用
+    :return: base_url
+    """
+    ready = threading.Event()
+
+    def run() -> None:
+      self._loop = asyncio.new_event_loop()
+      self._loop.run_until_complete(self.start())
+      ready.set()
+      self._loop.run_forever()
+      self._loop.run_until_complete(self.close())
+      self._loop.close()
+
+    self._thread = threading.Thread(target = run, daemon = True)
+    self._thread.start()
+    ready.wait()
+    return self.base_url
+
+  def stop(self) -> None:
+    """停止 start_in_thread 启动的服务器"""
+    if self._loop is not None:
+      self._loop.call_soon_threadsafe(self._loop.stop)
+      self._thread.join()
+      self._loop = None
+
+  async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """处理一个连接, 支持 keep-alive, 同一个连接上可以有多个请求"""
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line:
+          break
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+          line = await reader.readline()
+          if line in (b"\r\n", b"\n", b""):
+            break
+          name, _, value = line.decode("latin-1").partition(":")
+          headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        keep_alive = await self._route(method, path.split("?")[0], body, reader, writer)
+        if not keep_alive:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+      # CancelledError: 服务器关闭时取消仍在等待的请求, 正常结束即可
+      pass
+    finally:
+      writer.close()
+
+  async def _route(self, method: str, path: str, body: bytes, reader: asyncio.StreamReader,
+                   writer: asyncio.StreamWriter) -> bool:
+    """
+    处理一个请求
+    :return: 是否可以继续在该连接上处理下一个请求
+    """
+    path = path[3:] if path.startswith("/v1/") else path
+    if method == "GET" and path == "/models":
+      self._send_json(writer, 200, {"object": "list", "data": [
+        {"id": "deepseek-chat", "object": "model", "owned_by": "mock"},
+        {"id": "deepseek-reasoner", "object": "model", "owned_by": "mock"}
+      ]})
+      return True
+    if method == "GET" and path == "/user/balance":
+      self._send_json(writer, 200, {"is_available": True, "balance_infos": [
+        {"currency": "CNY", "total_balance": "100.00", "granted_balance": "0.00", "topped_up_balance": "100.00"}
+      ]})
+      return True
+    if method != "POST" or path != "/chat/completions":
+      self._send_json(writer, 404, {"error": {"message": f"not found: {path}", "type": "invalid_request_error"}})
+      return True
+
+    self.requests += 1
+    params = json.loads(body or b"{}")
+    if self.random.random() < self.fail_rate:
+      self.failures += 1
+      await asyncio.sleep(self.ttft)
+      self._send_json(writer, 500, {"error": {"message": "injected failure", "type": "server_error"}})
+      return True
+    prompt = "\n".join(str(message.get("content", "")) for message in params.get("messages", []))
+    prompt_tokens = split_tokens(prompt)
+    hit = self.prefix_hit(prompt_tokens)
+    self.prompt_tokens += len(prompt_tokens)
+    self.cache_hit_tokens += hit
+    # 多轮对话只根据最后一条消息生成回答, 之前的消息只计入提示词
+    messages = params.get("messages") or [{}]
+    chunks = self.answer_chunks(str(messages[-1].get("content", "")))
+    finish_reason = "stop"
+    if params.get("max_tokens") and len(chunks) > params["max_tokens"]:
+      chunks, finish_reason = chunks[:params["max_tokens"]], "length"
+    usage = self._usage(len(prompt_tokens), hit, chunks)
+    prefill = (len(prompt_tokens) - hit) / self.prefill_rate if self.prefill_rate > 0 else 0
+    if self.random.random() < self.stall_rate:
+      self.stalls += 1
+      prefill += self.stall
+    if params.get("stream"):
+      return await self._stream(reader, writer, params, chunks, usage, prefill, finish_reason)
+    await asyncio.sleep(self.ttft + prefill + (len(chunks) / self.rate if self.rate > 0 else 0))
+    answer = "".join(chunks)
+    self._send_json(writer, 200, {
+      "id": f"mock-{self.requests}",
+      "object": "chat.completion",
+      "created": int(time.time()),
+      "model": params.get("model", "deepseek-chat"),
+      "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": finish_reason}],
+      "usage": usage
+    })
+    await writer.drain()
+    return True
+
+  async def _stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, params: dict, chunks: list,
+                    usage: dict, prefill: float = 0, finish_reason: str = "stop") -> bool:
+    """以 SSE 分块发出回答"""
+    writer.write(
+      b"HTTP/1.1 200 OK\r\n"
+      b"Content-Type: text/event-stream\r\n"
+      b"Cache-Control: no-cache\r\n"
+      b"Transfer-Encoding: chunked\r\n\r\n"
+    )
+    await writer.drain()
+    base = {
+      "id": f"mock-{self.requests}",
+      "object": "chat.completion.chunk",
+      "created": int(time.time()),
+      "model": params.get("model", "deepseek-chat")
+    }
+
+    def event(payload) -> None:
+      data = f"data: {payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii = False)}\n\n".encode("utf-8")
+      writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    await asyncio.sleep(self.ttft + prefill)
+    if reader.at_eof():
+      return False # 客户端已经放弃了这个请求
+    event(dict(base, choices = [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]))
+    drop_at = self.random.randrange(len(chunks)) if chunks and self.random.random() < self.drop_rate else None
+    interval = 1 / self.rate if self.rate > 0 else 0
+    start = time.perf_counter()
+    for index, text in enumerate(chunks):
+      if index == drop_at:
+        self.failures += 1
+        await writer.drain()
+        writer.transport.abort() # 模拟网络中断
+        return False
+      event(dict(base, choices = [{"index": 0, "delta": {"content": text}, "finish_reason": None}]))
+      # 按绝对时间计算下一段的发出时间, 避免 sleep 的误差累积
+      delay = start + (index + 1) * interval - time.perf_counter()
+      if delay > 0:
+        await writer.drain()
+        await asyncio.sleep(delay)
+    event(dict(base, choices = [{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+    if (params.get("stream_options") or {}).get("include_usage"):
+      event(dict(base, choices = [], usage = usage))
+    event("[DONE]")
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    return True
+
+  def _usage(self, prompt_tokens: int, hit: int, chunks: list) -> dict:
+    return {
+      "prompt_tokens": prompt_tokens,
+      "completion_tokens": len(chunks),
+      "total_tokens": prompt_tokens + len(chunks),
+      "prompt_cache_hit_tokens": hit,
+      "prompt_cache_miss_tokens": prompt_tokens - hit
+    }
+
+  def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict) -> None:
+    body = json.dumps(payload, ensure_ascii = False).encode("utf-8")
+    reason = {200: "OK", 404: "Not Found", 500: "Internal Server Error"}[status]
+    writer.write(
+      f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+      + body
+    )
+
+async def serve(server: Mock_Server) -> None:
+  await server.start()
+  print(f"模拟服务器已启动: {server.base_url}", flush = True)
+  try:
+    await asyncio.Event().wait()
+  finally:
+    await server.close()
+    print(f"\n共处理 {server.requests} 个请求, 其中 {server.failures} 个注入了故障")
+
+def main():
+  parser = argparse.ArgumentParser(description = "本地模拟的 OpenAI 兼容接口")
+  parser.add_argument("--host", default = "127.0.0.1")
+  parser.add_argument("--port", type = int, default = 8765)
+  parser.add_argument("--ttft", type = float, default = 0.3, help = "首字延迟(秒), 默认为 0.3")
+  parser.add_argument("--rate", type = float, default = 50.0, help = "每秒发出的 token 数, 0 表示不限制, 默认为 50")
+  parser.add_argument("--fail-rate", type = float, default = 0.0, help = "返回 500 错误的概率")
+  parser.add_argument("--drop-rate", type = float, default = 0.0, help = "流式传输中途断开连接的概率")
+  parser.add_argument("--replay", metavar = "FILE", help = "回放录制文件中的回答")
+  parser.add_argument("--seed", type = int, help = "随机数种子")
+  parser.add_argument("--prefill-rate", type = float, default = 0.0, help = "每秒处理的未命中缓存的提示词 token 数, 0 表示忽略")
+  parser.add_argument("--stall-rate", type = float, default = 0.0, help = "请求卡住的概率")
+  parser.add_argument("--stall", type = float, default = 10.0, help = "卡住的请求额外增加的首字延迟(秒), 默认为 10")
+  args = parser.parse_args()
+  server = Mock_Server(args.host, args.port, args.ttft, args.rate, args.fail_rate, args.drop_rate, args.replay, args.seed,
+                       args.prefill_rate, args.stall_rate, args.stall)
+  try:
+    asyncio.run(serve(server))
+  except KeyboardInterrupt:
+    pass
+  except OSError as e:
+    print(f"启动失败: {e}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -1,6 +1,7 @@
-from log import get_current_time
-import requests
 import os
+import json
+import hashlib
+from config import BASE_URL, DATA_DIR, MODELS_CACHE_TTL, BALANCE_CACHE_TTL
 
 # 大模型服务器所在时区
 # 错峰使用大模型可以获得价格优惠
@@ -10,32 +11,62 @@ HEADERS = {
   'Accept': 'application/json',
   'Authorization': f"Bearer {os.getenv('DEEPSEEK_API_KEY')}"
 }
+# 模型列表和余额的查询结果缓存在单独的目录中, 与回答缓存互不影响
+API_CACHE_DIR = os.path.join(DATA_DIR, "api_cache")
 
-def list_models():
+def _get(path: str, ttl: float, refresh: bool = False) -> dict:
   """
-  列出所有可用的模型
+  请求 GET 接口, ttl 秒内重复查询时直接使用上一次的结果
+  缓存键包含 API 地址和密钥的哈希, 不同的密钥互不影响
+  :param refresh: 忽略缓存重新请求
+  :return: 接口返回的 JSON, 附带 cached (是否来自缓存) 和 fetched_at (请求时间)
+  """
+  import time
+  from cache import Answer_Cache
+  cache = Answer_Cache(API_CACHE_DIR, ttl = ttl)
+  key = hashlib.sha256(json.dumps([BASE_URL, path, HEADERS["Authorization"]]).encode("utf-8")).hexdigest()
+  if not refresh:
+    record = cache.get(key)
+    if record is not None:
+      return dict(record["answer"], cached = True, fetched_at = record["created"])
+  import requests
+  response = requests.request("GET", f"{BASE_URL}{path}", headers=HEADERS, timeout=10)
+  response.raise_for_status()
+  data = response.json()
+  cache.put(key, {"answer": data})
+  return dict(data, cached = False, fetched_at = time.time())
+
+def list_models(refresh: bool = False) -> dict:
+  """
+  列出所有可用的模型, 结果缓存 MODELS_CACHE_TTL 秒
   :return: 模型列表 json 格式
   """
-  url = "https://api.deepseek.com/models"
-  payload={}
-  
-  response = requests.request("GET", url, headers=HEADERS, data=payload)
-  print(response.text)
+  return _get("/models", MODELS_CACHE_TTL, refresh)
 
-def check_balance():
+def check_balance(refresh: bool = False) -> dict:
   """
-  查询余额
+  查询余额, 结果缓存 BALANCE_CACHE_TTL 秒
   :return: 余额信息 json 格式
   """
-  url = "https://api.deepseek.com/user/balance"
-  payload={}
-  response = requests.request("GET", url, headers=HEADERS, data=payload)
-  print(response.text)
+  return _get("/user/balance", BALANCE_CACHE_TTL, refresh)
+
+def format_balance(balance: dict) -> str:
+  """余额信息, 以及查询时间"""
+  from datetime import datetime
+  lines = []
+  for info in balance.get("balance_infos", []):
+    lines.append(f"余额: {info.get('total_balance')} {info.get('currency')} "
+                 f"(赠送 {info.get('granted_balance')}, 充值 {info.get('topped_up_balance')})")
+  if not balance.get("is_available", True):
+    lines.append("余额不足, 无法调用 API")
+  fetched = datetime.fromtimestamp(balance["fetched_at"]).strftime("%Y-%m-%d %H:%M:%S")
+  lines.append(f"查询时间: {fetched}{' (缓存)' if balance['cached'] else ''}")
+  return "\n".join(lines)
 
 def main():
   print("model主程序已运行!")
-  list_models()
-  check_balance()
+  print(json.dumps(list_models(), ensure_ascii = False, indent = 2))
+  print(format_balance(check_balance()))
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# 同一段输入同时使用多个模式, 例如 ds -tr -s "..." 或 ds -w -e serendipity
+# 各个模式的请求同时发出, 总耗时约等于最慢的一个, 而不是依次请求的总和
+#
+# 输出按模式分段: 先收到第一段内容的模式先占用终端, 边收边输出; 其他模式的内容先留在各自的渲染缓冲区中,
+# 前一段输出完毕后, 下一个已经开始返回的模式先写出缓冲的内容, 再继续流式输出, 各段不会互相穿插
+# 命中缓存(或复用相似问题)的模式不发起请求, 直接作为一段输出
+# 日志、生词本和指标都在全部完成后一次性写入
+
+import time
+import asyncio
+
+from prompts import Translator
+from engine import Session, TEMPERATURE, MAX_TOKENS
+from cache import Answer_Cache, make_key
+from log import log_messages, extract_word_data, save_words
+from metrics import Request_Trace, Metrics_Store, format_cache_rate
+from query_log import mode_name
+from router import Model_Router
+from render import Stream_Renderer
+from templates import render_prompt
+from conversation import save_last_query
+from word_parser import Word_Parser
+from utils import Animation, loading_animation, separator, GREEN_DOT, RED_DOT
+
+class Mode_Section:
+  def __init__(self, prompt_type, typewriter: bool = True):
+    """
+    一个模式的请求和它在终端中的一段输出
+    :param prompt_type: 提示词类型
+    :param typewriter: 流式传输时是否平滑输出
+    """
+    from cli import MODES
+    self.prompt_type = prompt_type
+    self.label = next((name for name, member in MODES.items() if member == prompt_type), mode_name(prompt_type))
+    self.renderer = Stream_Renderer(typewriter = typewriter)
+    # 单词解释在接收的同时解析生词本记录
+    self.parser = Word_Parser() if prompt_type == Translator.explain_word else None
+    self.route = None
+    self.trace = None
+    self.answer = ""
+    self.tokens_used = 0
+    self.request_time = None
+    self.sent_at = None
+    self.elapsed = 0.0
+    self.reused = None # 命中缓存或复用相似问题时的说明
+    self.error = None
+    self.arrived = False
+
+  def header(self) -> str:
+    model = f" || {self.route.model}" if self.route is not None and self.reused is None else ""
+    return f"【{self.label}】{model}"
+
+  def footer(self) -> str:
+    if self.error is not None:
+      return f"{RED_DOT} 请求失败: {self.error}"
+    if self.reused is not None:
+      return f"{GREEN_DOT} {self.reused} || 使用的token数: 0 || 总字符数: {len(self.answer)}"
+    notes = [f"使用的token数: {self.tokens_used}", f"总字符数: {len(self.answer)}", f"耗时: {self.elapsed:.2f}秒"]
+    if self.trace.cache_hit is not None:
+      notes.append(format_cache_rate(self.trace.cache_hit, self.trace.cache_miss))
+    if self.trace.retries:
+      notes.append(f"重试 {self.trace.retries} 次")
+    if self.trace.hedged:
+      notes.append("发出了对冲请求")
+    return f"{GREEN_DOT} " + " || ".join(notes)
+
+def find_reusable(section: Mode_Section, input_text: str, args, cache: Answer_Cache) -> bool:
+  """
+  查找可以直接使用的回答: 先查回答缓存, 再查相似问题, 与单个模式时的规则相同
+  :return: 是否找到, 找到时写入 section
+  """
+  if cache is not None and not args.refresh:
+    record = cache.get(make_key(section.prompt_type, input_text, section.route.model, TEMPERATURE, MAX_TOKENS))
+    if record is not None:
+      section.answer = record["answer"]
+      section.reused = f"命中缓存 (原始请求时间: {record.get('request_time')})"
+      return True
+  if args.no_cache or args.refresh or args.no_fuzzy:
+    return False
+  from similar import find_similar
+  match = find_similar(mode_name(section.prompt_type), input_text)
+  if match is None:
+    return False
+  similarity = "规范化后相同" if match["similarity"] >= 1.0 else f"相似度 {match['similarity']:.0%}"
+  section.answer = match["answer"]
+  section.reused = f"复用相似问题的回答 (原问题: {match['question']!r}, {similarity})"
+  return True
+
+async def run_modes(session: Session, args, prompt_types: list, timing = None) -> list:
+  """
+  对同一段输入同时请求多个模式, 分段输出
+  :param session: 请求会话
+  :param args: 命令行参数
+  :param prompt_types: 提示词类型列表, 先收到内容的先输出
+  :param timing: utils.Startup_Timer, 传入时统计从进程启动到发出请求的耗时
+  :return: 按输出顺序排列的 Mode_Section
+  """
+  input_text = ' '.join(args.text)
+  is_stream = not args.stream_false
+  cache = Answer_Cache() if not args.no_cache else None
+  router = Model_Router()
+  sections = [Mode_Section(prompt_type, typewriter = not args.no_typewriter) for prompt_type in prompt_types]
+  arrivals = asyncio.Queue()
+
+  def arrive(section: Mode_Section) -> None:
+    if not section.arrived:
+      section.arrived = True
+      arrivals.put_nowait(section)
+
+  async def work(section: Mode_Section) -> None:
+    mode = mode_name(section.prompt_type)
+    section.route = router.choose(mode, args.model, hedge = not args.no_hedge)
+    if find_reusable(section, input_text, args, cache):
+      section.renderer.feed(section.answer)
+      section.renderer.close()
+      arrive(section)
+      return
+    section.trace = Request_Trace(mode, section.route.model)
+
+    def on_chunk(text: str) -> None:
+      arrive(section)
+      section.renderer.feed(text)
+      if section.parser is not None:
+        section.parser.feed(text)
+
+    prompt = render_prompt(section.prompt_type, input_text)
+    start = time.perf_counter()
+    try:
+      if is_stream:
+        reply = await session.stream(prompt, on_chunk = on_chunk, on_finish = section.renderer.close,
+                                     model = section.route.model, hedge_after = section.route.hedge_after)
+      else:
+        reply = await session.complete(prompt, model = section.route.model, hedge_after = section.route.hedge_after)
+        section.renderer.feed(reply.answer)
+      section.answer, section.tokens_used, section.request_time = reply.answer, reply.tokens_used, reply.request_time
+      section.sent_at = reply.sent_at
+      section.trace.from_reply(reply)
+      if timing is not None and reply.sent_at is not None:
+        section.trace.add("startup", timing.since_exec(reply.sent_at))
+    except Exception as e:
+      section.error = e
+      section.trace.ok = False
+    finally:
+      section.elapsed = time.perf_counter() - start
+      section.renderer.close()
+      arrive(section)
+
+  start = time.perf_counter()
+  tasks = {section: asyncio.create_task(work(section)) for section in sections}
+  shown = []
+  try:
+    for _ in sections:
+      if arrivals.empty():
+        # 还没有任何模式返回内容时显示加载动画
+        ready = asyncio.Event()
+        animation_task = asyncio.create_task(loading_animation(ready, Animation.spin, True))
+        try:
+          section = await arrivals.get()
+        finally:
+          ready.set()
+          await animation_task
+      else:
+        section = arrivals.get_nowait()
+        print(separator(), flush = True)
+      print(section.header(), flush = True)
+      await section.renderer.run()
+      # 输出完毕时请求可能还在收尾(统计用量等), 等它完成后再显示这一段的统计
+      await tasks[section]
+      print(f"\n{section.footer()}", flush = True)
+      shown.append(section)
+  finally:
+    # 中断时取消还没有完成的请求
+    for task in tasks.values():
+      task.cancel()
+  elapsed = time.perf_counter() - start
+
+  requested = [section for section in sections if section.trace is not None]
+  print(separator(), flush = True)
+  print(f"{len(sections)} 个模式 || 使用的token数: {sum(section.tokens_used for section in sections)} || "
+        f"总耗时: {elapsed:.2f}秒 (依次请求约 {sum(section.elapsed for section in requested):.2f}秒)")
+  sent = [section.sent_at for section in requested if section.sent_at is not None]
+  if timing is not None and args.timing and sent:
+    print(timing.report(min(sent)))
+
+  # 全部完成后一次性写入缓存、日志和生词本
+  persist_start = time.perf_counter()
+  log_entries = []
+  word_records = []
+  for section in requested:
+    if section.error is not None:
+      log_entries.append((input_text, f"请求失败: {section.error}", section.prompt_type, section.route.model))
+      continue
+    if not section.answer:
+      continue
+    log_entries.append((input_text, section.answer, section.prompt_type, section.route.model))
+    if cache is not None and not section.trace.truncated:
+      cache.put(make_key(section.prompt_type, input_text, section.route.model, TEMPERATURE, MAX_TOKENS),
+                {"answer": section.answer, "tokens_used": section.tokens_used,
+                 "request_time": section.request_time, "model": section.route.model})
+    if section.prompt_type == Translator.explain_word:
+      word_data = extract_word_data(input_text, section.answer, section.request_time, section.parser)
+      if word_data is not None:
+        word_records.append(word_data)
+  if log_entries:
+    log_messages(log_entries)
+  if word_records:
+    save_words(word_records)
+    print("单词记录已提交, 在后台写入生词本")
+  # 追问时以输出的第一个有回答的模式作为上一次提问
+  answered = next((section for section in shown if section.answer), None)
+  if answered is not None:
+    save_last_query(answered.prompt_type, input_text, answered.answer)
+  persist = time.perf_counter() - persist_start
+  for section in requested:
+    section.trace.add("persist", persist)
+  Metrics_Store().append([section.trace.record() for section in requested])
+  return shown
+
+def main():
+  print("multi主程序已运行!")
+
+if __name__ == "__main__":
+  main()
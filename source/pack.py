@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# 打包请求: 把多个单词(-w)或词语(-e)放进同一个请求, 要求模型以 JSON 输出, 再拆分回每个单词
+# 很长的说明部分只发送一次, 请求次数也从 N 次减少到 N / PACK_SIZE 次
+# 拆分后的回答转换为与单独请求相同的格式, 照常写入缓存、日志和生词本, 之后单独查询这些单词时也能命中缓存
+# 没有出现在输出中或者内容不完整的单词, 改为单独请求
+
+import sys
+import json
+import asyncio
+
+from prompts import Translator, Packed_prompt
+from engine import Session, TEMPERATURE, MAX_TOKENS
+from config import JSON_MODE_MODELS
+from cache import Answer_Cache, make_key, normalize_text
+from log import log_messages, extract_word_data, save_words
+from word_parser import WORD_FIELDS, extract_json
+from metrics import Request_Trace, Metrics_Store
+from query_log import mode_name
+from router import Model_Router
+from templates import render_prompt
+from batch import show_progress
+from utils import Rate_Limiter, measure_time, CLEAN_SEQ, GREEN_DOT, RED_DOT
+
+# 每个请求最多包含的单词数
+PACK_SIZE = 8
+# 支持打包的提示词类型
+PACKABLE = {
+  Translator.explain_word: Packed_prompt.explain_word,
+  Translator.en_synonyms: Packed_prompt.en_synonyms
+}
+SYNONYM_FIELDS = ("english", "meaning", "tags", "collocations", "usage")
+SYNONYM_HEADER = ("英文词", "中文释义", "语义细分", "常见搭配", "使用场景及建议")
+
+def chunked(items: list, size: int) -> list:
+  return [items[i:i + size] for i in range(0, len(items), max(1, size))]
+
+def _flat(value) -> str:
+  """合并为一行, 避免破坏单独请求时的输出格式"""
+  return " ".join(str(value).split()) if value is not None else ""
+
+def render_item(prompt_type, entry: dict) -> str:
+  """
+  把一个单词的 JSON 结果转换为与单独请求相同格式的回答
+  :return: 回答内容, 字段不完整时返回 None
+  """
+  if prompt_type == Translator.explain_word:
+    values = [_flat(entry.get(field)) for field in WORD_FIELDS]
+    if not all(values):
+      return None
+    return (f"最接近的中文解释: {values[0]}\n作为俚语或日常用法: {values[1]}\n"
+            f"常用语境: {values[2]}\n造句: {values[3]}")
+  synonyms = entry.get("synonyms")
+  if not isinstance(synonyms, list) or not synonyms:
+    return None
+  rows = [
+    "| " + " | ".join(_flat(synonym.get(field)).replace("|", "/") for field in SYNONYM_FIELDS) + " |"
+    for synonym in synonyms if isinstance(synonym, dict) and synonym.get("english")
+  ]
+  if not rows:
+    return None
+  return "\n".join(["| " + " | ".join(SYNONYM_HEADER) + " |", "|" + "---|" * len(SYNONYM_HEADER)] + rows)
+
+def split_answer(prompt_type, text: str, items: list) -> dict:
+  """
+  拆分打包请求的回答
+  :return: {单词: 回答内容}, 只包含解析成功的单词
+  """
+  data = extract_json(text)
+  entries = data.get("items") if isinstance(data, dict) else data
+  if not isinstance(entries, list):
+    return {}
+  entries = [entry for entry in entries if isinstance(entry, dict)]
+  by_word = {normalize_text(str(entry.get("word", ""))).lower(): entry for entry in entries}
+  answers = {}
+  for index, item in enumerate(items):
+    entry = by_word.get(normalize_text(item).lower())
+    # 模型改写了单词(如大小写, 词形)时, 数量一致则按顺序对应
+    if entry is None and len(entries) == len(items):
+      entry = entries[index]
+    answer = render_item(prompt_type, entry) if entry is not None else None
+    if answer:
+      answers[item] = answer
+  return answers
+
+@measure_time
+async def run_packed(session: Session,
+                     items: list,
+                     prompt_type,
+                     pack_size: int = PACK_SIZE,
+                     concurrency: int = 4,
+                     rps: float = 0,
+                     use_cache: bool = True,
+                     refresh: bool = False,
+                     model: str = None,
+                     batch: bool = False) -> list:
+  """
+  打包请求多个单词, 按输入顺序输出结果
+  :param items: 单词列表, 重复的单词只请求一次
+  :param pack_size: 每个请求最多包含的单词数
+  :param concurrency: 最多同时进行的请求数
+  :param rps: 每秒最多发出的请求数, 小于等于 0 表示不限制
+  :param model: 指定使用的模型, 为 None 时由 router.py 选择
+  :param batch: 是否为批量模式, 影响模型的选择
+  :return: 每个单词对应的 (回答内容, 使用的token数, 请求时间), 失败时回答为空; 打包请求的token数平均分给其中的单词
+  """
+  packed_prompt = PACKABLE[prompt_type]
+  mode = mode_name(prompt_type)
+  route = Model_Router().choose(mode, model, batch = batch)
+  response_format = {"type": "json_object"} if route.model in JSON_MODE_MODELS else None
+  cache = Answer_Cache() if use_cache else None
+  limiter = Rate_Limiter(rps)
+  semaphore = asyncio.Semaphore(max(1, concurrency))
+  unique = list(dict.fromkeys(items))
+  traces = []
+  counts = {"packed": 0, "single": 0, "tokens": 0, "done": 0, "failed": 0}
+
+  def key_of(item: str) -> str:
+    return make_key(prompt_type, item, route.model, TEMPERATURE, MAX_TOKENS)
+
+  async def request(prompt: str, **kwargs):
+    trace = Request_Trace(mode, route.model)
+    traces.append(trace)
+    async with semaphore:
+      await limiter.acquire()
+      try:
+        reply = await session.complete(prompt, model = route.model, **kwargs)
+      except Exception:
+        trace.ok = False
+        raise
+    trace.from_reply(reply)
+    counts["tokens"] += reply.tokens_used
+    return reply
+
+  async def request_single(item: str) -> tuple:
+    counts["single"] += 1
+    reply = await request(render_prompt(prompt_type, item))
+    return reply.answer, reply.tokens_used, reply.request_time, "single"
+
+  async def request_group(group: list) -> dict:
+    """
+    :return: {单词: (回答内容, token数, 请求时间, 来源) 或者 异常}
+    """
+    counts["packed"] += 1
+    results = {}
+    try:
+      reply = await request(packed_prompt.value.format(items = json.dumps(group, ensure_ascii = False)),
+                            response_format = response_format)
+      answers = split_answer(prompt_type, reply.answer, group)
+    except Exception:
+      reply, answers = None, {}
+    share = reply.tokens_used // len(group) if reply is not None else 0
+    for item, answer in answers.items():
+      results[item] = (answer, share, reply.request_time, "packed")
+    # 解析失败的单词改为单独请求
+    missing = [item for item in group if item not in answers]
+    singles = await asyncio.gather(*(request_single(item) for item in missing), return_exceptions = True)
+    results.update(zip(missing, singles))
+    for result in results.values():
+      counts["done"] += 1
+      if isinstance(result, BaseException):
+        counts["failed"] += 1
+    show_progress(counts["done"], len(unique), counts["failed"])
+    return results
+
+  results = {}
+  pending = []
+  for item in unique:
+    record = cache.get(key_of(item)) if cache is not None and not refresh else None
+    if record is not None:
+      results[item] = (record["answer"], 0, record.get("request_time"), "cache")
+    else:
+      pending.append(item)
+  tasks = [asyncio.create_task(request_group(group)) for group in chunked(pending, pack_size)]
+
+  log_entries = []
+  word_records = []
+  try:
+    # 按输入顺序等待, 前面的单词完成后立即输出
+    task_of = {item: task for task, group in zip(tasks, chunked(pending, pack_size)) for item in group}
+    for index, item in enumerate(unique, start = 1):
+      if item in task_of:
+        result = (await task_of[item])[item]
+        results[item] = result
+      result = results[item]
+      if isinstance(result, BaseException):
+        log_entries.append((item, f"请求失败: {result}", prompt_type, route.model))
+        print(f"{CLEAN_SEQ}{RED_DOT} [{index}/{len(unique)}] {item}\n请求失败: {result}\n", flush = True)
+        continue
+      answer, _, request_time, source = result
+      mark = {"cache": "(缓存) ", "single": "(单独请求) "}.get(source, "")
+      print(f"{CLEAN_SEQ}{GREEN_DOT} [{index}/{len(unique)}] {mark}{item}\n{answer}\n", flush = True)
+      if source == "cache":
+        continue
+      log_entries.append((item, answer, prompt_type, route.model))
+      if cache is not None:
+        cache.put(key_of(item), {"answer": answer, "tokens_used": result[1], "request_time": request_time, "model": route.model})
+      if prompt_type == Translator.explain_word:
+        word_data = extract_word_data(item, answer, request_time)
+        if word_data is not None:
+          word_records.append(word_data)
+  finally:
+    for task in tasks:
+      task.cancel()
+
+  sys.stderr.write(CLEAN_SEQ)
+  print(f"完成 {len(unique)} 条, 失败 {counts['failed']} 条 || 请求次数: {counts['packed'] + counts['single']} "
+        f"(打包 {counts['packed']}, 单独 {counts['single']}) || 使用的token数: {counts['tokens']} || 模型: {route.model}")
+  if log_entries:
+    log_messages(log_entries)
+  if word_records:
+    save_words(word_records)
+    print(f"{len(word_records)} 条单词记录已提交, 在后台写入生词本")
+  Metrics_Store().append([trace.record() for trace in traces if not trace.ok or "total" in trace.spans])
+  return [
+    ("", 0, None) if isinstance(results[item], BaseException) else results[item][:3]
+    for item in items
+  ]
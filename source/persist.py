@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# 后台写入日志和生词本(write-behind)
+# 回答显示完毕后, 写日志、更新搜索/相似问题索引、追加生词本并 fsync 都不应该再让用户等待
+# log.log_messages 和 log.save_words 只把记录交给这里的队列, 由后台线程写入:
+#
+#   1. 提交时先把记录追加到本进程的预写日志 data/pending/<pid>-<时间>.jsonl, 只写入操作系统缓冲, 不 fsync
+#   2. 后台线程每次取出队列中的全部记录, 按(日志目录/生词本)分组, 每组只加锁、打开文件和更新索引一次(group commit)
+#   3. 写完一组后在预写日志中追加 {"done": [编号...]}; 全部写完并退出时删除预写日志
+#
+# 提交时只输出"已提交", 实际写入的结果在进程退出、全部写完之后输出, 写入失败时输出到标准错误
+# 进程退出时最多等待 PERSIST_FLUSH_TIMEOUT 秒, 超时或进程崩溃时预写日志保留下来,
+# 下一个 ds 进程第一次提交记录时, 由后台线程补写已经退出的进程留下的预写日志中没有 done 标记的记录
+# 写完记录之后、写入 done 标记之前崩溃时, 补写会重复这几条记录(至少写入一次, 不会丢失)
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from itertools import count
+
+from config import DATA_DIR, PERSIST_FLUSH_TIMEOUT, PERSIST_GROUP_DELAY
+
+PENDING_DIR = os.path.join(DATA_DIR, "pending")
+
+def write_group(kind: str, target: str, records: list) -> None:
+  """
+  同步写入一组记录, 由后台线程调用
+  :param kind: log(问答日志) 或 word(生词本)
+  :param target: 日志目录或生词本路径
+  """
+  from log import write_log_records, write_word_records
+  if kind == "word":
+    write_word_records(records, target)
+  else:
+    write_log_records(records, target)
+
+def process_alive(pid: int) -> bool:
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except (PermissionError, OSError):
+    return True
+  return True
+
+def read_journal(path: str) -> list:
+  """
+  读取预写日志中还没有写入的记录, 跳过崩溃时可能留下的不完整行
+  :return: [(类型, 目标, 记录)]
+  """
+  entries = {}
+  done = set()
+  with open(path, "r", encoding = "utf-8") as file:
+    for line in file:
+      try:
+        item = json.loads(line)
+      except ValueError:
+        continue
+      if "done" in item:
+        done.update(item["done"])
+      else:
+        entries[item["id"]] = (item["kind"], item["target"], item["record"])
+  return [entry for id, entry in entries.items() if id not in done]
+
+class Persist_Queue:
+  def __init__(self, pending_dir: str = None, group_delay: float = PERSIST_GROUP_DELAY):
+    """
+    :param pending_dir: 预写日志所在目录, 默认为 ../data/pending
+    :param group_delay: 收到记录后再等待多久(秒)一起写入, 把相继提交的记录合并为一组
+    """
+    self.pending_dir = pending_dir or PENDING_DIR
+    self.group_delay = group_delay
+    os.makedirs(self.pending_dir, exist_ok = True)
+    self.journal_file = os.path.join(self.pending_dir, f"{os.getpid()}-{int(time.time() * 1000)}.jsonl")
+    self._journal = None
+    self._ids = count(1)
+    self._items = []
+    self._writing = 0
+    self._failed = 0
+    self.written = {} # (类型, 目标) -> 已经写入的记录数
+    self._closed = False
+    self._condition = threading.Condition()
+    self._journal_lock = threading.Lock()
+    self._thread = threading.Thread(target = self._run, name = "ds-persist", daemon = True)
+    self._thread.start()
+
+  def submit(self, kind: str, target: str, records: list) -> None:
+    """
+    提交记录, 写入预写日志后立即返回
+    :param kind: log 或 word
+    :param target: 日志目录或生词本路径
+    """
+    if not records:
+      return
+    items = [(next(self._ids), kind, target, record) for record in records]
+    self._append_journal("".join(
+      json.dumps({"id": id, "kind": kind, "target": target, "record": record}, ensure_ascii = False) + "\n"
+      for id, kind, target, record in items
+    ))
+    with self._condition:
+      self._items.extend(items)
+      self._condition.notify_all()
+
+  @property
+  def pending(self) -> int:
+    """还没有写完的记录数"""
+    with self._condition:
+      return len(self._items) + self._writing
+
+  def flush(self, timeout: float = None) -> bool:
+    """
+    等待已经提交的记录全部写完
+    :param timeout: 最多等待的秒数, None 表示一直等待
+    :return: 是否全部写完
+    """
+    with self._condition:
+      self._condition.notify_all()
+      return self._condition.wait_for(lambda: not self._items and not self._writing, timeout)
+
+  def close(self, timeout: float = PERSIST_FLUSH_TIMEOUT) -> bool:
+    """
+    停止接收记录, 最多等待 timeout 秒写完; 全部写完时删除预写日志, 否则留给下次启动时补写
+    :return: 是否全部写完
+    """
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    self._thread.join(timeout)
+    finished = not self._thread.is_alive() and not self.pending
+    with self._journal_lock:
+      if self._journal is not None:
+        self._journal.close()
+        self._journal = None
+      if finished and not self._failed and os.path.exists(self.journal_file):
+        os.remove(self.journal_file)
+    self.report()
+    if not finished:
+      sys.stderr.write(f"还有 {self.pending} 条日志或生词本记录没有写完, 已保存在 {self.journal_file}, 下次运行时会自动补写\n")
+    return finished and not self._failed
+
+  def report(self) -> None:
+    """输出实际写入的结果, 不包括补写的其他进程留下的记录"""
+    for (kind, target), count in list(self.written.items()):
+      if kind == "word":
+        print(f"✅ 已将 {count} 条单词记录追加到生词本 {target}")
+      else:
+        print(f"日志已记录到 {target}")
+
+  def _append_journal(self, lines: str) -> None:
+    with self._journal_lock:
+      if self._journal is None:
+        self._journal = open(self.journal_file, "a", encoding = "utf-8")
+      self._journal.write(lines)
+      self._journal.flush() # 写入操作系统缓冲, 进程崩溃也不会丢失
+
+  def _run(self) -> None:
+    """后台线程: 先补写其他进程留下的记录, 再按组写入队列中的记录"""
+    self._recover()
+    while True:
+      with self._condition:
+        self._condition.wait_for(lambda: self._items or self._closed)
+        if not self._items and self._closed:
+          return
+      if not self._closed and self.group_delay > 0:
+        time.sleep(self.group_delay)
+      with self._condition:
+        items, self._items = self._items, []
+        self._writing = len(items)
+      try:
+        self._write(items)
+      finally:
+        with self._condition:
+          self._writing = 0
+          self._condition.notify_all()
+
+  def _write(self, items: list) -> None:
+    """按 (类型, 目标) 分组写入, 每组写完后记录 done 标记, 出错的组留在预写日志中"""
+    groups = {}
+    for id, kind, target, record in items:
+      groups.setdefault((kind, target), []).append((id, record))
+    for (kind, target), group in groups.items():
+      try:
+        write_group(kind, target, [record for _, record in group])
+      except Exception as e:
+        sys.stderr.write(f"后台写入{'生词本' if kind == 'word' else '日志'}失败: {e}, 记录保留在 {self.journal_file}\n")
+        self._failed += len(group)
+        continue
+      self._append_journal(json.dumps({"done": [id for id, _ in group]}) + "\n")
+      self.written[(kind, target)] = self.written.get((kind, target), 0) + len(group)
+
+  def _recover(self) -> int:
+    """
+    补写已经退出的进程留下的预写日志
+    先把文件改名为本进程的预写日志, 改名是原子操作, 多个进程同时启动时只有一个能拿到同一份文件;
+    补写过程中本进程崩溃, 改名后的文件同样会被之后的进程补写
+    :return: 补写的记录数
+    """
+    try:
+      names = sorted(os.listdir(self.pending_dir))
+    except OSError:
+      return 0
+    total = 0
+    for index, name in enumerate(names):
+      path = os.path.join(self.pending_dir, name)
+      try:
+        pid = int(name.split("-", 1)[0])
+      except ValueError:
+        continue
+      if path == self.journal_file or pid == os.getpid() or process_alive(pid):
+        continue
+      claimed = os.path.join(self.pending_dir, f"{os.getpid()}-{int(time.time() * 1000)}-recover{index}.jsonl")
+      try:
+        os.rename(path, claimed)
+      except OSError: # 已经被其他进程拿走
+        continue
+      try:
+        entries = read_journal(claimed)
+        groups = {}
+        for kind, target, record in entries:
+          groups.setdefault((kind, target), []).append(record)
+        for (kind, target), records in groups.items():
+          write_group(kind, target, records)
+        os.remove(claimed)
+        total += len(entries)
+      except Exception as e:
+        sys.stderr.write(f"补写 {claimed} 失败: {e}\n")
+    return total
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue() -> Persist_Queue:
+  """本进程的写入队列, 第一次使用时创建, 并在进程退出时最多等待 PERSIST_FLUSH_TIMEOUT 秒写完"""
+  global _queue
+  with _queue_lock:
+    if _queue is None:
+      _queue = Persist_Queue()
+      atexit.register(_queue.close)
+    return _queue
+
+def submit(kind: str, target: str, records: list) -> None:
+  get_queue().submit(kind, target, records)
+
+def flush(timeout: float = None) -> bool:
+  """等待本进程已经提交的记录写完, 还没有提交过记录时直接返回"""
+  return _queue.flush(timeout) if _queue is not None else True
+
+def main():
+  print("persist主程序已运行!")
+
+if __name__ == "__main__":
+  main()
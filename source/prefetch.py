@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# 错峰预取: 把以后会查询的词表加入持久化的任务队列, 在错峰优惠时段(服务器时间, 见 config.OFF_PEAK_WINDOWS)集中请求
+# 回答写入回答缓存, 单词解释同时写入生词本, 白天查询时直接命中缓存
+#
+# 任务队列保存在 data/prefetch.db (SQLite) 中, 每条任务结束后立即更新状态, 中断后再次执行会从未完成的任务继续
+# 执行方式:
+#   ds prefetch --run   在前台等待错峰时段开始, 时段结束、用完 token 预算或队列清空时退出
+#   ds --daemon         常驻进程每隔几分钟检查一次, 错峰时段内自动执行
+# 已经有缓存的任务直接跳过; 每个错峰时段使用的 token 数不超过预算, 超出后等到下一个时段继续
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+
+from config import DATA_DIR, TEMPERATURE, MAX_TOKENS, PREFETCH_CONCURRENCY, PREFETCH_TOKEN_BUDGET, PREFETCH_MAX_ATTEMPTS
+from prompts import Translator
+from cache import Answer_Cache, make_key
+from router import Model_Router, candidate_models, window_bounds, next_window_start
+from templates import get_registry, render_prompt
+from utils import CLEAN_SEQ, GREEN_DOT, RED_DOT
+
+QUEUE_FILE = os.path.join(DATA_DIR, "prefetch.db")
+STATUSES = ("pending", "done", "skipped", "failed")
+
+class Prefetch_Queue:
+  def __init__(self, queue_file: str = None, max_attempts: int = PREFETCH_MAX_ATTEMPTS):
+    """
+    :param queue_file: 队列数据库路径, 默认为 ../data/prefetch.db
+    :param max_attempts: 任务最多尝试的次数
+    """
+    self.queue_file = queue_file or QUEUE_FILE
+    self.max_attempts = max_attempts
+    os.makedirs(os.path.dirname(os.path.abspath(self.queue_file)), exist_ok = True)
+    self.conn = sqlite3.connect(self.queue_file, timeout = 10)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    with self.conn:
+      # 同一模式下相同的内容只保留一条任务
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY, mode TEXT, text TEXT, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, "
+        "tokens INTEGER DEFAULT 0, model TEXT, error TEXT, added REAL, finished REAL, UNIQUE(mode, text))"
+      )
+      self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id)")
+
+  def close(self) -> None:
+    self.conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc) -> None:
+    self.close()
+
+  def add(self, items: list) -> int:
+    """
+    加入任务, 已经在队列中的任务(包括已完成的)不会重复加入
+    :param items: (模式名称, 输入内容) 列表
+    :return: 新加入的任务数
+    """
+    before = self.conn.total_changes
+    now = time.time()
+    with self.conn:
+      self.conn.executemany(
+        "INSERT OR IGNORE INTO jobs (mode, text, added) VALUES (?, ?, ?)",
+        ((mode, " ".join(text.split()), now) for mode, text in items)
+      )
+    return self.conn.total_changes - before
+
+  def pending(self) -> list:
+    """
+    :return: 未完成的任务 [(id, 模式名称, 输入内容)], 按加入顺序排列
+    """
+    return self.conn.execute("SELECT id, mode, text FROM jobs WHERE status = 'pending' ORDER BY id").fetchall()
+
+  def finish(self, job_id: int, status: str = "done", tokens: int = 0, model: str = None) -> None:
+    """记录任务完成或跳过"""
+    with self.conn:
+      self.conn.execute(
+        "UPDATE jobs SET status = ?, tokens = ?, model = ?, error = NULL, finished = ? WHERE id = ?",
+        (status, tokens, model, time.time(), job_id)
+      )
+
+  def fail(self, job_id: int, error: str, tokens: int = 0, retry: bool = True) -> None:
+    """
+    记录一次失败, 次数用完之前仍然留在队列中
+    :param retry: 为 False 时直接标记为失败, 用于重试也不会成功的任务
+    """
+    with self.conn:
+      self.conn.execute(
+        "UPDATE jobs SET attempts = attempts + 1, error = ?, tokens = tokens + ?, finished = ?, "
+        "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END WHERE id = ?",
+        (error, tokens, time.time(), self.max_attempts if retry else 0, job_id)
+      )
+
+  def retry_failed(self) -> int:
+    """把失败的任务重新加入队列"""
+    with self.conn:
+      return self.conn.execute("UPDATE jobs SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+
+  def counts(self) -> dict:
+    """:return: {状态: 任务数}"""
+    counts = dict.fromkeys(STATUSES, 0)
+    counts.update(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    return counts
+
+  def tokens_since(self, since: float) -> int:
+    """since 之后完成或失败的任务使用的 token 数"""
+    return self.conn.execute("SELECT COALESCE(SUM(tokens), 0) FROM jobs WHERE finished >= ?", (since,)).fetchone()[0]
+
+def show_progress(stats: dict) -> None:
+  """在标准错误输出中刷新进度"""
+  processed = stats["done"] + stats["skipped"] + stats["failed"]
+  sys.stderr.write(f"{CLEAN_SEQ}预取进度: {processed}/{stats['total']} 完成: {stats['done']} 跳过: {stats['skipped']} "
+                   f"失败: {stats['failed']} || 使用的token数: {stats['tokens']}")
+  sys.stderr.flush()
+
+async def drain(session,
+                queue: Prefetch_Queue,
+                concurrency: int = PREFETCH_CONCURRENCY,
+                budget: int = PREFETCH_TOKEN_BUDGET,
+                model: str = None,
+                router: Model_Router = None,
+                ignore_window: bool = False,
+                progress: bool = True) -> dict:
+  """
+  执行队列中的任务, 直到队列清空、错峰时段结束或者用完 token 预算
+  :param session: engine.Session
+  :param concurrency: 同时进行的请求数
+  :param budget: token 预算, 0 表示不限制; 错峰时段内为整个时段的预算(包括之前的执行), 忽略时段时为本次执行的预算
+  :param model: 指定使用的模型, 为 None 时按批量模式的规则选择(见 router.py)
+  :param ignore_window: 是否忽略错峰时段立即执行
+  :param progress: 是否在标准错误输出中显示进度
+  :return: {"total", "done", "skipped", "failed", "tokens", "stopped"}, stopped 为停止的原因
+  """
+  from classifier import in_word_book
+  from log import extract_word_data, save_words
+  from metrics import Request_Trace, Metrics_Store
+
+  router = router or Model_Router()
+  cache = Answer_Cache()
+  registry = get_registry()
+  jobs = queue.pending()
+  spent = 0
+  if not ignore_window:
+    bounds = window_bounds(router.now(), router.windows)
+    spent = queue.tokens_since(bounds[0].timestamp()) if bounds else 0
+  stats = {"total": len(jobs), "done": 0, "skipped": 0, "failed": 0, "tokens": 0, "stopped": "队列已清空"}
+  saved_words = set() # 本次写入生词本的单词, in_word_book 读取的单词表不会随之更新
+  traces = []
+
+  def stop_reason() -> str:
+    if not ignore_window and not router.is_off_peak():
+      return "错峰时段已结束"
+    if budget and spent + stats["tokens"] >= budget:
+      return f"已用完 token 预算 ({budget})"
+    return None
+
+  def remember_word(prompt_type, text: str, answer: str, request_time: str) -> None:
+    """单词解释写入生词本, 已经查过的单词不重复写入"""
+    if prompt_type != Translator.explain_word or text.lower() in saved_words or in_word_book(text):
+      return
+    word_data = extract_word_data(text, answer, request_time)
+    if word_data is not None:
+      save_words([word_data])
+      saved_words.add(text.lower())
+
+  async def process(job_id: int, mode: str, text: str) -> None:
+    try:
+      template = registry.get(mode)
+    except KeyError as e:
+      queue.fail(job_id, e.args[0])
+      stats["failed"] += 1
+      return
+    prompt_type = template.prompt_type or template
+    # 该模式可能使用的任何一个模型的缓存都可以直接使用, 与 main.try_cache 相同
+    for candidate in candidate_models(mode):
+      record = cache.get(make_key(prompt_type, text, candidate, TEMPERATURE, MAX_TOKENS))
+      if record is not None:
+        remember_word(prompt_type, text, record["answer"], record.get("request_time"))
+        queue.finish(job_id, "skipped", model = candidate)
+        stats["skipped"] += 1
+        return
+    route = router.choose(mode, model, batch = True)
+    trace = Request_Trace(mode, route.model)
+    traces.append(trace)
+    try:
+      reply = await session.complete(render_prompt(prompt_type, text), model = route.model)
+    except Exception as e:
+      trace.ok = False
+      queue.fail(job_id, str(e))
+      stats["failed"] += 1
+      return
+    trace.from_reply(reply)
+    stats["tokens"] += reply.tokens_used
+    if not reply.answer:
+      queue.fail(job_id, "回答为空", reply.tokens_used)
+      stats["failed"] += 1
+      return
+    # 被截断的回答不完整, 不能作为缓存; 重新请求仍然会被截断, 不再重试
+    if trace.truncated:
+      queue.fail(job_id, "回答达到最大 token 数被截断", reply.tokens_used, retry = False)
+      stats["failed"] += 1
+      return
+    cache.put(make_key(prompt_type, text, route.model, TEMPERATURE, MAX_TOKENS),
+              {"answer": reply.answer, "tokens_used": reply.tokens_used, "request_time": reply.request_time, "model": route.model})
+    remember_word(prompt_type, text, reply.answer, reply.request_time)
+    queue.finish(job_id, "done", reply.tokens_used, route.model)
+    stats["done"] += 1
+
+  remaining = iter(jobs)
+
+  async def worker() -> None:
+    # 多个 worker 共用同一个迭代器, 每条任务只会被取出一次
+    for job_id, mode, text in remaining:
+      reason = stop_reason()
+      if reason is not None:
+        stats["stopped"] = reason
+        return
+      await process(job_id, mode, text)
+      if progress:
+        show_progress(stats)
+
+  try:
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+  finally:
+    # 中断时进行中的任务仍然留在队列中, 下次继续
+    if progress:
+      sys.stderr.write(CLEAN_SEQ)
+    Metrics_Store().append([trace.record() for trace in traces if not trace.ok or "total" in trace.spans])
+  return stats
+
+def format_status(queue: Prefetch_Queue) -> str:
+  """队列中各状态的任务数"""
+  counts = queue.counts()
+  return (f"预取队列: 等待 {counts['pending']} 条, 完成 {counts['done']} 条, 已有缓存 {counts['skipped']} 条, "
+          f"失败 {counts['failed']} 条 ({queue.queue_file})")
+
+def format_result(stats: dict) -> str:
+  return (f"完成 {stats['done']} 条, 已有缓存 {stats['skipped']} 条, 失败 {stats['failed']} 条 || "
+          f"使用的token数: {stats['tokens']} || {stats['stopped']}")
+
+async def run_scheduler(queue: Prefetch_Queue,
+                        concurrency: int = PREFETCH_CONCURRENCY,
+                        budget: int = PREFETCH_TOKEN_BUDGET,
+                        model: str = None,
+                        ignore_window: bool = False) -> dict:
+  """
+  在前台执行队列: 不在错峰时段时等待时段开始, 执行完一个时段后返回
+  :return: drain 的结果
+  """
+  from engine import Session
+  router = Model_Router()
+  if not ignore_window and not router.is_off_peak():
+    start = next_window_start(router.now(), router.windows)
+    print(f"等待错峰时段开始: {start:%Y-%m-%d %H:%M} (服务器时间), 可以用 --now 立即执行", flush = True)
+    await asyncio.sleep(max(0.0, (start - router.now()).total_seconds()))
+  async with Session() as session:
+    return await drain(session, queue, concurrency, budget, model, router, ignore_window)
+
+def prefetch_command(args, items: list) -> None:
+  """
+  ds prefetch 的入口
+  :param args: cli.parse_prefetch_arguments 的结果
+  :param items: 从词表文件中读取的内容
+  """
+  from cli import MODES
+  from query_log import mode_name
+  with Prefetch_Queue() as queue:
+    if args.retry_failed:
+      print(f"已把 {queue.retry_failed()} 条失败的任务重新加入队列")
+    if items:
+      if args.mode:
+        modes = [mode_name(MODES[args.mode])] * len(items)
+      else:
+        # 没有指定模式时每条分别自动选择
+        from classifier import classify, in_word_book
+        modes = [mode_name(classify(item, in_word_book).prompt_type) for item in items]
+      added = queue.add(list(zip(modes, items)))
+      print(f"{GREEN_DOT} 已加入 {added} 条任务, {len(items) - added} 条已经在队列中")
+    if (args.run or args.now) and not queue.counts()["pending"]:
+      print("队列中没有等待执行的任务")
+    elif args.run or args.now:
+      if not os.getenv('DEEPSEEK_API_KEY'):
+        print("请设置环境变量 DEEPSEEK_API_KEY")
+        sys.exit(1)
+      try:
+        stats = asyncio.run(run_scheduler(queue, args.concurrency, args.budget, args.model, args.now))
+      except KeyboardInterrupt:
+        print(f"\n{RED_DOT} 预取已中断, 未完成的任务保留在队列中")
+        sys.exit(130)
+      print(format_result(stats))
+    print(format_status(queue))
+
+def main():
+  print("prefetch主程序已运行!")
+
+if __name__ == "__main__":
+  main()
@@ -1,12 +1,14 @@
 from enum import Enum
 
+# 输入内容 {text} 统一放在模板的最后, 不同输入之间的提示词前缀相同, 可以命中服务器的提示词缓存(见 templates.py)
+
 class User_prompt(Enum):
-  default_answer = """请较简洁地回答我的问题: 
-{text}
+  default_answer = """请较简洁地回答我的问题
 要求：
 1. 使用中文
 2. 不要使用转义符号，不要使用 markdown 格式中的强调符号
-"""
+
+问题: {text}"""
 
 class Translator(Enum):
   fast_translate = """请识别下面要翻译的句子是中/日/英三种语言中的哪种，如果确定了是哪一国语言，则根据要求将其翻译成另外两国语言
@@ -35,21 +37,30 @@ class Translator(Enum):
 需要解释的内容: {text}
     """
 
-  explain_sentence = """请对下面的句子进行详细的解读并按照详细要求回答：
-句子: {text}
+  explain_sentence = """请对我给出的句子进行详细的解读并按照详细要求回答：
 
 要求:
 1. 用中文给出整句的通顺译文，句子可能是不完整的，或是有语法错误的，上下文信息缺失的，对于这些情况需要进行合理的推测
 2. 标注剧中所有较难理解的词汇或短语，以及一些常用词汇或短语的在此处的特殊用法，并分别解释其含义
 3. 说明这些难点在句中为什么这样使用，以及如何在类似语境下的运用
-"""
+
+句子: {text}"""
+  document_translate = """下面是从一篇长文档中按顺序切分出来的一段，请翻译这一段
+要求：
+1. 原文是中文时翻译成英文，否则翻译成中文
+2. 只输出译文，不要添加解释、标题或说明，也不要重复原文
+3. 保留原文的段落划分，段落之间空一行
+4. 这一段可能从句子中间开始或结束，按原文的断句翻译，不要补充内容
+
+原文:
+{text}"""
   translate_jp = """请将我给出的中文翻译成日文，要求：
 1. 根据语言风格进行翻译，推测可能的上下文，并给出翻译的详细步骤和理由
 2. 符合日本人的说话习惯和思维方式，不能按照中文母语者的思维字面地、一字一句地强行翻译
 3. 推测语言的场景，根据场景使用不同程度的敬语或普通型甚至较为随意的用法
 
 需要翻译的内容: {text}"""
-  en_synonyms = """针对我给出的词语<{text}>，查询其英语同义词/近义词(如果有)，具体执行以下操作：
+  en_synonyms = """针对我给出的词语，查询其英语同义词/近义词(如果有)，具体执行以下操作：
 1. 列出其对应的主要英文词汇
 2. 根据语义、搭配和使用场景及上下文，对这些英文词汇进行分类(如"正式/非正式"，"强度高/中/低")
 3. 生成一张表格，包含：
@@ -58,4 +69,49 @@ class Translator(Enum):
   - 语义细分(标签)
   - 常见搭配
   - 使用场景及建议
-"""
+
+需要查询的词语: {text}"""
+
+class Packed_prompt(Enum):
+  """
+  一次请求处理多个单词/词语, 要求以 JSON 对象输出, 由 pack.py 拆分回每个单词
+  {items} 为输入内容组成的 JSON 数组
+  """
+  explain_word = """请逐个解释下面 JSON 数组中给出的每个单词/词组/短语的含义，对每一项:
+1. 给出最接近的中文解释
+2. 如果这个单词是个俚语或使用场景较多，请进一步解释其当前在英美母语者当中的含义
+3. 进一步解释这个单词的常用语境，以帮助我理解这个单词如何使用
+4. 从应用角度(如日常对话或专业领域)给出一个涉及该单词的造句
+注意，每一项的内容都使用普通文本，不要换行，不要使用markdown格式的强调符号
+5. 只输出一个 JSON 对象，items 的顺序与输入相同，word 与输入完全一致，严格使用以下格式：
+{{"items": [{{"word": "<输入的单词>", "closest_chinese": "<ans1>", "slang_or_usage": "<ans2>", "context": "<ans3>", "example": "<ans4>"}}]}}
+
+需要解释的内容: {items}"""
+
+  en_synonyms = """针对下面 JSON 数组中给出的每个词语，查询其英语同义词/近义词(如果有)，对每一项:
+1. 列出其对应的主要英文词汇
+2. 根据语义、搭配和使用场景及上下文，对这些英文词汇进行分类(如"正式/非正式"，"强度高/中/低")
+3. 对每个英文词汇给出中文释义、语义细分(标签)、常见搭配、使用场景及建议
+4. 只输出一个 JSON 对象，items 的顺序与输入相同，word 与输入完全一致，严格使用以下格式：
+{{"items": [{{"word": "<输入的词语>", "synonyms": [{{"english": "<英文词>", "meaning": "<中文释义>", "tags": "<语义细分>", "collocations": "<常见搭配>", "usage": "<使用场景及建议>"}}]}}]}}
+
+需要查询的词语: {items}"""
+
+class Conversation_prompt(Enum):
+  """
+  多轮对话(见 conversation.py)使用的提示词
+  摘要以一问一答的形式插入到第一轮之后, 推理模型不接受连续两条相同角色的消息
+  """
+  summary_note = """以下是我们在这之后、最近几轮之前的对话摘要，请在回答时参考：
+{summary}"""
+  summary_ack = "好的，我会结合这些内容继续回答。"
+  summarize = """请把下面的对话内容压缩成一段简洁的摘要，供之后的对话参考
+要求：
+1. 使用中文，只输出摘要本身
+2. 保留讨论过的句子、单词、结论和仍未解决的问题，省略寒暄和重复的内容
+3. 如果给出了之前的摘要，把它和新的对话合并成一段摘要
+
+之前的摘要: {summary}
+
+对话内容:
+{turns}"""
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# 结构化的问答日志
+# 每条记录为一行 JSON, 写入 data/log/current.jsonl
+# current.jsonl 超过一定大小或跨天之后归档为 gzip 压缩的分段文件, 同时在 index.json 中记录
+# 该分段的时间范围和各模式的记录数, 查询时只需要解压时间范围和模式都匹配的分段
+#
+# index.json 格式:
+# {"segments": [{"file": "log-20261001-000000.jsonl.gz", "start": 1790000000.0, "end": 1790086399.0,
+#                "count": 120, "modes": {"explain_word": 80, "fast_translate": 40}}]}
+
+import os
+import re
+import gzip
+import json
+import time
+from datetime import datetime
+
+from utils import file_lock, write_json_atomic
+from config import DATA_DIR
+
+LOG_DIR = os.path.join(DATA_DIR, "log")
+LEGACY_LOG_FILE = os.path.join(DATA_DIR, "log.txt")
+# 当前分段超过该大小(字节)时归档
+ROTATE_BYTES = 4 * 1024 * 1024
+
+# 旧版 log.txt 的一条记录, 回答中可能包含换行和 ], 因此以下一条记录的开头作为结束标志
+LEGACY_PATTERN = re.compile(
+  r"\[(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})[^\n|]*\|\| Prompt Type: (?P<type>[^\n]*)\n"
+  r"Question: (?P<question>.*?)\nAnswer: (?P<answer>.*?)\]\n\n"
+  r"(?=\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|\Z)",
+  re.S
+)
+
+def mode_name(prompt_type) -> str:
+  """提示词类型的名称, 如 Translator.explain_word -> explain_word"""
+  name = getattr(prompt_type, "name", None)
+  if name:
+    return name
+  return str(prompt_type).rsplit(".", 1)[-1]
+
+def parse_time(text: str) -> float:
+  """
+  解析命令行中输入的本地时间
+  :param text: 如 2026-10-01 或 2026-10-01 08:30
+  :return: 时间戳
+  """
+  for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+    try:
+      return datetime.strptime(text, fmt).timestamp()
+    except ValueError:
+      continue
+  raise ValueError(f"无法识别的时间格式: {text}, 请使用 YYYY-MM-DD 或 YYYY-MM-DD HH:MM")
+
+class Query_Log:
+  def __init__(self, log_dir: str = None, rotate_bytes: int = ROTATE_BYTES, legacy_file: str = LEGACY_LOG_FILE):
+    """
+    :param log_dir: 日志目录, 默认为 ../data/log
+    :param rotate_bytes: 当前分段的归档阈值
+    :param legacy_file: 旧版 log.txt 的路径, 存在时第一次使用会自动迁移
+    """
+    self.log_dir = log_dir or LOG_DIR
+    self.current_file = os.path.join(self.log_dir, "current.jsonl")
+    self.index_file = os.path.join(self.log_dir, "index.json")
+    self.lock_file = os.path.join(self.log_dir, ".lock")
+    self.rotate_bytes = rotate_bytes
+    self.legacy_file = legacy_file
+    os.makedirs(self.log_dir, exist_ok = True)
+    if legacy_file and os.path.exists(legacy_file):
+      self.migrate_legacy(legacy_file)
+
+  def append(self, records: list) -> None:
+    """
+    追加多条记录
+    :param records: 字典列表, 至少包含 ts(时间戳), mode, question, answer
+    """
+    if not records:
+      return
+    lines = "".join(json.dumps(record, ensure_ascii = False) + "\n" for record in records)
+    with file_lock(self.lock_file):
+      self._rotate_if_needed(records[0]["ts"])
+      with open(self.current_file, "a", encoding = "utf-8") as file:
+        file.write(lines)
+
+  def query(self, since: float = None, until: float = None, mode: str = None):
+    """
+    按时间范围和模式查询记录, 按时间顺序返回
+    :param since: 起始时间戳(包含)
+    :param until: 结束时间戳(不包含)
+    :param mode: 模式名称, 如 explain_word
+    """
+    def match(record: dict) -> bool:
+      if since is not None and record["ts"] < since:
+        return False
+      if until is not None and record["ts"] >= until:
+        return False
+      return mode is None or record.get("mode") == mode
+
+    for segment in self._index()["segments"]:
+      # 根据索引跳过时间范围或模式不匹配的分段, 不需要解压
+      if since is not None and segment["end"] < since:
+        continue
+      if until is not None and segment["start"] >= until:
+        continue
+      if mode is not None and not segment["modes"].get(mode):
+        continue
+      with gzip.open(os.path.join(self.log_dir, segment["file"]), "rt", encoding = "utf-8") as file:
+        for record in self._parse(file):
+          if match(record):
+            yield record
+    if os.path.exists(self.current_file):
+      with open(self.current_file, "r", encoding = "utf-8") as file:
+        for record in self._parse(file):
+          if match(record):
+            yield record
+
+  def rotate(self) -> None:
+    """立即归档当前分段"""
+    with file_lock(self.lock_file):
+      self._rotate()
+
+  def migrate_legacy(self, legacy_file: str) -> int:
+    """
+    将旧版 log.txt 迁移为结构化日志, 迁移后原文件重命名为 log.txt.migrated
+    :return: 迁移的记录数
+    """
+    with file_lock(self.lock_file):
+      if not os.path.exists(legacy_file): # 其他 ds 进程已经迁移过了
+        return 0
+      with open(legacy_file, "r", encoding = "utf-8") as file:
+        content = file.read()
+      records = []
+      for match in LEGACY_PATTERN.finditer(content):
+        records.append({
+          "ts": datetime.strptime(match.group("time"), "%Y-%m-%d %H:%M:%S").timestamp(),
+          "time": match.group("time"),
+          "mode": mode_name(match.group("type").strip()),
+          "question": match.group("question"),
+          "answer": match.group("answer")
+        })
+      # 旧记录比现有的结构化日志更早, 直接归档为单独的分段
+      if records:
+        self._archive(records, "legacy")
+      os.replace(legacy_file, legacy_file + ".migrated")
+    print(f"已将 {len(records)} 条旧日志从 {legacy_file} 迁移到 {self.log_dir}")
+    return len(records)
+
+  def _parse(self, file):
+    for line in file:
+      try:
+        yield json.loads(line)
+      except ValueError:
+        continue # 进程崩溃时可能留下不完整的行
+
+  def _index(self) -> dict:
+    try:
+      with open(self.index_file, "r", encoding = "utf-8") as file:
+        return json.load(file)
+    except (OSError, ValueError):
+      return {"segments": []}
+
+  def _rotate_if_needed(self, ts: float) -> None:
+    """当前分段超过大小或者与新记录不在同一天时归档, 调用方需要持有文件锁"""
+    try:
+      stat = os.stat(self.current_file)
+    except OSError:
+      return
+    if stat.st_size >= self.rotate_bytes:
+      self._rotate()
+      return
+    with open(self.current_file, "r", encoding = "utf-8") as file:
+      first = next(self._parse(file), None)
+    if first is not None and datetime.fromtimestamp(first["ts"]).date() != datetime.fromtimestamp(ts).date():
+      self._rotate()
+
+  def _rotate(self) -> None:
+    if not os.path.exists(self.current_file):
+      return
+    with open(self.current_file, "r", encoding = "utf-8") as file:
+      records = list(self._parse(file))
+    if records:
+      self._archive(records, "log")
+    os.remove(self.current_file)
+
+  def _archive(self, records: list, prefix: str) -> None:
+    """将记录压缩为一个分段并加入索引, 调用方需要持有文件锁"""
+    start = min(record["ts"] for record in records)
+    name = f"{prefix}-{datetime.fromtimestamp(start).strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 100000:05d}.jsonl.gz"
+    path = os.path.join(self.log_dir, name)
+    with gzip.open(path, "wt", encoding = "utf-8") as file:
+      for record in records:
+        file.write(json.dumps(record, ensure_ascii = False) + "\n")
+    modes = {}
+    for record in records:
+      modes[record.get("mode")] = modes.get(record.get("mode"), 0) + 1
+    index = self._index()
+    index["segments"].append({
+      "file": name,
+      "start": start,
+      "end": max(record["ts"] for record in records),
+      "count": len(records),
+      "modes": modes
+    })
+    index["segments"].sort(key = lambda segment: segment["start"])
+    write_json_atomic(self.index_file, index)
+
+def main():
+  print("query_log主程序已运行!")
+
+if __name__ == "__main__":
+  main()
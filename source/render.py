@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# 流式输出渲染
+# 网络读取和终端输出分开进行: 网络收到的内容只放进缓冲区, 由渲染任务按帧写到终端
+# 渲染领先于网络(缓冲区里只有刚收到的一小段)时, 把这一段分几帧写完, 看起来像打字机一样平滑
+# 渲染落后于网络时, 每帧写出的字数随缓冲区长度增加, 网络结束后剩余内容立即全部写出
+
+import sys
+import time
+import math
+import asyncio
+
+# 每帧间隔(秒), 约 60 帧每秒
+FRAME_INTERVAL = 1 / 60
+# 新收到的一段内容大约分几帧写完
+DRAIN_FRAMES = 4
+
+class Stream_Renderer:
+  def __init__(self,
+               typewriter: bool = True,
+               frame_interval: float = FRAME_INTERVAL,
+               drain_frames: int = DRAIN_FRAMES,
+               out = None):
+    """
+    :param typewriter: 是否平滑输出, 为 False 时收到内容立即原样输出
+    :param frame_interval: 每帧间隔(秒)
+    :param drain_frames: 新内容大约分几帧写完
+    :param out: 输出流, 默认为标准输出
+    """
+    self.typewriter = typewriter
+    self.frame_interval = frame_interval
+    self.drain_frames = max(1, drain_frames)
+    self.out = out or sys.stdout
+    self._parts = []
+    self._pending = 0
+    self._closed = False
+    self._running = False
+    self._wakeup = asyncio.Event()
+    self._done = asyncio.Event()
+    # 用于统计显示延迟
+    self.last_feed_time = None
+    self.close_time = None
+    self.last_write_time = None
+
+  def feed(self, text: str) -> None:
+    """
+    收到一段网络内容
+    """
+    self.last_feed_time = time.perf_counter()
+    if not self.typewriter and self._running:
+      self._write(text)
+      return
+    self._parts.append(text)
+    self._pending += len(text)
+    self._wakeup.set()
+
+  def close(self) -> None:
+    """
+    网络传输结束, 剩余内容立即全部写出
+    """
+    if not self._closed:
+      self.close_time = time.perf_counter()
+    self._closed = True
+    self._wakeup.set()
+    self._done.set()
+
+  async def run(self) -> None:
+    """
+    渲染任务, 直到 close() 被调用且缓冲区写完为止
+    在此之前收到的内容会先留在缓冲区中, 以免和加载动画的输出混在一起
+    """
+    self._running = True
+    while True:
+      if not self._pending:
+        if self._closed:
+          return
+        self._wakeup.clear()
+        await self._wakeup.wait()
+        continue
+      buffer = "".join(self._parts)
+      if self._closed or not self.typewriter:
+        count = len(buffer)
+      else:
+        count = math.ceil(len(buffer) / self.drain_frames)
+      self._write(buffer[:count])
+      rest = buffer[count:]
+      self._parts = [rest] if rest else []
+      self._pending = len(rest)
+      if self._pending and not self._closed:
+        # 等待下一帧, 期间网络结束则立即写出剩余内容
+        try:
+          await asyncio.wait_for(self._done.wait(), self.frame_interval)
+        except asyncio.TimeoutError:
+          pass
+
+  def _write(self, text: str) -> None:
+    self.out.write(text)
+    self.out.flush()
+    self.last_write_time = time.perf_counter()
+
+  @property
+  def display_lag(self) -> float:
+    """
+    显示延迟(秒): 显示最后一个字符的时间与网络传输结束的时间之差
+    """
+    if self.last_feed_time is None or self.last_write_time is None:
+      return 0.0
+    network_end = max(self.last_feed_time, self.close_time or 0.0)
+    return max(0.0, self.last_write_time - network_end)
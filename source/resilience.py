@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# 请求的超时、重试和对冲规则, 由 engine.Session 使用
+#
+# 三种超时:
+#   connect      建立 TCP/TLS 连接的时间, 交给 httpx 控制
+#   first_token  发出请求到收到第一段内容(包括推理模型的思考过程)的时间, 连接卡住时尽早放弃并重试
+#   total        整个请求(包括重试)的时间, 即 Session 的 timeout
+# 连接错误、超时、429 和 5xx 错误会在收到任何内容之前重试, 重试间隔为带随机抖动的指数退避
+# 已经输出了部分内容的请求不再重试, 避免重复输出
+#
+# 对冲请求: 首字延迟超过该模型最近的 p95 时, 再发出一个相同的请求, 先收到内容的一方胜出, 另一方立即取消
+# 只有约 5% 的请求会触发对冲, 额外的费用很少, 但可以去掉偶尔卡住的请求造成的长尾延迟
+
+import sys
+import random
+import asyncio
+
+from config import CONNECT_TIMEOUT, FIRST_TOKEN_TIMEOUT, MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+
+# 需要重试的 HTTP 状态码
+RETRYABLE_STATUS = (408, 409, 429)
+
+class Deadline_Exceeded(Exception):
+  """超过了首字超时时间"""
+
+class Retry_Policy:
+  def __init__(self,
+               max_retries: int = MAX_RETRIES,
+               base_delay: float = RETRY_BASE_DELAY,
+               max_delay: float = RETRY_MAX_DELAY,
+               connect_timeout: float = CONNECT_TIMEOUT,
+               first_token_timeout: float = FIRST_TOKEN_TIMEOUT,
+               seed: int = None):
+    """
+    :param max_retries: 最多重试的次数, 0 表示不重试
+    :param base_delay: 第一次重试前最长等待的时间(秒), 之后每次翻倍
+    :param max_delay: 重试前最长等待的时间(秒)
+    :param connect_timeout: 建立连接的超时时间(秒)
+    :param first_token_timeout: 收到第一段内容的超时时间(秒), None 表示不限制
+    :param seed: 随机数种子, 便于测试
+    """
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.connect_timeout = connect_timeout
+    self.first_token_timeout = first_token_timeout
+    self.random = random.Random(seed)
+
+  def backoff(self, attempt: int, retry_after: float = None) -> float:
+    """
+    第 attempt 次(从 0 开始)失败后等待的时间, 在 0 到指数上限之间随机选择 (full jitter)
+    多个客户端同时失败时不会在同一时刻一起重试
+    :param retry_after: 服务器要求的等待时间(秒), 优先使用
+    """
+    if retry_after is not None:
+      return min(retry_after, self.max_delay)
+    return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+def is_retryable(error: BaseException) -> bool:
+  """错误是否可能是暂时的, 重试有机会成功"""
+  if isinstance(error, (Deadline_Exceeded, asyncio.TimeoutError, ConnectionError)):
+    return True
+  # 没有导入过 openai 时, 错误不可能来自 openai, 也不必为此导入
+  openai = sys.modules.get("openai")
+  if openai is None:
+    return False
+  if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+    return True
+  if isinstance(error, openai.APIStatusError):
+    return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+  return False
+
+def retry_after(error: BaseException) -> float:
+  """服务器在 Retry-After 中要求的等待时间(秒), 没有时返回 None"""
+  response = getattr(error, "response", None)
+  headers = getattr(response, "headers", None)
+  if not headers:
+    return None
+  try:
+    return max(0.0, float(headers.get("retry-after")))
+  except (TypeError, ValueError):
+    return None
+
+class Race:
+  """
+  同一个请求的多个副本(对冲请求)之间的竞争
+  第一个收到内容的副本胜出, 并取消其他副本, 只有胜出者的内容会输出
+  """
+  def __init__(self):
+    self.winner = None
+    self.winner_task = None
+    self.tasks = []
+    self.started = asyncio.Event() # 有副本收到了第一段内容或者已经结束
+
+  def claim(self, reply) -> bool:
+    """
+    收到第一段内容时调用
+    :return: 是否胜出, 未胜出的副本应该立即结束
+    """
+    if self.winner is None:
+      self.winner = reply
+      self.winner_task = asyncio.current_task()
+      self.started.set()
+      for task in self.tasks:
+        if task is not self.winner_task:
+          task.cancel()
+    return self.winner is reply
+
+def main():
+  policy = Retry_Policy(seed = 0)
+  print([round(policy.backoff(attempt), 3) for attempt in range(6)])
+
+if __name__ == "__main__":
+  main()
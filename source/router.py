@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# 模型选择
+# 每次请求前根据以下规则选择模型:
+#   1. 使用 --model 指定时直接使用指定的模型
+#   2. 根据服务器时间判断是否处于错峰优惠时段(见 config.OFF_PEAK_WINDOWS), 错峰时推理模型与对话模型价格相同
+#   3. 按模式和时段取出候选模型列表, 批量模式不在意首字延迟, 错峰时优先使用推理模型
+#   4. 根据 metrics.jsonl 中最近的请求记录, 跳过错误率过高或首字延迟明显变差的模型
+# 同时根据最近成功请求的首字延迟 p95 确定对冲请求的等待时间(见 resilience.py)
+# 候选模型都不可用时使用列表中的第一个
+
+import time
+from datetime import datetime, timedelta
+
+from config import MODEL, REASONER_MODEL, OFF_PEAK_WINDOWS, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY
+
+# 各模式的候选模型, 按优先顺序排列
+# 快速翻译、单词解释和同义词查询的回答较短, 交互使用时看重速度, 错峰时也优先使用对话模型
+# 句子解释、日语翻译和问答需要推理, 错峰时优先使用推理模型
+QUICK_MODES = ("fast_translate", "explain_word", "en_synonyms")
+PEAK_MODELS = [MODEL, REASONER_MODEL]
+OFF_PEAK_MODELS = [REASONER_MODEL, MODEL]
+MODE_PREFERENCES = {
+  mode: {"peak": [MODEL], "off_peak": [MODEL, REASONER_MODEL], "batch_off_peak": OFF_PEAK_MODELS}
+  for mode in QUICK_MODES
+}
+DEFAULT_PREFERENCE = {"peak": PEAK_MODELS, "off_peak": OFF_PEAK_MODELS, "batch_off_peak": OFF_PEAK_MODELS}
+
+# 统计最近多长时间(秒)内的请求, 判断模型当前是否变慢
+RECENT_WINDOW = 30 * 60
+# 样本数少于该值时不做判断
+MIN_SAMPLES = 3
+# 最近的错误率超过该值时跳过
+MAX_ERROR_RATE = 0.5
+# 最近的首字延迟中位数超过长期中位数的倍数时跳过
+DEGRADED_FACTOR = 2.0
+
+def parse_clock(text: str) -> int:
+  """HH:MM -> 当天的分钟数"""
+  hour, minute = text.split(":")
+  return int(hour) * 60 + int(minute)
+
+def in_windows(moment: datetime, windows = OFF_PEAK_WINDOWS) -> bool:
+  """
+  判断时间是否在某个时段内, 支持跨越午夜的时段, 如 ("22:00", "06:00")
+  :param moment: 服务器时区的时间
+  """
+  minutes = moment.hour * 60 + moment.minute
+  for start, end in windows:
+    start, end = parse_clock(start), parse_clock(end)
+    if (start <= minutes < end) if start <= end else (minutes >= start or minutes < end):
+      return True
+  return False
+
+def window_bounds(moment: datetime, windows = OFF_PEAK_WINDOWS) -> tuple:
+  """
+  :param moment: 服务器时区的时间
+  :return: moment 所在时段的 (开始时间, 结束时间), 不在任何时段内时返回 None
+  """
+  for start, end in windows:
+    start, end = parse_clock(start), parse_clock(end)
+    start_at = moment.replace(hour = start // 60, minute = start % 60, second = 0, microsecond = 0)
+    end_at = moment.replace(hour = end // 60, minute = end % 60, second = 0, microsecond = 0)
+    if end_at <= start_at: # 跨越午夜
+      if moment >= start_at:
+        end_at += timedelta(days = 1)
+      else:
+        start_at -= timedelta(days = 1)
+    if start_at <= moment < end_at:
+      return start_at, end_at
+  return None
+
+def next_window_start(moment: datetime, windows = OFF_PEAK_WINDOWS) -> datetime:
+  """
+  :param moment: 服务器时区的时间
+  :return: moment 之后最近的时段开始时间
+  """
+  starts = []
+  for start, _ in windows:
+    start = parse_clock(start)
+    start_at = moment.replace(hour = start // 60, minute = start % 60, second = 0, microsecond = 0)
+    starts.append(start_at if start_at > moment else start_at + timedelta(days = 1))
+  return min(starts)
+
+def candidate_models(mode: str) -> list:
+  """该模式可能使用的全部模型, 用于在不选择模型的情况下查询缓存"""
+  models = []
+  for choices in MODE_PREFERENCES.get(mode, DEFAULT_PREFERENCE).values():
+    models += [model for model in choices if model not in models]
+  return models
+
+def _median(values: list) -> float:
+  values = sorted(values)
+  return values[len(values) // 2] if values else None
+
+class Route:
+  """选择结果"""
+  def __init__(self, model: str, reason: str, hedge_after: float = None):
+    """
+    :param hedge_after: 超过该时间(秒)还没有收到第一段内容时发出对冲请求, None 表示不对冲
+    """
+    self.model = model
+    self.reason = reason
+    self.hedge_after = hedge_after
+
+  def __repr__(self) -> str:
+    return f"Route(model={self.model!r}, reason={self.reason!r}, hedge_after={self.hedge_after!r})"
+
+class Model_Router:
+  def __init__(self, metrics_store = None, windows = OFF_PEAK_WINDOWS, clock = None):
+    """
+    :param metrics_store: metrics.Metrics_Store, 读取最近的请求记录, 默认使用 data/metrics.jsonl
+    :param windows: 服务器时间的错峰时段
+    :param clock: 返回服务器时区当前时间的函数, 默认使用 log.SERVER_TIMEZONE
+    """
+    self.metrics_store = metrics_store
+    self.windows = windows
+    self.clock = clock
+    self._stats = None
+
+  def now(self) -> datetime:
+    if self.clock is not None:
+      return self.clock()
+    from log import SERVER_TIMEZONE
+    return datetime.now(SERVER_TIMEZONE)
+
+  def is_off_peak(self) -> bool:
+    return in_windows(self.now(), self.windows)
+
+  def stats(self) -> dict:
+    """
+    每个模型最近的请求统计, 同一个 Model_Router 只读取一次指标文件
+    :return: {模型: {"samples", "error_rate", "ttft_recent", "ttft_baseline", "ttft_p95", "ttft_samples"}}, 首字延迟单位为毫秒
+    """
+    if self._stats is not None:
+      return self._stats
+    if self.metrics_store is None:
+      from metrics import Metrics_Store
+      self.metrics_store = Metrics_Store()
+    since = time.time() - RECENT_WINDOW
+    grouped = {}
+    for record in self.metrics_store.recent():
+      grouped.setdefault(record.get("model"), []).append(record)
+    self._stats = {}
+    for model, records in grouped.items():
+      recent = [record for record in records if record.get("ts", 0) >= since]
+      ttfts = sorted(record["ttft"] for record in records if "ttft" in record and record.get("ok", True))
+      self._stats[model] = {
+        "ttft_p95": ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))] if ttfts else None,
+        "ttft_samples": len(ttfts),
+        "samples": len(recent),
+        "error_rate": sum(1 for record in recent if not record.get("ok", True)) / len(recent) if recent else 0.0,
+        "ttft_recent": _median([record["ttft"] for record in recent if "ttft" in record]),
+        "ttft_baseline": _median([record["ttft"] for record in records if "ttft" in record])
+      }
+    return self._stats
+
+  def degraded(self, model: str) -> str:
+    """
+    :return: 模型最近不可用的原因, 正常时返回 None
+    """
+    stats = self.stats().get(model)
+    if stats is None or stats["samples"] < MIN_SAMPLES:
+      return None
+    if stats["error_rate"] > MAX_ERROR_RATE:
+      return f"最近错误率 {stats['error_rate']:.0%}"
+    recent, baseline = stats["ttft_recent"], stats["ttft_baseline"]
+    if recent is not None and baseline and recent > baseline * DEGRADED_FACTOR:
+      return f"最近首字延迟 {recent:.0f}ms, 平时 {baseline:.0f}ms"
+    return None
+
+  def hedge_delay(self, model: str) -> float:
+    """
+    对冲请求的等待时间(秒): 该模型最近成功请求的首字延迟 p95, 样本太少时返回 None, 不对冲
+    """
+    stats = self.stats().get(model)
+    if stats is None or stats["ttft_samples"] < HEDGE_MIN_SAMPLES:
+      return None
+    return max(HEDGE_MIN_DELAY, stats["ttft_p95"] / 1000)
+
+  def choose(self, mode: str, override: str = None, batch: bool = False, hedge: bool = False) -> Route:
+    """
+    选择模型
+    :param mode: 模式名称, 如 explain_word
+    :param override: 命令行指定的模型
+    :param batch: 是否为批量模式
+    :param hedge: 是否计算对冲请求的等待时间, 只用于交互使用的单次请求
+    """
+    route = self._choose(mode, override, batch)
+    if hedge:
+      route.hedge_after = self.hedge_delay(route.model)
+    return route
+
+  def _choose(self, mode: str, override: str = None, batch: bool = False) -> Route:
+    if override:
+      return Route(override, "手动指定")
+    off_peak = self.is_off_peak()
+    preference = MODE_PREFERENCES.get(mode, DEFAULT_PREFERENCE)
+    models = preference["batch_off_peak" if batch else "off_peak"] if off_peak else preference["peak"]
+    period = "错峰时段" if off_peak else "高峰时段"
+    skipped = []
+    for model in models:
+      problem = self.degraded(model)
+      if problem is None:
+        reason = period if not skipped else f"{period}, 跳过 {'; '.join(skipped)}"
+        return Route(model, reason)
+      skipped.append(f"{model} ({problem})")
+    return Route(models[0], f"{period}, 候选模型都不理想: {'; '.join(skipped)}")
+
+def main():
+  router = Model_Router()
+  print(f"错峰时段: {router.is_off_peak()}")
+  for mode in ("fast_translate", "explain_sentence"):
+    print(mode, router.choose(mode), router.choose(mode, batch = True))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# 问答日志和生词本的全文搜索
+# 使用 SQLite FTS5 建立倒排索引, 写入日志和生词本时同步更新, 搜索时不需要扫描全部日志
+#
+# FTS5 自带的分词器按空白和标点切分, 无法处理中文和日文, 因此写入前先自行分词:
+#   英文等按单词切分并转为小写
+#   连续的中日韩文字切分为相邻两字组成的二元组, 并在末尾补上最后一个字, 如 苹果汁 -> 苹果 果汁 汁
+# 搜索时按同样的方式切分, 多个二元组组成短语查询, 相当于子串匹配
+#
+# 结果按相关度(bm25)和时间综合排序: 只在最近的若干条匹配记录中排序, 保证常见词的查询时间也有上限
+
+import os
+import re
+import time
+import sqlite3
+
+from config import DATA_DIR
+
+INDEX_FILE = os.path.join(DATA_DIR, "search.db")
+# 参与排序的最近匹配记录数
+CANDIDATES = 500
+# 时间衰减: 每过这么多天, 排序分数减半
+HALF_LIFE_DAYS = 30.0
+# 问题列和回答列的权重
+WEIGHTS = (2.0, 1.0)
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af" # 假名, 汉字, 谚文
+TOKEN_PATTERN = re.compile(rf"(?P<cjk>[{_CJK}]+)|(?P<word>[^\W_{_CJK}]+)")
+
+def tokenize(text: str) -> list:
+  """
+  切分文本
+  :return: 词元列表
+  """
+  tokens = []
+  for match in TOKEN_PATTERN.finditer(text):
+    run = match.group("cjk")
+    if run is None:
+      tokens.append(match.group("word").lower())
+      continue
+    tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.append(run[-1])
+  return tokens
+
+def build_query(terms: str) -> str:
+  """
+  把用户输入的搜索词转换为 FTS5 查询, 多个搜索词之间为"与"的关系
+  :return: FTS5 查询字符串, 没有可搜索的内容时返回空字符串
+  """
+  parts = []
+  for term in terms.split():
+    tokens = tokenize(term)
+    if not tokens:
+      continue
+    if len(tokens) == 1:
+      # 单个汉字作为前缀匹配, 可以匹配以它开头的二元组和末尾的单字
+      parts.append(f'"{tokens[0]}" *' if TOKEN_PATTERN.fullmatch(tokens[0]).group("cjk") else f'"{tokens[0]}"')
+      continue
+    if TOKEN_PATTERN.fullmatch(tokens[-1]).group("cjk") and len(tokens[-1]) == 1:
+      tokens.pop() # 搜索词末尾补上的单字在索引中与下一个二元组位置不同, 去掉后二元组相邻即可匹配
+    parts.append('"' + " ".join(tokens) + '"')
+  return " AND ".join(parts)
+
+class Search_Index:
+  def __init__(self, index_file: str = None):
+    """
+    :param index_file: 索引数据库路径, 默认为 ../data/search.db
+    """
+    self.index_file = index_file or INDEX_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok = True)
+    self.conn = sqlite3.connect(self.index_file, timeout = 10)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    with self.conn:
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS entries ("
+        "id INTEGER PRIMARY KEY, ts REAL, source TEXT, mode TEXT, time TEXT, question TEXT, answer TEXT)"
+      )
+      # 原文保存在 entries 中, 倒排索引不再重复保存一份
+      self.conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(question, answer, content = '')"
+      )
+      self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+  def close(self) -> None:
+    self.conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  @property
+  def is_built(self) -> bool:
+    """是否已经导入过已有的日志和生词本"""
+    return self.conn.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+  def add(self, records: list, source: str = "log") -> None:
+    """
+    加入多条记录
+    :param records: 字典列表, 包含 ts, mode, time, question, answer
+    :param source: 记录来源, log 或 word
+    """
+    with self.conn:
+      for record in records:
+        self._insert(record, source)
+
+  def add_words(self, word_records: list) -> None:
+    """加入生词本记录"""
+    self.add([word_entry(record) for record in word_records], "word")
+
+  def build(self, query_log, word_book) -> int:
+    """
+    第一次使用时导入已有的日志和生词本, 之后由写入日志和生词本的地方增量更新
+    :return: 导入的记录数
+    """
+    with self.conn:
+      # 在同一个事务中检查, 避免多个进程重复导入
+      self.conn.execute("BEGIN IMMEDIATE")
+      if self.is_built:
+        return 0
+      count = 0
+      for source, records in (("log", query_log.query()), ("word", map(word_entry, word_book.records()))):
+        for record in records:
+          self._insert(record, source)
+          count += 1
+      self.conn.execute("INSERT INTO meta (key, value) VALUES ('built', ?)", (str(time.time()),))
+    return count
+
+  def _insert(self, record: dict, source: str) -> None:
+    """写入原文和分词后的索引, 调用方负责事务"""
+    cursor = self.conn.execute(
+      "INSERT INTO entries (ts, source, mode, time, question, answer) VALUES (?, ?, ?, ?, ?, ?)",
+      (record["ts"], source, record.get("mode"), record.get("time"), record["question"], record["answer"])
+    )
+    self.conn.execute(
+      "INSERT INTO terms (rowid, question, answer) VALUES (?, ?, ?)",
+      (cursor.lastrowid, " ".join(tokenize(record["question"])), " ".join(tokenize(record["answer"])))
+    )
+
+  def search(self, terms: str, limit: int = 20, since: float = None, until: float = None, mode: str = None) -> list:
+    """
+    搜索记录
+    :param terms: 搜索词, 空格分隔
+    :return: 按相关度和时间排序的记录列表, 每条记录附带 score
+    """
+    query = build_query(terms)
+    if not query:
+      return []
+    sql = (
+      "SELECT e.ts, e.source, e.mode, e.time, e.question, e.answer, bm25(terms, ?, ?) "
+      "FROM terms JOIN entries e ON e.id = terms.rowid WHERE terms MATCH ?"
+    )
+    params = [*WEIGHTS, query]
+    if since is not None:
+      sql += " AND e.ts >= ?"
+      params.append(since)
+    if until is not None:
+      sql += " AND e.ts < ?"
+      params.append(until)
+    if mode is not None:
+      sql += " AND e.mode = ?"
+      params.append(mode)
+    sql += " ORDER BY terms.rowid DESC LIMIT ?"
+    params.append(CANDIDATES)
+
+    now = time.time()
+    results = []
+    for ts, source, mode, timestamp, question, answer, rank in self.conn.execute(sql, params):
+      age_days = max(now - ts, 0) / 86400
+      # bm25 越小越相关, 取相反数后乘以时间衰减系数
+      score = -rank * 0.5 ** (age_days / HALF_LIFE_DAYS)
+      results.append({
+        "ts": ts, "source": source, "mode": mode, "time": timestamp,
+        "question": question, "answer": answer, "score": score
+      })
+    results.sort(key = lambda result: (-result["score"], -result["ts"]))
+    return results[:limit]
+
+def word_entry(record: dict) -> dict:
+  """把生词本记录转换为索引记录"""
+  answer = "\n".join(str(record.get(field, "")) for field in ("closest_chinese", "slang_or_usage", "context", "example"))
+  try:
+    ts = time.mktime(time.strptime(str(record.get("time", ""))[:19], "%Y-%m-%d %H:%M:%S"))
+  except ValueError:
+    ts = 0.0
+  return {"ts": ts, "mode": "explain_word", "time": record.get("time"), "question": record.get("word", ""), "answer": answer}
+
+def update_index(records: list, source: str = "log", index_file: str = None) -> None:
+  """
+  写入日志或生词本之后更新索引, 索引出错不影响日志本身
+  还没有导入过已有记录时跳过, 第一次搜索时会统一导入
+  """
+  try:
+    with Search_Index(index_file) as index:
+      if not index.is_built:
+        return
+      if source == "word":
+        index.add_words(records)
+      else:
+        index.add(records, source)
+  except sqlite3.Error as e:
+    print(f"更新搜索索引失败: {e}")
+
+def main():
+  print("search主程序已运行!")
+
+if __name__ == "__main__":
+  main()
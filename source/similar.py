@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+# 相似问题的回答复用
+# 回答缓存只能命中完全相同的输入, "Running", "running " 或者只有标点、单复数不同的句子都会重新请求
+# 这里为以前的问答日志和生词本建立相似度索引, 没有命中回答缓存时, 找到足够相似的问题就直接使用它的回答
+#
+# 比较之前先规范化: 全角半角(NFKC)、大小写、空白统一, 去掉标点, 英文单词去掉复数词尾
+#   规范化之后相同        相似度为 1
+#   规范化之后有少量不同  按字符三元组集合的 Jaccard 相似度比较, 超过 config.FUZZY_THRESHOLD 时复用
+# 单词和词语(config.FUZZY_EXACT_MODES)相差一个字母就可能是另一个词(plan/plane), 只做保守的词形还原(runs/running -> run),
+# 还原之后完全相同才复用, 不比较相似度
+# 用 MinHash + LSH 找出候选: 每条记录计算 NUM_PERM 个最小哈希, 分成 BANDS 组, 任意一组完全相同即为候选,
+# 再对候选计算精确的 Jaccard 相似度; 查询只需要几次索引查找, 与记录总数无关
+#
+# 索引保存在 data/similar.db, 与搜索索引(search.py)一样在写入日志和生词本时增量更新, 第一次查询时导入已有记录
+# 只在同一模式内比较, 复用的回答会明确标注原问题和相似度
+
+import os
+import re
+import time
+import struct
+import sqlite3
+import hashlib
+import unicodedata
+
+from config import DATA_DIR, FUZZY_THRESHOLD, FUZZY_MODES, FUZZY_EXACT_MODES
+from utils import GREEN_DOT
+
+SIMILAR_FILE = os.path.join(DATA_DIR, "similar.db")
+# 规范化规则或表结构改变时增加, 旧的索引会被清空, 第一次查询时按新规则重新导入
+INDEX_VERSION = "4"
+# 最小哈希的个数, 以及分组数(每组 NUM_PERM // BANDS 个)
+# 相似度 0.85 的两条记录成为候选的概率约为 99.7%, 相似度 0.5 的约为 40%, 候选最终都会精确比较
+NUM_PERM = 32
+BANDS = 8
+# 每次查询最多精确比较的候选数
+MAX_CANDIDATES = 50
+# 失败的请求在日志中记录的回答, 不参与复用
+FAILED_ANSWERS = frozenset(("请求失败", "未知错误", "程序发生错误"))
+
+_UNPACK = struct.Struct(f"<{NUM_PERM}I").unpack
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+# 去掉词尾 s 时不应该处理的单词
+S_EXCEPTIONS = frozenset(("news", "series", "species", "always", "perhaps", "physics", "mathematics", "politics", "this", "his", "its", "was", "has", "does", "is", "us", "yes"))
+# 去掉 -s/-ed/-ing 之后是另一个意思不同的单词, 单词复用时不做词形还原
+LEMMA_EXCEPTIONS = S_EXCEPTIONS | frozenset((
+  "evening", "morning", "wedding", "ceiling", "during", "nothing", "something", "anything", "everything", "pudding",
+  "wicked", "crooked", "naked", "sacred", "united", "learned", "aged", "beloved", "blessed", "dogged", "ragged",
+  "glasses", "pants", "arms", "goods", "manners", "customs", "spirits", "means", "lines", "letters", "minutes", "quarters"
+))
+
+def stem(word: str) -> str:
+  """
+  保守的英文词干提取, 只去掉规则的复数词尾 s/es: cats -> cat, boxes -> box, studies -> study
+  不处理 -ing/-ed 和词尾的 e/y, 这些规则会把不同的单词变成同一个(evening/even, wedding/wed, plane/plan, unite/unit)
+  非英文内容原样返回
+  """
+  if not word.isascii() or not word.isalpha() or len(word) <= 3 or word in S_EXCEPTIONS:
+    return word
+  if word.endswith("ies") and len(word) > 4:
+    return word[:-3] + "y"
+  if word.endswith(("sses", "shes", "ches", "xes", "zzes")):
+    return word[:-2]
+  if word.endswith("s") and not word.endswith(("ss", "us", "is", "ous")):
+    return word[:-1]
+  return word
+
+def _measure(stem: str) -> int:
+  """词干中"元音-辅音"组合的个数(Porter 的 m 值), plan -> 1, visit -> 2"""
+  pattern = "".join("v" if char in "aeiou" or (char == "y" and i > 0 and stem[i - 1] not in "aeiou") else "c"
+                    for i, char in enumerate(stem))
+  return pattern.count("vc")
+
+def _restore(stem: str) -> str:
+  """去掉 -ing/-ed 之后还原词干: running -> run(去掉重复的辅音), making -> make(短词干补回 e)"""
+  if len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in "aeioulsz":
+    return stem[:-1]
+  if _measure(stem) == 1 and len(stem) >= 3 and stem[-1] not in "aeiouwxy" and stem[-2] in "aeiou" and stem[-3] not in "aeiou":
+    return stem + "e"
+  return stem
+
+def lemma(word: str) -> str:
+  """
+  单词的词形还原, 用于单词和词语的复用: runs, running -> run, studied -> study, 不处理不规则变化(ran)
+  只去掉 -s/-es/-ed/-ing 词尾, 不去掉词尾的 e, 所以 plane/plan, hope/hop 仍然不同;
+  去掉词尾之后会变成另一个词的单词(evening/even, wicked/wick, united/unit)列在 LEMMA_EXCEPTIONS 中, 原样返回
+  """
+  if not word.isascii() or not word.isalpha() or len(word) <= 3 or word in LEMMA_EXCEPTIONS:
+    return word
+  if word.endswith("ied") and len(word) > 4:
+    return word[:-3] + "y"
+  for suffix in ("ing", "ed"):
+    base = word[:-len(suffix)]
+    # 去掉词尾之后至少三个字母且包含元音: bring, thing, need, feed 保持不变
+    if word.endswith(suffix) and len(base) >= 3 and any(char in "aeiouy" for char in base) and not word.endswith("eed"):
+      return _restore(base)
+  return stem(word)
+
+def surface(text: str) -> str:
+  """只统一全角半角、大小写、标点和空白, 不提取词干"""
+  # 撇号和其他标点一样作为分隔, 不能直接去掉: we're/were, he'll/hell, it's/its 是不同的词
+  text = unicodedata.normalize("NFKC", text).casefold()
+  return " ".join(TOKEN_PATTERN.findall(text))
+
+def normalize(text: str) -> str:
+  """规范化: 在 surface 的基础上, 英文单词去掉复数词尾"""
+  return " ".join(stem(token) for token in surface(text).split(" ") if token)
+
+def word_key(text: str) -> str:
+  """单词和词语(config.FUZZY_EXACT_MODES)的规范化: 在 surface 的基础上做词形还原"""
+  return " ".join(lemma(token) for token in surface(text).split(" ") if token)
+
+def key_for(mode: str, text: str) -> str:
+  return word_key(text) if mode in FUZZY_EXACT_MODES else normalize(text)
+
+def shingles(key: str) -> set:
+  """规范化文本的字符三元组集合, 不足三个字符时为文本本身"""
+  if len(key) < 3:
+    return {key}
+  return {key[i:i + 3] for i in range(len(key) - 2)}
+
+def jaccard(a: set, b: set) -> float:
+  if not a and not b:
+    return 1.0
+  return len(a & b) / len(a | b)
+
+def minhash(grams: set) -> list:
+  """
+  每个哈希函数下的最小值
+  用 SHAKE-128 为每个三元组一次生成 NUM_PERM 个 32 位哈希值, 代替逐个计算排列, 在不同进程中结果相同
+  """
+  return list(map(min, zip(*(_UNPACK(hashlib.shake_128(gram.encode("utf-8")).digest(NUM_PERM * 4)) for gram in grams))))
+
+def band_keys(mode: str, signature: list) -> list:
+  """把最小哈希分组, 每组(连同模式)哈希成一个 64 位整数, 作为 LSH 的桶"""
+  rows = NUM_PERM // BANDS
+  keys = []
+  for band in range(BANDS):
+    payload = f"{mode}|{band}|" + ",".join(map(str, signature[band * rows:(band + 1) * rows]))
+    keys.append(int.from_bytes(hashlib.blake2b(payload.encode("utf-8"), digest_size = 8).digest(), "big", signed = True))
+  return keys
+
+def word_answer(record: dict) -> str:
+  """把生词本记录还原为单词解释的回答格式"""
+  return (f"最接近的中文解释: {record.get('closest_chinese', '')}\n"
+          f"作为俚语或日常用法: {record.get('slang_or_usage', '')}\n"
+          f"常用语境: {record.get('context', '')}\n"
+          f"造句: {record.get('example', '')}")
+
+def word_entry(record: dict) -> dict:
+  """把生词本记录转换为索引记录"""
+  from search import word_entry as search_entry
+  return dict(search_entry(record), answer = word_answer(record))
+
+class Similar_Index:
+  def __init__(self, index_file: str = None, threshold: float = FUZZY_THRESHOLD, modes = FUZZY_MODES):
+    """
+    :param index_file: 索引数据库路径, 默认为 ../data/similar.db
+    :param threshold: 复用回答需要的最低相似度
+    :param modes: 参与复用的模式名称
+    """
+    self.index_file = index_file or SIMILAR_FILE
+    self.threshold = threshold
+    self.modes = modes
+    os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok = True)
+    self.conn = sqlite3.connect(self.index_file, timeout = 10)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    with self.conn:
+      self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+      version = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+      if version is None or version[0] != INDEX_VERSION:
+        # 按旧规则计算的规范化结果不能再用, 清空后重新导入
+        self.conn.execute("DROP TABLE IF EXISTS entries")
+        self.conn.execute("DROP TABLE IF EXISTS bands")
+        self.conn.execute("DELETE FROM meta")
+        self.conn.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (INDEX_VERSION,))
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS entries ("
+        "id INTEGER PRIMARY KEY, ts REAL, mode TEXT, key TEXT, time TEXT, question TEXT, answer TEXT)"
+      )
+      self.conn.execute("CREATE INDEX IF NOT EXISTS entries_key ON entries (mode, key)")
+      self.conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, entry INTEGER)")
+      self.conn.execute("CREATE INDEX IF NOT EXISTS bands_band ON bands (band)")
+
+  def close(self) -> None:
+    self.conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  @property
+  def is_built(self) -> bool:
+    """是否已经导入过已有的日志和生词本"""
+    return self.conn.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+  def add(self, records: list) -> int:
+    """
+    加入多条记录, 不参与复用的模式和失败的请求跳过
+    :param records: 字典列表, 包含 ts, mode, time, question, answer
+    :return: 加入的条数
+    """
+    with self.conn:
+      return sum(self._insert(record) for record in records)
+
+  def build(self, query_log, word_book) -> int:
+    """
+    第一次使用时导入已有的日志和生词本, 之后由写入日志和生词本的地方增量更新
+    :return: 导入的记录数
+    """
+    with self.conn:
+      # 在同一个事务中检查, 避免多个进程重复导入
+      self.conn.execute("BEGIN IMMEDIATE")
+      if self.is_built:
+        return 0
+      count = 0
+      for records in (query_log.query(), map(word_entry, word_book.records())):
+        count += sum(self._insert(record) for record in records)
+      self.conn.execute("INSERT INTO meta (key, value) VALUES ('built', ?)", (str(time.time()),))
+    return count
+
+  def _insert(self, record: dict) -> int:
+    """写入一条记录和它的 LSH 桶, 调用方负责事务"""
+    mode, question, answer = record.get("mode"), record.get("question") or "", record.get("answer") or ""
+    if mode not in self.modes or not answer.strip() or answer in FAILED_ANSWERS:
+      return 0
+    key = key_for(mode, question)
+    if not key:
+      return 0
+    cursor = self.conn.execute(
+      "INSERT INTO entries (ts, mode, key, time, question, answer) VALUES (?, ?, ?, ?, ?, ?)",
+      (record.get("ts", 0.0), mode, key, record.get("time"), question, answer)
+    )
+    if mode in FUZZY_EXACT_MODES:
+      return 1
+    self.conn.executemany(
+      "INSERT INTO bands (band, entry) VALUES (?, ?)",
+      [(band, cursor.lastrowid) for band in band_keys(mode, minhash(shingles(key)))]
+    )
+    return 1
+
+  def find(self, mode: str, question: str) -> dict:
+    """
+    查找同一模式下最相似的问题
+    :return: 相似度达到阈值的记录, 附带 similarity; 没有时返回 None
+    """
+    if mode not in self.modes:
+      return None
+    key = key_for(mode, question)
+    if not key:
+      return None
+    # 规范化之后完全相同, 使用最近的一条
+    row = self.conn.execute(
+      "SELECT ts, time, question, answer FROM entries WHERE mode = ? AND key = ? ORDER BY id DESC LIMIT 1", (mode, key)
+    ).fetchone()
+    if row is not None:
+      return {"ts": row[0], "time": row[1], "question": row[2], "answer": row[3], "similarity": 1.0}
+    # 单词和词语相差一个字母就可能是另一个词, 不比较相似度
+    if mode in FUZZY_EXACT_MODES:
+      return None
+    grams = shingles(key)
+    bands = band_keys(mode, minhash(grams))
+    rows = self.conn.execute(
+      f"SELECT DISTINCT e.id, e.ts, e.time, e.key, e.question, e.answer FROM bands b JOIN entries e ON e.id = b.entry "
+      f"WHERE b.band IN ({', '.join('?' * len(bands))}) ORDER BY e.id DESC LIMIT ?",
+      (*bands, MAX_CANDIDATES)
+    ).fetchall()
+    best = None
+    for _, ts, timestamp, candidate, question, answer in rows:
+      similarity = jaccard(grams, shingles(candidate))
+      if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+        best = {"ts": ts, "time": timestamp, "question": question, "answer": answer, "similarity": similarity}
+    return best
+
+def find_similar(mode: str, question: str, index_file: str = None) -> dict:
+  """
+  没有命中回答缓存时查找相似的问题, 还没有导入过已有记录时先导入
+  :return: 见 Similar_Index.find
+  """
+  if mode not in FUZZY_MODES:
+    return None
+  with Similar_Index(index_file) as index:
+    if not index.is_built:
+      from query_log import Query_Log
+      from word_book import Word_Book
+      from log import default_path
+      print("第一次查找相似问题, 正在为已有的日志和生词本建立索引...")
+      count = index.build(Query_Log(), Word_Book(default_path("word_data.json")))
+      print(f"已建立索引, 共 {count} 条记录")
+    return index.find(mode, question)
+
+def show_reused(match: dict) -> None:
+  """输出复用的回答, 并注明原问题和相似度"""
+  similarity = "规范化后相同" if match["similarity"] >= 1.0 else f"相似度 {match['similarity']:.0%}"
+  print(f"{GREEN_DOT} 复用相似问题的回答 (原问题: {match['question']!r}, {similarity}, 时间: {match['time']})")
+  print("  这不是针对本次输入的新回答, 需要重新请求时使用 --no-fuzzy")
+  print(match["answer"])
+  print(f"\n使用的token数: 0 || 总字符数: {len(match['answer'])}")
+
+def update_similar(records: list, source: str = "log", index_file: str = None) -> None:
+  """
+  写入日志或生词本之后更新索引, 索引出错不影响日志本身
+  还没有导入过已有记录时跳过, 第一次查询时会统一导入
+  """
+  try:
+    with Similar_Index(index_file) as index:
+      if not index.is_built:
+        return
+      index.add([word_entry(record) for record in records] if source == "word" else records)
+  except sqlite3.Error as e:
+    print(f"更新相似问题索引失败: {e}")
+
+def main():
+  for word in ("Running", "running ", "runs", "studied", "making", "hoping", "hopping", "plane", "evening", "united", "we're"):
+    print(f"{word!r} -> {word_key(word)!r}")
+
+if __name__ == "__main__":
+  main()
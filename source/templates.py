@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# 提示词模板
+# 内置模板来自 prompts.py, 用户模板保存在 data/templates/<名称>.txt 中, 不需要修改代码:
+#   与内置模式同名的文件(如 explain_word.txt)覆盖内置模板
+#   其他名称作为新的模式, 使用 ds --template <名称> 调用
+#
+# 模板必须是"固定前缀 + 输入内容"的结构: {text} 只能出现一次, 并且之后只能有空白
+# DeepSeek 会缓存请求之间相同的提示词前缀, 命中的部分计费更低, 首字延迟也更短
+# 输入内容放在中间或开头时, 每次请求的前缀都不同, 无法命中缓存
+#
+# 用户模板目录中文件的修改时间和大小没有变化时, 直接使用已经编译好的模板, 不重新读取文件
+
+import os
+import hashlib
+
+from config import DATA_DIR
+from prompts import Translator, User_prompt
+
+TEMPLATE_DIR = os.path.join(DATA_DIR, "templates")
+PLACEHOLDER = "{text}"
+TEMPLATE_SUFFIX = ".txt"
+
+class Template_Error(ValueError):
+  """模板不符合"固定前缀 + 输入内容"的结构"""
+
+class Template:
+  def __init__(self, name: str, text: str, source: str = "builtin", path: str = None, prompt_type = None):
+    """
+    :param name: 模板名称, 同时作为日志和指标中的模式名称
+    :param text: 模板内容, 用 {text} 表示输入内容, 其他花括号原样保留
+    :param source: builtin 或 user
+    :param path: 用户模板的文件路径
+    :param prompt_type: 对应的内置提示词类型, 用户自定义的新模式为 None
+    """
+    count = text.count(PLACEHOLDER)
+    if count != 1:
+      raise Template_Error(f"模板 {name} 中 {PLACEHOLDER} 应该出现 1 次, 实际出现 {count} 次")
+    prefix, suffix = text.split(PLACEHOLDER)
+    if suffix.strip():
+      raise Template_Error(f"模板 {name} 中 {PLACEHOLDER} 之后还有内容, 请把要求放在输入内容之前: {suffix.strip()[:30]!r}")
+    if not prefix.strip():
+      raise Template_Error(f"模板 {name} 没有固定前缀")
+    self.name = name
+    self.prefix = prefix
+    self.suffix = suffix
+    self.source = source
+    self.path = path
+    self.prompt_type = prompt_type
+    self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+  def render(self, input_text: str) -> str:
+    """生成完整的提示词"""
+    return self.prefix + input_text + self.suffix
+
+  def __str__(self) -> str:
+    """
+    作为缓存键的一部分: 未被覆盖的内置模板与提示词类型相同, 保持已有缓存可用
+    用户模板附带内容摘要, 修改模板后不会命中旧的回答
+    """
+    if self.source == "builtin":
+      return str(self.prompt_type)
+    return f"Template.{self.name}@{self.digest}"
+
+  def __repr__(self) -> str:
+    return f"Template(name={self.name!r}, source={self.source!r})"
+
+def builtin_templates() -> dict:
+  """prompts.py 中的内置模板"""
+  return {
+    prompt_type.name: Template(prompt_type.name, prompt_type.value, prompt_type = prompt_type)
+    for prompt_type in (*Translator, *User_prompt)
+  }
+
+class Template_Registry:
+  def __init__(self, template_dir: str = None):
+    """
+    :param template_dir: 用户模板目录, 默认为 ../data/templates
+    """
+    self.template_dir = template_dir or TEMPLATE_DIR
+    self.errors = {} # 文件名 -> 无法使用的原因
+    self._builtin = builtin_templates()
+    self._signature = None
+    self._templates = None
+
+  def _scan(self) -> tuple:
+    """用户模板文件的 (文件名, 修改时间, 大小), 目录不存在时为空"""
+    try:
+      entries = [entry for entry in os.scandir(self.template_dir)
+                 if entry.name.endswith(TEMPLATE_SUFFIX) and entry.is_file()]
+    except OSError:
+      return ()
+    return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries))
+
+  def templates(self) -> dict:
+    """
+    全部可用的模板, 文件没有变化时返回上一次的结果
+    :return: {名称: Template}
+    """
+    signature = self._scan()
+    if self._templates is not None and signature == self._signature:
+      return self._templates
+    templates = dict(self._builtin)
+    errors = {}
+    for file_name, _, _ in signature:
+      name = file_name[:-len(TEMPLATE_SUFFIX)]
+      path = os.path.join(self.template_dir, file_name)
+      builtin = self._builtin.get(name)
+      try:
+        with open(path, "r", encoding = "utf-8") as file:
+          text = file.read()
+        templates[name] = Template(name, text, "user", path, builtin.prompt_type if builtin else None)
+      except (OSError, UnicodeDecodeError, Template_Error) as e:
+        errors[file_name] = str(e)
+    self._signature, self._templates, self.errors = signature, templates, errors
+    return templates
+
+  def get(self, prompt_type) -> Template:
+    """
+    :param prompt_type: 提示词类型, 模板名称或者 Template
+    """
+    if isinstance(prompt_type, Template):
+      return prompt_type
+    name = getattr(prompt_type, "name", prompt_type)
+    template = self.templates().get(name)
+    if template is None:
+      raise KeyError(f"没有名为 {name} 的模板")
+    return template
+
+  def render(self, prompt_type, input_text: str) -> str:
+    return self.get(prompt_type).render(input_text)
+
+_registry = None
+
+def get_registry() -> Template_Registry:
+  """进程内共用的模板注册表"""
+  global _registry
+  if _registry is None:
+    _registry = Template_Registry()
+  return _registry
+
+def render_prompt(prompt_type, input_text: str) -> str:
+  """根据提示词类型(或用户模板)和输入内容生成完整的提示词"""
+  return get_registry().render(prompt_type, input_text)
+
+def template_key(prompt_type) -> str:
+  """提示词类型在缓存键中的表示, 见 Template.__str__"""
+  try:
+    return str(get_registry().get(prompt_type))
+  except KeyError:
+    return str(prompt_type)
+
+def format_templates(registry: Template_Registry) -> str:
+  """列出全部模板, 以及固定前缀的长度"""
+  lines = []
+  for name, template in sorted(registry.templates().items()):
+    origin = "内置" if template.source == "builtin" else ("用户 (覆盖内置)" if template.prompt_type else "用户")
+    lines.append(f"{name:<20}固定前缀 {len(template.prefix):>4} 字  {origin}")
+  for file_name, error in registry.errors.items():
+    lines.append(f"{file_name:<20}已忽略: {error}")
+  lines.append(f"用户模板目录: {registry.template_dir}")
+  return "\n".join(lines)
+
+def main():
+  print("templates主程序已运行!")
+
+if __name__ == "__main__":
+  main()
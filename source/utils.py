@@ -1,13 +1,20 @@
 import itertools
+import functools
+import types
 import time
-import threading
 import os
 import json
 import shutil
 import tempfile
 import sys
+from contextlib import contextmanager
 from enum import Enum
 
+try:
+  import fcntl
+except ImportError: # Windows 下没有 fcntl, 退化为不加锁
+  fcntl = None
+
 ORANGE_DOT = "\033[38;2;245;148;37m●\033[0m"
 GREEN_DOT =  "\033[38;2;37;245;58m●\033[0m"
 RED_DOT = "\033[38;2;242;12;12m●\033[0m"
@@ -31,19 +38,6 @@ class RequestStatus(Enum):
   completed = f"{GREEN_DOT} 请求完毕"
   failed = f"{RED_DOT} 请求失败"
 
-animation_event = threading.Event()
-request_done = threading.Event()
-print_lock = threading.Lock()
-"""
-对于动画线程有新的问题:
-1. 发起请求时显示 "正在请求" 的加载动画
-2. 当请求完成时，即主线程的 answer (非流式传输)变量被赋值时，加载动画线程应该停止
-并且立即显示 "请求完毕" 的提示 
-但是在主进程中，加载动画线程的状态是无法被直接访问的
-【这是否意味着需要想办法先阻塞主进程代码的运行】
-3. 对于流式传输，answer 变量一旦有了值，动画应该改变为 "正在流式传输" 的状态
-"""
-
 # def clear_block(start_row: int, height: int):
 #   """
 #   清空指定区域的内容
@@ -62,79 +56,129 @@ print_lock = threading.Lock()
 #     sys.stdout.write(f"\033[{start_row + offset};1H" + line.ljust(width) + "\n") # 宽度不足补空格
 #   sys.stdout.flush()
 
-def loading_animation(animation_type: Enum = Animation.spin, 
-                      isStream: bool = False) -> None:
+def separator() -> str:
+  """与终端等宽的分隔线, 输出被重定向时使用默认宽度"""
+  return "-" * shutil.get_terminal_size().columns
+
+async def loading_animation(ready,
+                            animation_type: Enum = Animation.spin,
+                            isStream: bool = False) -> None:
   """
-  动态加载动画，支持状态切换
-  现在加载动画不会再吞掉流式输出
+  动态加载动画, 直到 ready 被设置
+  流式传输时 ready 表示收到了第一段内容, 非流式传输时表示请求完成
+  动画和输出运行在同一个事件循环中, 不需要锁, 也不会再吞掉流式输出
   """
+  import asyncio # 只有发起请求时才需要, 不在模块顶部导入以加快启动
   frames, frame_rate = animation_type.value
-  print(f"{RequestStatus.start.value}", end = '', flush = True) #  打印初始状态
   for frame in itertools.cycle(frames):
-    if request_done.is_set():
-      with print_lock:
-        print(f"{CLEAN_SEQ}{RequestStatus.completed.value}", flush = True)
+    print(f"{CLEAN_SEQ}{RequestStatus.start.value} {frame}", end = '', flush = True)
+    try:
+      await asyncio.wait_for(ready.wait(), frame_rate)
       break
-    if animation_event.is_set():
-      with print_lock:
-        print(f"{CLEAN_SEQ}{RequestStatus.in_progress.value}...", flush = True)
-        print(f"-" * os.get_terminal_size().columns, flush = True)
-      break
-    with print_lock:
-      print(f"{CLEAN_SEQ}{RequestStatus.start.value} {frame}", end = '', flush = True)
-    time.sleep(frame_rate)
-  
-  request_done.wait() # 阻塞直到请求完成
+    except asyncio.TimeoutError:
+      continue
   if isStream:
-    print(f"-" * os.get_terminal_size().columns, flush = True)
-    print(f"{RequestStatus.completed.value}", flush = True)
+    print(f"{CLEAN_SEQ}{RequestStatus.in_progress.value}...", flush = True)
+    print(separator(), flush = True)
   else:
-    print(f"{MOVE_CURSOR}{RequestStatus.completed.value}", flush = True)
-  
-  # while True:
-  #   if request_done.is_set():
-  #     print(f"{MOVE_CURSOR}{CLEAN_SEQ}{RequestStatus.completed.value}", flush = True)
-  #     break
+    print(f"{CLEAN_SEQ}{RequestStatus.completed.value}", flush = True)
+
+def process_uptime() -> float:
+  """
+  进程从 exec 到现在经过的时间(秒), 包括解释器自身的启动时间
+  只支持 Linux, 精度为一个时钟周期(通常为 10 毫秒), 其他系统返回 None
+  """
+  try:
+    with open("/proc/self/stat", "r") as file:
+      # 第二个字段是可能包含空格的进程名, 从最后一个括号之后开始数
+      fields = file.read().rsplit(")", 1)[1].split()
+    with open("/proc/uptime", "r") as file:
+      uptime = float(file.read().split()[0])
+    return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+  except (OSError, ValueError, IndexError, AttributeError):
+    return None
+
+class Startup_Timer:
+  """
+  统计启动耗时: 解释器启动和模块导入, 以及从进程启动到发出请求
+  应该在入口文件中尽早创建
+  """
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.exec_offset = process_uptime()
+
+  def since_exec(self, moment: float) -> float:
+    """从进程启动到 moment (time.perf_counter) 经过的时间(秒)"""
+    return moment - self.start + (self.exec_offset or 0.0)
+
+  def report(self, sent_at: float) -> str:
+    """
+    :param sent_at: 请求发出的时间 (time.perf_counter)
+    :return: 启动耗时报告
+    """
+    if self.exec_offset is None:
+      return f"启动耗时: 入口到发出请求 {(sent_at - self.start) * 1000:.0f}毫秒 (无法获取解释器启动时间)"
+    return (f"启动耗时: 解释器启动及导入 {self.exec_offset * 1000:.0f}毫秒 || "
+            f"进程启动到发出请求 {self.since_exec(sent_at) * 1000:.0f}毫秒")
 
 def measure_time(func):
   """
-  计时器装饰器
+  计时器装饰器, 同时支持普通函数和协程函数
   :param func: 被装饰的函数
   """
+  @functools.wraps(func)
   def wrapper(*args, **kwargs):
     start_time = time.time()
     result = func(*args, **kwargs)
+    # 协程函数返回的是协程对象, 需要在协程执行完之后再计时
+    # 这里不用 inspect.iscoroutinefunction 判断, 导入 inspect 会明显拖慢启动
+    if isinstance(result, types.CoroutineType):
+      async def timed():
+        try:
+          return await result
+        finally:
+          print(f"\r总耗时: {time.time() - start_time:.2f}秒")
+      return timed()
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"\r总耗时: {elapsed_time:.2f}秒")
     return result
   return wrapper
 
-def append_dict_to_json(path: str, record: dict) -> None:
+def estimate_tokens(text: str) -> int:
   """
-  讲一个字典 record 追加到 path 制定的 JSON 文件中的数组里
-  如果文件不存在，则创建文件并写入包含 record 的数组
+  在本地估算 token 数, 不需要导入分词器
+  按 DeepSeek 文档中的换算比例: 1 个英文字符约 0.3 个 token, 1 个中文字符约 0.6 个 token
+  """
+  ascii_chars = sum(1 for char in text if ord(char) < 0x80)
+  return int(ascii_chars * 0.3 + (len(text) - ascii_chars) * 0.6) + 1
+
+def read_json_array(path: str) -> list:
+  """
+  读取 path 指定的 JSON 数组文件
+  如果文件不存在则返回空列表; 内容非法时备份原文件后当作空列表处理
   """
   # 检查文件是否存在
-  if os.path.exists(path):
-    # 文件存在: 读取现有数据
-    with open(path, "r", encoding = 'utf-8') as file:
-      try:
-        data = json.load(file) # 反序列化为 Python 对象
-        if not isinstance(data, list):
-          raise ValueError(f"预期 JSON 文件内容是数组，但得到 {type(data)}")
-      except (json.JSONDecodeError, ValueError):
-        # 当文件为空、格式错误或类型不匹配时，备份原文件后当作空列表处理
-        backup_path = path + ".bak"
-        shutil.copy(path, backup_path)
-        print(f"⚠️ 原文件内容非法，已备份到 {backup_path}，将以空数组继续操作")
-        data = []
-  else:
-    # 文件不存在: 初始化空列表
-    data = []
-  # 将新的字典追加到列表
-  data.append(record)
-  # 原子写入: 先写入临时文件，再替换
+  if not os.path.exists(path):
+    return []
+  # 文件存在: 读取现有数据
+  with open(path, "r", encoding = 'utf-8') as file:
+    try:
+      data = json.load(file) # 反序列化为 Python 对象
+      if not isinstance(data, list):
+        raise ValueError(f"预期 JSON 文件内容是数组，但得到 {type(data)}")
+    except (json.JSONDecodeError, ValueError):
+      # 当文件为空、格式错误或类型不匹配时，备份原文件后当作空列表处理
+      backup_path = path + ".bak"
+      shutil.copy(path, backup_path)
+      print(f"⚠️ 原文件内容非法，已备份到 {backup_path}，将以空数组继续操作")
+      data = []
+  return data
+
+def write_json_atomic(path: str, data) -> None:
+  """
+  原子写入 JSON 文件: 先写入临时文件，再替换
+  """
   dir_name = os.path.dirname(path) or "."
   fd, tmp_path = tempfile.mkstemp(dir = dir_name, prefix = ".tmp_", suffix = ".json")
   try:
@@ -148,21 +192,58 @@ def append_dict_to_json(path: str, record: dict) -> None:
     # 若写入或替换发生异常，删除临时文件以免残留
     os.remove(tmp_path)
     raise
-  else:
-    print(f"✅ 已安全将记录追加并写入 {path}")
 
-def typewriter(text: str, delay: float = 0.02, end = "\n") -> None:
+def append_dict_to_json(path: str, record: dict) -> None:
+  """
+  讲一个字典 record 追加到 path 制定的 JSON 文件中的数组里
+  如果文件不存在，则创建文件并写入包含 record 的数组
+  注意每次调用都会重写整个文件, 频繁追加请使用 word_book.Word_Book
+  """
+  data = read_json_array(path)
+  # 将新的字典追加到列表
+  data.append(record)
+  write_json_atomic(path, data)
+  print(f"✅ 已安全将记录追加并写入 {path}")
+
+class Rate_Limiter:
+  """
+  限制每秒请求数, 同一个事件循环中的多个任务共享同一个实例
+  """
+  def __init__(self, rate: float):
+    """
+    :param rate: 每秒允许的请求数, 小于等于 0 表示不限制
+    """
+    self.interval = 1 / rate if rate > 0 else 0
+    self.next_time = time.monotonic()
+
+  async def acquire(self) -> None:
+    """等待直到允许发出下一个请求"""
+    if not self.interval:
+      return
+    import asyncio
+    now = time.monotonic()
+    wait = self.next_time - now
+    self.next_time = max(now, self.next_time) + self.interval
+    if wait > 0:
+      await asyncio.sleep(wait)
+
+@contextmanager
+def file_lock(path: str):
   """
-  逐字打印给定文本
-  :param text: 待打印的字符串
-  :param delay: 每个字符之间的延迟（秒），默认 0.02 秒，这个速度和大模型的输出速度差不多
+  对 path 加建议性文件锁(排他锁), 用于多个 ds 进程同时写同一份数据
+  :param path: 锁文件路径, 不存在时自动创建
   """
-  for char in text:
-    sys.stdout.write(char)
-    sys.stdout.flush()
-    time.sleep(delay)
-  sys.stdout.write(end)
-  sys.stdout.flush()
+  dir_name = os.path.dirname(path)
+  if dir_name:
+    os.makedirs(dir_name, exist_ok = True)
+  with open(path, "a") as lock_file:
+    if fcntl is not None:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
 def main():
   print("utils.py程序已执行")
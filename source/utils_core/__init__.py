@@ -1,56 +1,127 @@
 import os
 import json
+import sqlite3
+from contextlib import contextmanager
+
+# SQLite 数据库文件的文件头
+SQLITE_HEADER = b"SQLite format 3\x00"
 
 class History_Record:
+  """
+  键值形式的历史记录, 底层使用 SQLite 存储
+  键为主键索引, 单条记录的增删改查不需要读写整个文件
+  """
   def __init__ (self, file_path: str):
     self.file_path = file_path
-    if not os.path.exists(file_path):
-      with open(self.file_path, "w", encoding = "utf-8") as file:
-        json.dump({}, file)
-  
-  def _read_file(self) -> dict:
-    """读取 JSON 文件内容并返回为字典"""
+    self._in_transaction = False
+    legacy = self._read_legacy_json()
+    self._conn = sqlite3.connect(self.file_path, isolation_level = None, check_same_thread = False)
+    self._conn.execute("PRAGMA journal_mode = WAL")
+    self._conn.execute("PRAGMA synchronous = NORMAL")
+    self._conn.execute("CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    if legacy:
+      self.add_records(legacy)
+
+  def _read_legacy_json(self) -> dict:
+    """
+    兼容旧版本的 JSON 文件: 读取原有内容并备份, 之后在同一路径创建数据库
+    """
+    if not os.path.exists(self.file_path):
+      return None
+    with open(self.file_path, "rb") as file:
+      header = file.read(len(SQLITE_HEADER))
+    if header == SQLITE_HEADER or header == b"":
+      return None
     with open(self.file_path, "r", encoding = "utf-8") as file:
-      return json.load(file)
-  
-  def _write_file(self, data: dict) -> None:
-    """将字典写入 JSON 文件"""
-    with open(self.file_path, "w", encoding = "utf-8") as file:
-      json.dump(data, file, intent = 4)
-  
+      data = json.load(file)
+    os.replace(self.file_path, self.file_path + ".json.bak")
+    return data
+
+  def close(self) -> None:
+    """关闭数据库连接"""
+    self._conn.close()
+
+  @contextmanager
+  def transaction(self):
+    """
+    事务, 批量修改时使用, 全部成功才会提交
+    用法:
+      with record.transaction():
+        record.add_record(...)
+        record.update_record(...)
+    """
+    if self._in_transaction: # 支持嵌套, 由最外层事务提交
+      yield self
+      return
+    self._conn.execute("BEGIN IMMEDIATE")
+    self._in_transaction = True
+    try:
+      yield self
+    except BaseException:
+      self._conn.execute("ROLLBACK")
+      raise
+    else:
+      self._conn.execute("COMMIT")
+    finally:
+      self._in_transaction = False
+
   def add_record(self, key: str, value: dict) -> None:
     """
     添加一条记录
     """
-    data = self._read_file()
-    if key in data:
+    try:
+      self._conn.execute(
+        "INSERT INTO records (key, value) VALUES (?, ?)",
+        (key, json.dumps(value, ensure_ascii = False))
+      )
+    except sqlite3.IntegrityError:
       raise KeyError(f"记录 {key} 已存在")
-    data[key] = value
-    self._write_file(data)
-  
+
+  def add_records(self, records: dict) -> None:
+    """批量添加记录, 任意一条已存在时全部不添加"""
+    with self.transaction():
+      for key, value in records.items():
+        self.add_record(key, value)
+
   def update_record(self, key: str, value: dict) -> None:
     """更新一条记录"""
-    data = self._read_file()
-    if key not in data:
+    cursor = self._conn.execute(
+      "UPDATE records SET value = ? WHERE key = ?",
+      (json.dumps(value, ensure_ascii = False), key)
+    )
+    if cursor.rowcount == 0:
       raise KeyError(f"记录 {key} 不存在")
-    data[key] = value
-    self._write_file(data)
-  
+
+  def update_records(self, records: dict) -> None:
+    """批量更新记录, 任意一条不存在时全部不更新"""
+    with self.transaction():
+      for key, value in records.items():
+        self.update_record(key, value)
+
+  def upsert_record(self, key: str, value: dict) -> None:
+    """添加或覆盖一条记录"""
+    self._conn.execute(
+      "INSERT OR REPLACE INTO records (key, value) VALUES (?, ?)",
+      (key, json.dumps(value, ensure_ascii = False))
+    )
+
   def delete_record(self, key: str) -> None:
     """删除一条记录"""
-    data = self._read_file()
-    if key not in data:
+    cursor = self._conn.execute("DELETE FROM records WHERE key = ?", (key,))
+    if cursor.rowcount == 0:
       raise KeyError(f"记录 {key} 不存在")
-    del data[key]
-    self._write_file(data)
-  
+
   def get_record(self, key: str) -> dict:
     """获取一条记录"""
-    data = self._read_file()
-    if key not in data:
+    row = self._conn.execute("SELECT value FROM records WHERE key = ?", (key,)).fetchone()
+    if row is None:
       raise KeyError(f"记录 {key} 不存在")
-    return data[key]
-  
+    return json.loads(row[0])
+
+  def has_record(self, key: str) -> bool:
+    """判断记录是否存在"""
+    return self._conn.execute("SELECT 1 FROM records WHERE key = ?", (key,)).fetchone() is not None
+
   def list_records(self) -> dict:
     """列出所有记录"""
-    return self._read_file()
\ No newline at end of file
+    return {key: json.loads(value) for key, value in self._conn.execute("SELECT key, value FROM records")}
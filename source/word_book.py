@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# 生词本存储
+# 新记录只追加到 word_data.jsonl 中(每行一条记录), 不再每次重写整个 word_data.json
+# 追加日志超过一定大小后, 合并(compact)进 word_data.json 快照, 快照保持原来的 JSON 数组格式
+# 所有读写都在建议性文件锁内进行, 多个 ds 进程同时写入不会丢失记录
+
+import os
+import sys
+import json
+from utils import file_lock, read_json_array, write_json_atomic
+from config import DATA_DIR
+
+DEFAULT_DATA_FILE = os.path.join(DATA_DIR, "word_data.json")
+# 追加日志超过该大小(字节)时合并进快照
+COMPACT_BYTES = 1024 * 1024
+
+class Word_Book:
+  def __init__(self, data_file: str, compact_bytes: int = COMPACT_BYTES):
+    """
+    :param data_file: 快照文件路径, 即原来的 word_data.json
+    :param compact_bytes: 追加日志的合并阈值
+    """
+    self.data_file = data_file
+    self.log_file = os.path.splitext(data_file)[0] + ".jsonl"
+    self.lock_file = data_file + ".lock"
+    self.compact_bytes = compact_bytes
+
+  def append(self, record: dict) -> None:
+    """
+    追加一条记录
+    """
+    self.extend([record])
+
+  def extend(self, records: list) -> None:
+    """
+    一次追加多条记录, 只加锁和落盘一次
+    """
+    if not records:
+      return
+    lines = "".join(json.dumps(record, ensure_ascii = False) + "\n" for record in records)
+    with file_lock(self.lock_file):
+      with open(self.log_file, "a", encoding = "utf-8") as file:
+        file.write(lines)
+        file.flush()
+        os.fsync(file.fileno()) # 确保写入磁盘
+      if os.path.getsize(self.log_file) >= self.compact_bytes:
+        self._compact()
+
+  def compact(self) -> None:
+    """
+    将追加日志合并进快照
+    """
+    with file_lock(self.lock_file):
+      self._compact()
+
+  def records(self) -> list:
+    """
+    读取全部记录(快照 + 追加日志), 顺序与写入顺序一致
+    """
+    with file_lock(self.lock_file):
+      data = read_json_array(self.data_file)
+      for path in self._pending_logs():
+        data.extend(self._read_log(path))
+      return data
+
+  def export_json(self, path: str = None) -> str:
+    """
+    导出为原来的 JSON 数组格式
+    :param path: 导出路径, 默认先合并再直接使用快照文件
+    :return: 导出的文件路径
+    """
+    if path is None or os.path.abspath(path) == os.path.abspath(self.data_file):
+      self.compact()
+      return self.data_file
+    write_json_atomic(path, self.records())
+    return path
+
+  def _pending_logs(self) -> list:
+    """尚未合并进快照的日志文件, 包括上次合并中断留下的文件"""
+    compacting = self.log_file + ".compacting"
+    paths = []
+    if os.path.exists(compacting):
+      # 快照比 .compacting 新, 说明上次合并已经写完快照, 只是没来得及删除
+      if os.path.exists(self.data_file) and os.path.getmtime(self.data_file) > os.path.getmtime(compacting):
+        os.remove(compacting)
+      else:
+        paths.append(compacting)
+    if os.path.exists(self.log_file):
+      paths.append(self.log_file)
+    return paths
+
+  def _read_log(self, path: str) -> list:
+    """读取追加日志, 跳过进程崩溃时可能留下的不完整行"""
+    records = []
+    with open(path, "r", encoding = "utf-8") as file:
+      for line in file:
+        try:
+          records.append(json.loads(line))
+        except ValueError:
+          continue
+    return records
+
+  def _compact(self) -> None:
+    """合并追加日志, 调用方需要持有文件锁"""
+    compacting = self.log_file + ".compacting"
+    pending = self._pending_logs()
+    if not pending:
+      return
+    data = read_json_array(self.data_file)
+    for path in pending:
+      data.extend(self._read_log(path))
+    # 先把日志改名, 这样即使中途崩溃也能在下次合并时识别出来
+    if os.path.exists(self.log_file):
+      if os.path.exists(compacting):
+        with open(compacting, "a", encoding = "utf-8") as dst, open(self.log_file, "r", encoding = "utf-8") as src:
+          dst.write(src.read())
+        os.remove(self.log_file)
+      else:
+        os.replace(self.log_file, compacting)
+    write_json_atomic(self.data_file, data)
+    os.remove(compacting)
+
+def main():
+  """
+  导出生词本为 JSON 数组格式
+  用法: python word_book.py [导出路径], 不指定路径时合并进 data/word_data.json
+  """
+  path = sys.argv[1] if len(sys.argv) > 1 else None
+  print(f"生词本已导出到 {Word_Book(DEFAULT_DATA_FILE).export_json(path)}")
+
+if __name__ == "__main__":
+  main()
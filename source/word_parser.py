@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# 单词解释(explain_word)回答的增量解析
+# 以前在流式输出结束后用一个多分组的正则匹配整段回答, 格式稍有变化(全角冒号、加粗、序号、字段名略有不同、
+# 少了一项或者多了一句结束语)就整条不匹配, 这个单词也就不会写入生词本
+#
+# 这里按字段名(及其常见的变体)加冒号识别每个字段的开始, 下一个字段开始时上一个字段就确定了:
+#   - 每收到一段内容只检查新增的部分(以及末尾可能被截断的字段名), 回答结束时只需要确定最后一个字段
+#   - 字段名可以在行首或行中, 前面可以有序号、列表符号或 ** 加粗, 冒号可以是全角或半角
+#   - 缺少的字段留空, 只要识别出任意一个字段就返回记录(部分记录), 一个都没有时再尝试按 JSON 解析
+# 语料和基准测试见 word_corpus.jsonl 和 python bench.py words
+
+import re
+import json
+
+# 生词本记录中的字段, 与回答中的顺序一致
+WORD_FIELDS = ("closest_chinese", "slang_or_usage", "context", "example")
+# 字段名 -> 字段, 同一字段的变体中较长的放在前面
+FIELD_MARKERS = {
+  "最接近的中文解释": "closest_chinese",
+  "最接近的中文意思": "closest_chinese",
+  "中文释义": "closest_chinese",
+  "中文解释": "closest_chinese",
+  "作为俚语或日常用法": "slang_or_usage",
+  "作为俚语/日常用法": "slang_or_usage",
+  "俚语或日常用法": "slang_or_usage",
+  "俚语/日常用法": "slang_or_usage",
+  "日常用法": "slang_or_usage",
+  "常用语境": "context",
+  "常见语境": "context",
+  "使用语境": "context",
+  "语境": "context",
+  "造句": "example",
+  "例句": "example"
+}
+# 字段名后面紧跟冒号才算字段的开始, 正文中出现"语境"等词不会被误认
+MARKER_PATTERN = re.compile(
+  "(?P<marker>" + "|".join(re.escape(marker) for marker in sorted(FIELD_MARKERS, key = len, reverse = True)) + ")"
+  r"(?:\*\*)?[ \t]{0,3}[:：]"
+)
+# 新内容到来时向前多检查的字符数, 覆盖被分在两段中的字段名
+LOOKBACK = max(map(len, FIELD_MARKERS)) + 8
+# 字段内容首尾需要去掉的内容: 模型照抄的 <ans1> 占位符, 列表符号, 以及下一个字段之前的序号
+PLACEHOLDER_PATTERN = re.compile(r"<ans\d>")
+LEADING_PATTERN = re.compile(r"^[\-•>][ \t]*")
+TRAILING_PATTERN = re.compile(r"\n[ \t]*(?:\d+[.、)）]|[\-•#>]+)[ \t]*$")
+PARAGRAPH_PATTERN = re.compile(r"\n[ \t]*\n")
+
+def _strip(value: str) -> str:
+  return value.strip().strip("*").strip()
+
+def clean_value(value: str, last: bool = False) -> str:
+  """
+  整理一个字段的内容
+  :param last: 是否为回答中的最后一个字段, 最后一个字段只取到第一个空行为止, 之后通常是模型添加的结束语
+  """
+  value = _strip(PLACEHOLDER_PATTERN.sub("", value))
+  if last:
+    value = PARAGRAPH_PATTERN.split(value, 1)[0]
+  value = TRAILING_PATTERN.sub("", LEADING_PATTERN.sub("", _strip(value)))
+  return _strip(value)
+
+class Word_Parser:
+  def __init__(self):
+    """
+    增量解析一条单词解释, 流式传输时每收到一段内容调用 feed, 结束时调用 close
+    """
+    self.text = ""
+    self.fields = {} # 已经确定的字段
+    self.closed = False
+    self._current = None # (正在接收的字段, 内容的起始位置)
+    self._scan = 0 # 在此之前的内容已经检查过
+
+  def feed(self, chunk: str) -> None:
+    """收到一段内容"""
+    start = max(self._scan, len(self.text) - LOOKBACK)
+    self.text += chunk
+    for match in MARKER_PATTERN.finditer(self.text, start):
+      field = FIELD_MARKERS[match.group("marker")]
+      # 同一个字段只取第一次出现的位置, 之后再出现的字段名作为内容
+      if field in self.fields or (self._current is not None and self._current[0] == field):
+        continue
+      if self._current is not None:
+        current, value_start = self._current
+        self.fields[current] = clean_value(self.text[value_start:match.start()])
+      self._current = (field, match.end())
+      self._scan = match.end()
+
+  def close(self) -> dict:
+    """
+    回答结束, 确定最后一个字段
+    :return: 识别出的字段
+    """
+    if self.closed:
+      return self.fields
+    self.closed = True
+    if self._current is not None:
+      current, value_start = self._current
+      self.fields[current] = clean_value(self.text[value_start:], last = True)
+      self._current = None
+    elif not self.fields:
+      self.fields = parse_json_fields(self.text)
+    # 只有字段名没有内容的字段视为缺少
+    self.fields = {field: value for field, value in self.fields.items() if value}
+    return self.fields
+
+  @property
+  def missing(self) -> list:
+    """缺少的字段"""
+    return [field for field in WORD_FIELDS if not self.fields.get(field)]
+
+  def record(self, word: str, request_time: str) -> dict:
+    """
+    生词本记录, 缺少的字段为空字符串
+    :return: 一个字段都没有识别出时返回 None
+    """
+    fields = self.close()
+    if not fields:
+      return None
+    record = {"word": word}
+    record.update({field: fields.get(field, "") for field in WORD_FIELDS})
+    record["time"] = request_time
+    return record
+
+def extract_json(text: str):
+  """
+  从回答中取出 JSON, 允许前后有多余的文字或者 ``` 代码块标记
+  :return: 解析结果, 失败时返回 None
+  """
+  text = re.sub(r"^\s*```(?:json)?|```\s*$", "", text.strip())
+  try:
+    return json.loads(text)
+  except ValueError:
+    pass
+  start, end = text.find("{"), text.rfind("}")
+  if start < 0 or end <= start:
+    return None
+  try:
+    return json.loads(text[start:end + 1])
+  except ValueError:
+    return None
+
+def parse_json_fields(text: str) -> dict:
+  """回答是 JSON 时(例如模型自行改用了 JSON 输出)直接取出字段"""
+  if "{" not in text:
+    return {}
+  data = extract_json(text)
+  if isinstance(data, dict) and isinstance(data.get("items"), list) and data["items"]:
+    data = data["items"][0]
+  if not isinstance(data, dict):
+    return {}
+  return {field: " ".join(str(data[field]).split()) for field in WORD_FIELDS if data.get(field)}
+
+def parse_word(answer: str) -> Word_Parser:
+  """一次性解析完整的回答"""
+  parser = Word_Parser()
+  parser.feed(answer)
+  parser.close()
+  return parser
+
+def main():
+  print("word_parser主程序已运行!")
+
+if __name__ == "__main__":
+  main()
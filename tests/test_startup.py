@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+# 入口文件的导入耗时检查, 与 python source/bench.py startup 使用相同的预算和重量级模块列表
+# ds -h 和命中缓存的路径上不应该导入 asyncio、openai 等模块, 导入耗时超出预算时测试失败
+
+import os
+import sys
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "source")
+sys.path.insert(0, SOURCE_DIR)
+
+from bench import measure_import, HEAVY_MODULES, STARTUP_BUDGET_MS
+
+def test_import_main_within_budget(tmp_path, monkeypatch):
+  # 导入时可能创建数据目录, 放在临时目录中
+  monkeypatch.setenv("DS_DATA_DIR", str(tmp_path))
+  result = measure_import("main")
+  assert result["import_ms"] <= STARTUP_BUDGET_MS, f"导入 main 耗时 {result['import_ms']}毫秒, 超出预算 {STARTUP_BUDGET_MS}毫秒: {result['slowest']}"
+  assert not result["heavy_modules"], f"导入 main 时加载了重量级模块: {result['heavy_modules']} (检查的模块: {HEAVY_MODULES})"